@@ -1,11 +1,301 @@
-from transformers import AutoTokenizer, AutoModelForCausalLM
+import argparse
+import fnmatch
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
 
 MODEL_ID = "Qwen/Qwen2.5-7B-Instruct"
+MANIFEST = "manifest.json"
+CHUNK = 1 << 20
 
-print("Downloading tokenizer...")
-AutoTokenizer.from_pretrained(MODEL_ID, use_fast=True)
 
-print("Downloading model weights (this is large)...")
-AutoModelForCausalLM.from_pretrained(MODEL_ID)
+def hub_cache() -> Path:
+    """Where from_pretrained looks for hub downloads (HF_HUB_CACHE, else HF_HOME/hub, else ~/.cache/huggingface/hub)."""
+    if os.environ.get("HF_HUB_CACHE"):
+        return Path(os.environ["HF_HUB_CACHE"])
+    return Path(os.environ.get("HF_HOME", Path.home() / ".cache" / "huggingface")) / "hub"
 
-print("DONE. Model is now in your Hugging Face cache.")
+
+def cache_repo(model_id: str) -> Path:
+    return hub_cache() / ("models--" + model_id.replace("/", "--"))
+
+
+def request(url: str, token: str = "", headers: dict = None):
+    req = urllib.request.Request(url, headers=dict(headers or {}, **{"User-Agent": "learnbuddy-download/1.0"}))
+    if token:
+        req.add_header("Authorization", f"Bearer {token}")
+    return urllib.request.urlopen(req, timeout=60)
+
+
+def fetch_manifest(endpoint: str, model_id: str, revision: str, token: str) -> dict:
+    """Commit sha and file list (size + checksum) for one revision, from the hub's model API."""
+    url = f"{endpoint}/api/models/{model_id}/revision/{urllib.parse.quote(revision, safe='')}?blobs=true"
+    with request(url, token) as r:
+        info = json.loads(r.read().decode("utf-8"))
+    files = []
+    for s in info.get("siblings", []):
+        entry = {"path": s["rfilename"], "size": s.get("size")}
+        if s.get("lfs"):
+            entry.update(size=s["lfs"]["size"], sha256=s["lfs"]["sha256"])
+        elif s.get("blobId"):
+            entry["git_sha1"] = s["blobId"]
+        files.append(entry)
+    return {"model": model_id, "revision": revision, "sha": info["sha"], "files": files}
+
+
+def select(files, include, exclude):
+    keep = [f for f in files if not include or any(fnmatch.fnmatch(f["path"], p) for p in include)]
+    return [f for f in keep if not any(fnmatch.fnmatch(f["path"], p) for p in exclude)]
+
+
+def checksum_error(path: Path, entry: dict):
+    """None when `path` matches the manifest entry's size and sha256 (LFS) or git blob sha1, else why not."""
+    size = path.stat().st_size
+    if entry.get("size") is not None and size != entry["size"]:
+        return f"size {size} != {entry['size']}"
+    if "sha256" in entry:
+        h, want = hashlib.sha256(), entry["sha256"]
+    elif "git_sha1" in entry:
+        h, want = hashlib.sha1(), entry["git_sha1"]
+        h.update(f"blob {size}\0".encode("utf-8"))
+    else:
+        return None
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(8 * CHUNK), b""):
+            h.update(block)
+    return None if h.hexdigest() == want else f"checksum {h.hexdigest()[:12]}.. != {want[:12]}.."
+
+
+class Progress:
+    def __init__(self, total: int):
+        self.total = total
+        self.done = 0
+        self.resumed = 0
+        self.lock = threading.Lock()
+        self.t0 = time.perf_counter()
+
+    def add(self, n: int):
+        with self.lock:
+            self.done += n
+
+    def mb_s(self) -> float:
+        return self.done / 2**20 / max(1e-9, time.perf_counter() - self.t0)
+
+
+def download_file(url: str, dest: Path, entry: dict, token: str, retries: int, progress: Progress) -> dict:
+    """
+    Streams `url` into <dest>.incomplete, resuming with a byte Range from
+    whatever a previous attempt left there, then verifies and renames.
+    A server that ignores Range (200 instead of 206) restarts the file.
+    """
+    part = dest.with_name(dest.name + ".incomplete")
+    part.parent.mkdir(parents=True, exist_ok=True)
+    t0 = time.perf_counter()
+    fetched, resumed_from = 0, part.stat().st_size if part.exists() else 0
+    for attempt in range(retries + 1):
+        have = part.stat().st_size if part.exists() else 0
+        if entry.get("size") is not None and have > entry["size"]:
+            part.unlink()
+            have = 0
+        try:
+            headers = {"Range": f"bytes={have}-"} if have else {}
+            with request(url, token, headers) as r:
+                resume = have and r.status == 206
+                length = r.headers.get("Content-Length")
+                expected = (have if resume else 0) + int(length) if length is not None else entry.get("size")
+                with open(part, "ab" if resume else "wb") as f:
+                    for block in iter(lambda: r.read(CHUNK), b""):
+                        f.write(block)
+                        fetched += len(block)
+                        progress.add(len(block))
+            if expected is not None and part.stat().st_size < expected:
+                raise ConnectionError(f"connection closed at {part.stat().st_size} of {expected} bytes")
+            break
+        except urllib.error.HTTPError as e:
+            if e.code == 416 and have:  # range past the end: the part file is already complete
+                break
+            if e.code in (401, 403, 404) or attempt == retries:
+                raise
+        except (urllib.error.URLError, ConnectionError, TimeoutError, OSError):
+            if attempt == retries:
+                raise
+        time.sleep(min(30, 2 ** attempt))
+    err = checksum_error(part, entry)
+    if err:
+        part.unlink()
+        raise RuntimeError(f"{err}; the partial file was removed, re-run to fetch it again.")
+    os.replace(part, dest)
+    seconds = time.perf_counter() - t0
+    with progress.lock:
+        progress.resumed += resumed_from
+    return {"path": entry["path"], "bytes": fetched, "resumed_from": resumed_from, "seconds": round(seconds, 2),
+            "mb_s": round(fetched / 2**20 / max(1e-9, seconds), 1)}
+
+
+def copy_file(src: Path, dest: Path, entry: dict, progress: Progress) -> dict:
+    """Copies one file out of (or into) a mirror through a temp name, verifying the copy."""
+    t0 = time.perf_counter()
+    tmp = dest.with_name(dest.name + ".incomplete")
+    tmp.parent.mkdir(parents=True, exist_ok=True)
+    shutil.copyfile(src, tmp)
+    err = checksum_error(tmp, entry)
+    if err:
+        tmp.unlink()
+        raise RuntimeError(f"copy from {src}: {err}")
+    os.replace(tmp, dest)
+    size = dest.stat().st_size
+    progress.add(size)
+    seconds = time.perf_counter() - t0
+    return {"path": entry["path"], "bytes": size, "seconds": round(seconds, 2),
+            "mb_s": round(size / 2**20 / max(1e-9, seconds), 1)}
+
+
+def run_parallel(jobs, workers: int):
+    """Runs (label, fn) jobs on a thread pool, printing each as it finishes; raises after all have run."""
+    results, errors = [], []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(fn): label for label, fn in jobs}
+        for fut in as_completed(futures):
+            label = futures[fut]
+            try:
+                res = fut.result()
+                results.append(res)
+                print(f"  {label}: {res['bytes'] / 2**20:.1f} MB in {res['seconds']}s ({res['mb_s']} MB/s)")
+            except Exception as e:  # noqa: BLE001 - report every failed file, not just the first
+                errors.append(f"{label}: {e}")
+    if errors:
+        raise RuntimeError("Failed:\n  " + "\n  ".join(errors))
+    return results
+
+
+def mirror_dir(mirror: str, model_id: str) -> Path:
+    return Path(mirror) / model_id
+
+
+def mirror_manifest(mirror: str, model_id: str, revision: str):
+    """The mirror's manifest for `revision` (a commit sha, or a branch/tag recorded under refs/), or None."""
+    root = mirror_dir(mirror, model_id)
+    ref = root / "refs" / revision
+    sha = ref.read_text(encoding="utf-8").strip() if ref.exists() else revision
+    path = root / sha / MANIFEST
+    return json.loads(path.read_text(encoding="utf-8")) if path.exists() else None
+
+
+def publish(snapshot: Path, manifest: dict, mirror: str, workers: int) -> dict:
+    """Copies a verified snapshot into <mirror>/<model>/<sha>/; the manifest is written last, so readers never see half a copy."""
+    root = mirror_dir(mirror, manifest["model"])
+    dest = root / manifest["sha"]
+    todo = [e for e in manifest["files"]
+            if not ((dest / e["path"]).exists() and (dest / e["path"]).stat().st_size == e["size"])]
+    print(f"Publishing {len(todo)} files to {dest}")
+    progress = Progress(sum(e["size"] or 0 for e in todo))
+    run_parallel([(e["path"], lambda e=e: copy_file(snapshot / e["path"], dest / e["path"], e, progress))
+                  for e in todo], workers)
+    (dest / MANIFEST).write_text(json.dumps(manifest, indent=2), encoding="utf-8")
+    if manifest["revision"] != manifest["sha"]:
+        (root / "refs").mkdir(parents=True, exist_ok=True)
+        (root / "refs" / manifest["revision"]).write_text(manifest["sha"], encoding="utf-8")
+    return {"mirror": str(dest), "files_copied": len(todo), "mb": round(progress.done / 2**20, 1)}
+
+
+def main():
+    p = argparse.ArgumentParser(description="Download a hub model: parallel, resumable, checksummed, mirror-aware.")
+    p.add_argument("--model", type=str, default=MODEL_ID)
+    p.add_argument("--revision", type=str, default="main")
+    p.add_argument("--endpoint", type=str, default=os.environ.get("HF_ENDPOINT", "https://huggingface.co"))
+    p.add_argument("--local_dir", type=str, default="",
+                   help="Plain directory to download into; default: the Hugging Face cache, so "
+                        "from_pretrained(<model id>) finds the files offline.")
+    p.add_argument("--mirror", type=str, default="",
+                   help="Filesystem mirror (e.g. NFS). Files are copied from it when it has the revision.")
+    p.add_argument("--publish", action="store_true", help="After downloading, copy the snapshot into --mirror (whole revisions only: "
+                        "not with --include/--exclude).")
+    p.add_argument("--offline", action="store_true", help="Only use --mirror; never contact the endpoint.")
+    p.add_argument("--workers", type=int, default=8, help="Files fetched concurrently.")
+    p.add_argument("--retries", type=int, default=5)
+    p.add_argument("--include", type=str, nargs="*", default=[], help="Glob patterns to keep (default: all files).")
+    p.add_argument("--exclude", type=str, nargs="*", default=[], help="Glob patterns to skip.")
+    p.add_argument("--verify", action="store_true", help="Re-check checksums of files already present.")
+    args = p.parse_args()
+
+    token = os.environ.get("HF_TOKEN", "")
+    endpoint = args.endpoint.rstrip("/")
+    if args.offline and not args.mirror:
+        p.error("--offline needs --mirror")
+    if args.publish and not args.mirror:
+        p.error("--publish needs --mirror")
+    if args.publish and (args.include or args.exclude):
+        # the mirror entry stands for the whole revision; a filtered copy would be served as complete
+        p.error("--publish copies whole revisions; drop --include/--exclude")
+
+    t0 = time.perf_counter()
+    manifest = mirror_manifest(args.mirror, args.model, args.revision) if args.mirror else None
+    source = "mirror" if manifest else "endpoint"
+    if manifest is None:
+        if args.offline:
+            raise FileNotFoundError(f"{args.model}@{args.revision} is not in mirror {args.mirror}")
+        manifest = fetch_manifest(endpoint, args.model, args.revision, token)
+    files = select(manifest["files"], args.include, args.exclude)
+
+    if args.local_dir:
+        snapshot = Path(args.local_dir)
+    else:
+        repo = cache_repo(args.model)
+        snapshot = repo / "snapshots" / manifest["sha"]
+        if args.revision != manifest["sha"]:
+            (repo / "refs").mkdir(parents=True, exist_ok=True)
+            (repo / "refs" / args.revision).write_text(manifest["sha"], encoding="utf-8")
+    snapshot.mkdir(parents=True, exist_ok=True)
+
+    todo, present = [], 0
+    for e in files:
+        dest = snapshot / e["path"]
+        if dest.exists() and (e["size"] is None or dest.stat().st_size == e["size"]) and \
+                not (args.verify and checksum_error(dest, e)):
+            present += 1
+            continue
+        todo.append(e)
+    print(f"{args.model}@{manifest['sha'][:12]} from {source}: {len(files)} files, {present} already present, "
+          f"{len(todo)} to fetch ({sum(e['size'] or 0 for e in todo) / 2**30:.2f} GB) into {snapshot}")
+
+    progress = Progress(sum(e["size"] or 0 for e in todo))
+    if source == "mirror":
+        src = mirror_dir(args.mirror, args.model) / manifest["sha"]
+        jobs = [(e["path"], lambda e=e: copy_file(src / e["path"], snapshot / e["path"], e, progress)) for e in todo]
+    else:
+        base = f"{endpoint}/{args.model}/resolve/{manifest['sha']}/"
+        jobs = [(e["path"], lambda e=e: download_file(base + urllib.parse.quote(e["path"]), snapshot / e["path"],
+                                                      e, token, args.retries, progress)) for e in todo]
+    results = run_parallel(jobs, args.workers)
+    wall = time.perf_counter() - t0
+
+    report = {
+        "model": args.model,
+        "revision": args.revision,
+        "sha": manifest["sha"],
+        "source": source,
+        "path": str(snapshot),
+        "files": len(files),
+        "fetched": len(results),
+        "already_present": present,
+        "mb": round(progress.done / 2**20, 1),
+        "resumed_mb": round(progress.resumed / 2**20, 1),
+        "wall_s": round(wall, 2),
+        "mb_s": round(progress.done / 2**20 / max(1e-9, wall), 1),
+        "slowest": sorted(results, key=lambda r: -r["seconds"])[:3],
+    }
+    if args.publish and source == "endpoint":
+        report["publish"] = publish(snapshot, manifest, args.mirror, args.workers)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,261 @@
+"""
+One entry point for the whole toolkit:
+
+    python learnbuddy.py <command> <target> [script args...]
+
+Each target is an existing script, run with runpy exactly as if it had been
+started directly, so its flags, --help and subcommands are unchanged; a
+script without argparse refuses arguments instead of ignoring them. Only the
+stdlib is imported here; torch, transformers, peft and bitsandbytes are
+imported by the target script when it runs, never for the command and target
+listings, which are read from the scripts' source.
+`python learnbuddy.py selfcheck` measures each target's module-level import
+time and its `--help` time in fresh interpreters and fails when one is over
+budget.
+"""
+import ast
+import json
+import re
+import runpy
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent
+
+CHAPTER_DIRS = {
+    "algebraic_fractions": ("algebraic-fractions", "algebraic"),
+    "arithmetic": ("arithmetic", "arithmetic"),
+    "growth_depreciation": ("growth-n-depreciation", "growth_depr"),
+    "probability": ("probability", "probability"),
+    "quadratic_equations": ("quadratic-equations", "quadratic"),
+    "sequence_series": ("sequence-n-series", "sequence_series"),
+}
+
+COMMANDS = {
+    "generate": {
+        "algebraic_fractions": "generic-generators/algebraic-fractions.py",
+        "arithmetic": "generic-generators/arithmetic.py",
+        "growth_depreciation": "generic-generators/growth-n-depriciation.py",
+        "probability": "generic-generators/probability.py",
+        "quadratic_equations": "generic-generators/quadratic-equations.py",
+        "quadratic_word": "generic-generators/quadratic-equation-word.py",
+        "sequence_series": "generic-generators/sequence-n-series.py",
+        "router": "routing/question_generator.py",
+    },
+    "prepare": dict({c: f"scripts/{d}/prepare_data.py" for c, (d, _) in CHAPTER_DIRS.items()},
+                    router="routing/prepare_data.py"),
+    "train": dict({c: f"scripts/{d}/train_lora_{n}.py" for c, (d, n) in CHAPTER_DIRS.items()},
+                  router="routing/train_router_lora.py", router_head="routing/train_router_head.py",
+                  autotune="scripts/autotune.py"),
+    "test": dict({c: f"scripts/{d}/test_{n}_adapter.py" for c, (d, n) in CHAPTER_DIRS.items()},
+                 router="routing/test_router.py", base="scripts/quick_infer.py"),
+    "route": {
+        "file": "routing/route_file.py",
+        "prerouter": "routing/prerouter.py",
+    },
+    "serve": {
+        "engine": "serving/engine.py",
+        "server": "serving/server.py",
+        "daemon": "serving/daemon.py",
+        "client": "serving/daemon_client.py",
+        "cpu_int8": "serving/cpu_int8.py",
+        "json_stream": "serving/json_stream.py",
+    },
+    "bench": {
+        "matrix": "serving/bench_matrix.py",
+        "router": "routing/bench_router.py",
+        "adapter_cache": "serving/bench_adapter_cache.py",
+        "constrained": "serving/bench_constrained.py",
+        "json_stop": "serving/bench_json_stop.py",
+        "mixed": "serving/bench_mixed.py",
+        "scheduler": "serving/bench_scheduler.py",
+        "speculative": "serving/bench_speculative.py",
+        "cpu_int8": "serving/bench_cpu_int8.py",
+        "loadgen": "serving/loadgen.py",
+    },
+    "export": {
+        "quantized": "serving/export_quantized.py",
+        "merged": "serving/export_merged.py",
+        "reduce_rank": "serving/reduce_rank.py",
+    },
+    "download": "download_model.py",
+}
+
+# seconds of module-level imports allowed per target; data commands must not pull in the ML stack
+BUDGETS = {"generate": 0.5, "prepare": 0.5, "download": 0.5, "test": 0.5,
+           "route": 15.0, "train": 15.0, "serve": 15.0, "bench": 15.0, "export": 15.0}
+# quick_infer.py loads the base model at import
+TARGET_BUDGETS = {"test base": 15.0}
+# `learnbuddy.py <command> <target> --help` may take the target's import budget plus this (interpreter start)
+HELP_BUDGET = 0.5
+HEAVY = ("torch", "transformers", "peft", "bitsandbytes", "datasets")
+
+USAGE = "usage: python learnbuddy.py <command> [target] [script args...]"
+
+
+def describe(path: str) -> str:
+    """
+    One line for target listings, read from the source without importing it:
+    the first line of the module docstring, else the argparse description,
+    else the path.
+    """
+    text = (ROOT / path).read_text(encoding="utf-8")
+    doc = ast.get_docstring(ast.parse(text))
+    if doc:
+        return f"{doc.strip().splitlines()[0]}  [{path}]"
+    m = re.search(r"ArgumentParser\(\s*(?:description=)?\s*\"([^\"]+)\"", text)
+    return f"{m.group(1).strip()}  [{path}]" if m else path
+
+
+def has_flags(path: str) -> bool:
+    """Whether the script parses its own command line (and so answers --help itself)."""
+    return "ArgumentParser(" in (ROOT / path).read_text(encoding="utf-8")
+
+
+def run_target(words: str, path: str, argv) -> int:
+    """
+    Scripts with argparse get every argument, --help included, so their own
+    parser (subcommands too) answers. A flagless script would just start
+    working, so --help prints its description here and other arguments are
+    refused.
+    """
+    if has_flags(path):
+        run_script(path, argv)
+        return 0
+    if any(a in ("-h", "--help") for a in argv):
+        print(f"usage: python learnbuddy.py {words}\n\n{describe(path)}\n\nThis script takes no arguments.")
+        return 0
+    if argv:
+        print(f"usage: python learnbuddy.py {words}\n{words}: this script takes no arguments "
+              f"(got {' '.join(argv)})", file=sys.stderr)
+        return 2
+    run_script(path, argv)
+    return 0
+
+
+def print_commands():
+    print(USAGE)
+    print("\ncommands:")
+    for cmd, targets in COMMANDS.items():
+        names = "" if isinstance(targets, str) else " | ".join(targets)
+        print(f"  {cmd:<10} {names}")
+    print(f"  {'selfcheck':<10} import time per target vs budget ([command ...] [--json])")
+    print("\n`python learnbuddy.py <command>` lists its targets; flags after the target go to the script.")
+
+
+def print_targets(cmd: str):
+    print(f"usage: python learnbuddy.py {cmd} <target> [script args...]\n\ntargets:")
+    for name, path in COMMANDS[cmd].items():
+        print(f"  {name:<20} {describe(path)}")
+
+
+def run_script(path: str, argv):
+    """Runs a repo script as __main__ with its own argv and import path, as `python <path>` would."""
+    script = ROOT / path
+    sys.argv = [str(script)] + list(argv)
+    sys.path.insert(0, str(script.parent))
+    runpy.run_path(str(script), run_name="__main__")
+
+
+def import_prefix(path: str) -> str:
+    """Source of the script's top-level statements up to its last import (path setup included, work excluded)."""
+    tree = ast.parse((ROOT / path).read_text(encoding="utf-8"))
+    last = max((i for i, node in enumerate(tree.body) if isinstance(node, (ast.Import, ast.ImportFrom))), default=-1)
+    return ast.unparse(ast.Module(body=tree.body[:last + 1], type_ignores=[]))
+
+
+PROBE = """
+import json, sys, time
+path, src = sys.argv[1], sys.argv[2]
+sys.path.insert(0, str(__import__("pathlib").Path(path).parent))
+t0 = time.perf_counter()
+exec(compile(src, path, "exec"), {"__file__": path, "__name__": "learnbuddy_selfcheck"})
+print(json.dumps({"import_s": time.perf_counter() - t0, "heavy": [m for m in %r if m in sys.modules]}))
+"""
+
+
+def measure(path: str) -> dict:
+    """Module-level import time of one script, in a fresh interpreter started from the repo root."""
+    proc = subprocess.run([sys.executable, "-c", PROBE % (HEAVY,), str(ROOT / path), import_prefix(path)],
+                          cwd=ROOT, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    if proc.returncode != 0:
+        err = [ln for ln in proc.stderr.splitlines() if ln.strip()]
+        return {"error": err[-1] if err else f"exit code {proc.returncode}"}
+    res = json.loads(proc.stdout.strip().splitlines()[-1])
+    return {"import_s": round(res["import_s"], 3), "heavy": res["heavy"]}
+
+
+def measure_help(words) -> dict:
+    """Wall time and heavy imports of `learnbuddy.py <words> --help` in a fresh interpreter."""
+    t0 = time.perf_counter()
+    proc = subprocess.run([sys.executable, "-X", "importtime", str(ROOT / "learnbuddy.py"), *words, "--help"],
+                          cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    wall = time.perf_counter() - t0
+    own = [ln.split("|")[-1].strip() for ln in proc.stderr.splitlines() if "|" in ln]
+    return {"help_s": round(wall, 3), "help_heavy": [m for m in HEAVY if m in own], "help_exit": proc.returncode}
+
+
+def selfcheck(argv) -> int:
+    """Measures every target (or the commands given) and returns 1 when any is over budget or fails to import."""
+    as_json = "--json" in argv
+    wanted = [a for a in argv if not a.startswith("-")] or list(COMMANDS)
+    unknown = [c for c in wanted if c not in COMMANDS]
+    if unknown:
+        print(f"unknown command(s) {', '.join(unknown)}; choose from {', '.join(COMMANDS)}", file=sys.stderr)
+        return 2
+    cli = subprocess.run([sys.executable, "-X", "importtime", str(ROOT / "learnbuddy.py"), "--help"],
+                         stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    own = [ln.split("|")[-1].strip() for ln in cli.stderr.splitlines() if "|" in ln]
+    rows = [{"target": "learnbuddy --help", "heavy": [m for m in HEAVY if m in own], "budget_s": None}]
+    failed = bool(rows[0]["heavy"])
+    for cmd in wanted:
+        targets = COMMANDS[cmd]
+        for name, path in ({cmd: targets} if isinstance(targets, str) else targets).items():
+            target = f"{cmd} {name}" if name != cmd else cmd
+            budget = TARGET_BUDGETS.get(target, BUDGETS[cmd])
+            res = dict(target=target, budget_s=budget, **measure(path), **measure_help(target.split()))
+            res["ok"] = ("error" not in res and res["import_s"] <= budget
+                         and res["help_exit"] == 0 and res["help_s"] <= budget + HELP_BUDGET)
+            failed |= not res["ok"]
+            rows.append(res)
+            if not as_json:
+                status = "ok  " if res["ok"] else "FAIL"
+                detail = res.get("error") or f"{res['import_s']:.3f}s / {budget}s"
+                heavy = ", ".join(res.get("heavy", [])) or "-"
+                helped = f"--help {res['help_s']:.3f}s / {budget + HELP_BUDGET}s" + (
+                    f" imports {', '.join(res['help_heavy'])}" if res["help_heavy"] else "")
+                print(f"{status} {res['target']:<32} {detail:<20} heavy: {heavy:<32} {helped}")
+    if as_json:
+        print(json.dumps(rows, indent=2))
+    elif rows[0]["heavy"]:
+        print(f"FAIL learnbuddy --help imports {', '.join(rows[0]['heavy'])}")
+    return 1 if failed else 0
+
+
+def main(argv=None) -> int:
+    argv = list(sys.argv[1:] if argv is None else argv)
+    if not argv or argv[0] in ("-h", "--help"):
+        print_commands()
+        return 0
+    cmd, rest = argv[0], argv[1:]
+    if cmd == "selfcheck":
+        return selfcheck(rest)
+    if cmd not in COMMANDS:
+        print(f"{USAGE}\nunknown command '{cmd}'; choose from {', '.join(COMMANDS)}, selfcheck", file=sys.stderr)
+        return 2
+    targets = COMMANDS[cmd]
+    if isinstance(targets, str):
+        return run_target(cmd, targets, rest)
+    if not rest or rest[0] in ("-h", "--help"):
+        print_targets(cmd)
+        return 0
+    if rest[0] not in targets:
+        print(f"unknown {cmd} target '{rest[0]}'; choose from {', '.join(targets)}", file=sys.stderr)
+        return 2
+    return run_target(f"{cmd} {rest[0]}", targets[rest[0]], rest[1:])
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,93 @@
+import argparse
+import json
+import statistics
+import time
+from pathlib import Path
+
+import torch
+
+from router_scoring import load_model, label_candidates, route, route_batch, build_prefix_cache
+
+RAW_PATH = Path("data/routing/raw/routing_raw.jsonl")
+
+DEFAULT_QUESTIONS = [
+    "Find the compound interest on Rs 5000 at 10% for 2 years.",
+    "Solve: x^2 - 7x + 10 = 0",
+    "Simplify: (x^2 - 9)/(x - 3)",
+    "Find the 10th term of 3, 7, 11, ...",
+    "A die is rolled. Find P(even).",
+    "What is the capital of France?",
+]
+
+
+def short_questions(n: int, max_words: int):
+    if not RAW_PATH.exists():
+        return DEFAULT_QUESTIONS
+    qs = []
+    with RAW_PATH.open("r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            q = json.loads(line)["question"]
+            if len(q.split()) <= max_words:
+                qs.append(q)
+            if len(qs) >= n:
+                break
+    return qs or DEFAULT_QUESTIONS
+
+
+def time_per_question(fn, questions, warmup: int = 2):
+    for q in questions[:warmup]:
+        fn(q)
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+    times = []
+    for q in questions:
+        t0 = time.perf_counter()
+        fn(q)
+        if torch.cuda.is_available():
+            torch.cuda.synchronize()
+        times.append((time.perf_counter() - t0) * 1000)
+    return times
+
+
+def report(name: str, times):
+    times = sorted(times)
+    p90 = times[min(len(times) - 1, int(round(0.9 * (len(times) - 1))))]
+    print(f"{name:<28} median {statistics.median(times):8.1f} ms   p90 {p90:8.1f} ms")
+    return statistics.median(times)
+
+
+def main():
+    p = argparse.ArgumentParser(description="Time-to-label for short questions across router modes.")
+    p.add_argument("--base_model", type=str, default="Qwen/Qwen2.5-7B-Instruct")
+    p.add_argument("--adapter", type=str, required=True)
+    p.add_argument("--device", type=str, default="cuda", choices=["cuda", "cpu"])
+    p.add_argument("--n", type=int, default=50)
+    p.add_argument("--max_words", type=int, default=15)
+    args = p.parse_args()
+
+    if args.device == "cuda" and not torch.cuda.is_available():
+        raise RuntimeError("CUDA not available but --device=cuda was set.")
+
+    model, tokenizer = load_model(args.base_model, args.adapter, args.device)
+    candidates = label_candidates(tokenizer)
+    prefix = build_prefix_cache(model, tokenizer)
+    questions = short_questions(args.n, args.max_words)
+    print(f"{len(questions)} questions, <= {args.max_words} words\n")
+
+    gen_ms = report("generate", time_per_question(
+        lambda q: route(model, tokenizer, q, max_new_tokens=6, temperature=0.0), questions))
+    full_ms = report("score (full prefill)", time_per_question(
+        lambda q: route_batch(model, tokenizer, [q], batch_size=1, candidates=candidates), questions))
+    if prefix is not None:
+        cached_ms = report("score (prefix cache)", time_per_question(
+            lambda q: route_batch(model, tokenizer, [q], batch_size=1, candidates=candidates,
+                                  prefix=prefix), questions))
+        print(f"\nprefix cache: {len(prefix['ids'])} tokens reused, "
+              f"{full_ms / cached_ms:.2f}x vs full prefill, {gen_ms / cached_ms:.2f}x vs generate")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,284 @@
+import argparse
+import json
+import random
+import re
+import time
+import zlib
+from pathlib import Path
+from typing import Callable, Dict, List, Tuple
+
+import numpy as np
+
+RAW_PATH = Path("data/routing/raw/routing_raw.jsonl")
+MODEL_PATH = Path("adapters/prerouter/prerouter.npz")
+
+N_FEATURES = 2 ** 18
+NGRAM_RANGE = (2, 4)
+
+
+def load_raw(path: Path) -> List[dict]:
+    rows = []
+    with path.open("r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            rows.append(json.loads(line))
+    return rows
+
+
+def split_rows(rows: List[dict], valid_ratio: float, seed: int) -> Tuple[List[dict], List[dict]]:
+    rows = list(rows)
+    random.Random(seed).shuffle(rows)
+    n_valid = max(1, int(round(len(rows) * valid_ratio)))
+    return rows[n_valid:], rows[:n_valid]
+
+
+def featurize(text: str, n_features: int = N_FEATURES, ngram_range=NGRAM_RANGE):
+    """
+    Hashed character n-grams of the lowercased, whitespace-collapsed text.
+    crc32 keeps the hashing stable across processes (unlike hash()).
+    Returns (unique bucket indices, L2-normalized counts).
+    """
+    t = " " + re.sub(r"\s+", " ", text.strip().lower()) + " "
+    counts: Dict[int, float] = {}
+    lo, hi = ngram_range
+    for n in range(lo, hi + 1):
+        for i in range(len(t) - n + 1):
+            h = zlib.crc32(t[i:i + n].encode("utf-8")) % n_features
+            counts[h] = counts.get(h, 0.0) + 1.0
+    idx = np.fromiter(counts.keys(), dtype=np.int64, count=len(counts))
+    val = np.fromiter(counts.values(), dtype=np.float32, count=len(counts))
+    norm = np.linalg.norm(val)
+    if norm > 0:
+        val /= norm
+    return idx, val
+
+
+def _softmax(z):
+    z = z - z.max()
+    e = np.exp(z)
+    return e / e.sum()
+
+
+class PreRouter:
+    """
+    Multinomial logistic regression over hashed char n-grams. Small enough
+    to answer thousands of questions per second on a single CPU core.
+    An untuned model's threshold is infinite: it defers every question,
+    even one whose (float32) softmax saturates at 1.0.
+    """
+
+    def __init__(self, labels: List[str], n_features: int = N_FEATURES,
+                 ngram_range=NGRAM_RANGE, threshold: float = float("inf")):
+        self.labels = list(labels)
+        self.n_features = n_features
+        self.ngram_range = tuple(ngram_range)
+        self.threshold = threshold
+        self.W = np.zeros((n_features, len(labels)), dtype=np.float32)
+        self.b = np.zeros(len(labels), dtype=np.float32)
+
+    def _features(self, text: str):
+        return featurize(text, self.n_features, self.ngram_range)
+
+    def fit(self, questions: List[str], labels: List[str], epochs: int = 8,
+            lr: float = 0.5, l2: float = 1e-6, seed: int = 42) -> None:
+        lab_idx = {lab: i for i, lab in enumerate(self.labels)}
+        feats = [self._features(q) for q in questions]
+        ys = [lab_idx[lab] for lab in labels]
+        order = list(range(len(feats)))
+        rng = random.Random(seed)
+
+        for epoch in range(epochs):
+            rng.shuffle(order)
+            step_lr = lr / (1.0 + epoch)
+            loss = 0.0
+            for i in order:
+                idx, val = feats[i]
+                p = _softmax(val @ self.W[idx] + self.b)
+                loss -= float(np.log(p[ys[i]] + 1e-12))
+                p[ys[i]] -= 1.0
+                self.W[idx] -= step_lr * (np.outer(val, p) + l2 * self.W[idx])
+                self.b -= step_lr * p
+            print(f"epoch {epoch + 1}/{epochs}  loss {loss / max(1, len(order)):.4f}")
+
+    def predict_proba(self, question: str) -> np.ndarray:
+        idx, val = self._features(question)
+        return _softmax(val @ self.W[idx] + self.b)
+
+    def predict(self, question: str) -> dict:
+        probs = self.predict_proba(question)
+        top = np.argsort(-probs)[:2]
+        p2 = float(probs[top[1]]) if len(top) > 1 else 0.0
+        return {
+            "label": self.labels[int(top[0])],
+            "probs": {lab: float(probs[i]) for i, lab in enumerate(self.labels)},
+            "margin": float(probs[top[0]]) - p2,
+            "confidence": float(probs[top[0]]),
+        }
+
+    def save(self, path: Path, extra: dict = None) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        meta = {
+            "labels": self.labels,
+            "n_features": self.n_features,
+            "ngram_range": list(self.ngram_range),
+            "threshold": self.threshold,
+        }
+        meta.update(extra or {})
+        with path.open("wb") as f:
+            np.savez_compressed(f, W=self.W, b=self.b, meta=json.dumps(meta))
+
+    @classmethod
+    def load(cls, path: Path) -> "PreRouter":
+        data = np.load(path, allow_pickle=False)
+        meta = json.loads(str(data["meta"]))
+        pre = cls(meta["labels"], meta["n_features"], meta["ngram_range"], meta["threshold"])
+        pre.W = data["W"]
+        pre.b = data["b"]
+        pre.meta = meta
+        return pre
+
+
+def pick_threshold(confidences: List[float], correct: List[bool], target_acc: float):
+    """
+    Lowest confidence threshold whose accepted subset still reaches target_acc.
+    Lower threshold = more traffic answered on CPU. Returns (threshold, coverage, accuracy).
+    """
+    pairs = sorted(zip(confidences, correct), key=lambda x: -x[0])
+    best = (float("inf"), 0.0, 1.0)
+    n_ok = 0
+    for k, (conf, ok) in enumerate(pairs, start=1):
+        n_ok += int(ok)
+        # only cut between distinct confidence values
+        if k < len(pairs) and pairs[k][0] == conf:
+            continue
+        acc = n_ok / k
+        if acc >= target_acc:
+            best = (conf, k / len(pairs), acc)
+    return best
+
+
+def cascade_route(questions: List[str], pre: PreRouter, fallback: Callable[[List[str]], List[dict]],
+                  threshold: float = None) -> Tuple[List[dict], dict]:
+    """
+    Answers confident questions with the CPU pre-router and sends the rest, in
+    one call, to `fallback` (e.g. a route_batch closure over the LoRA router).
+    """
+    if threshold is None:
+        threshold = pre.threshold
+
+    results: List[dict] = [None] * len(questions)
+    deferred = []
+    t0 = time.perf_counter()
+    for i, q in enumerate(questions):
+        res = pre.predict(q)
+        if res["confidence"] >= threshold:
+            res["source"] = "prerouter"
+            results[i] = res
+        else:
+            deferred.append(i)
+    cpu_s = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    if deferred:
+        for i, res in zip(deferred, fallback([questions[i] for i in deferred])):
+            res["source"] = "router"
+            results[i] = res
+    gpu_s = time.perf_counter() - t0
+
+    stats = {
+        "total": len(questions),
+        "prerouter": len(questions) - len(deferred),
+        "router": len(deferred),
+        "skip_rate": (len(questions) - len(deferred)) / max(1, len(questions)),
+        "prerouter_s": cpu_s,
+        "router_s": gpu_s,
+    }
+    return results, stats
+
+
+def cmd_train(args):
+    rows = load_raw(Path(args.raw))
+    train, valid = split_rows(rows, args.valid_ratio, args.seed)
+
+    labels = sorted({r["label"] for r in rows})
+    pre = PreRouter(labels)
+    t0 = time.perf_counter()
+    pre.fit([r["question"] for r in train], [r["label"] for r in train],
+            epochs=args.epochs, lr=args.lr, seed=args.seed)
+    print(f"Trained on {len(train)} rows in {time.perf_counter() - t0:.1f}s")
+
+    n_ok = sum(pre.predict(r["question"])["label"] == r["label"] for r in valid)
+    print(f"Valid accuracy: {n_ok / len(valid):.4f} ({len(valid)} rows)")
+
+    pre.save(Path(args.out), {"seed": args.seed, "valid_ratio": args.valid_ratio})
+    print(f"Saved: {args.out}")
+
+
+def cmd_tune(args):
+    pre = PreRouter.load(Path(args.model))
+    rows = load_raw(Path(args.raw))
+    _, valid = split_rows(rows, pre.meta.get("valid_ratio", 0.1), pre.meta.get("seed", 42))
+
+    confs, correct = [], []
+    for r in valid:
+        res = pre.predict(r["question"])
+        confs.append(res["confidence"])
+        correct.append(res["label"] == r["label"])
+
+    thr, coverage, acc = pick_threshold(confs, correct, args.target_acc)
+    print(f"Overall pre-router accuracy: {sum(correct) / len(correct):.4f}")
+    print(f"Threshold for >= {args.target_acc:.3f} accuracy: {thr:.4f}")
+    print(f"  accepted accuracy: {acc:.4f}")
+    print(f"  traffic skipping the GPU router: {coverage * 100:.1f}%")
+
+    pre.threshold = float(thr)
+    pre.save(Path(args.model), {k: v for k, v in pre.meta.items()
+                                if k not in {"labels", "n_features", "ngram_range", "threshold"}})
+    print(f"Saved threshold to: {args.model}")
+
+
+def cmd_predict(args):
+    pre = PreRouter.load(Path(args.model))
+    print(f"Pre-router ready (threshold {pre.threshold:.4f}). Type 'quit' to exit.\n")
+    while True:
+        q = input("question> ").strip()
+        if not q:
+            continue
+        if q.lower() in {"quit", "exit", "q"}:
+            break
+        res = pre.predict(q)
+        decision = "answer" if res["confidence"] >= pre.threshold else "defer to router"
+        print(f"label: {res['label']}  (p={res['confidence']:.3f}) → {decision}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CPU pre-router (char n-gram hashing + linear model).")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    p = sub.add_parser("train")
+    p.add_argument("--raw", type=str, default=str(RAW_PATH))
+    p.add_argument("--out", type=str, default=str(MODEL_PATH))
+    p.add_argument("--valid_ratio", type=float, default=0.1)
+    p.add_argument("--epochs", type=int, default=8)
+    p.add_argument("--lr", type=float, default=0.5)
+    p.add_argument("--seed", type=int, default=42)
+    p.set_defaults(func=cmd_train)
+
+    p = sub.add_parser("tune", help="Pick the confidence threshold that meets a target accuracy.")
+    p.add_argument("--raw", type=str, default=str(RAW_PATH))
+    p.add_argument("--model", type=str, default=str(MODEL_PATH))
+    p.add_argument("--target_acc", type=float, default=0.99)
+    p.set_defaults(func=cmd_tune)
+
+    p = sub.add_parser("predict")
+    p.add_argument("--model", type=str, default=str(MODEL_PATH))
+    p.set_defaults(func=cmd_predict)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
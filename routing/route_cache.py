@@ -0,0 +1,191 @@
+import hashlib
+import json
+import re
+import sqlite3
+import time
+import unicodedata
+from collections import OrderedDict
+from pathlib import Path
+from typing import Callable, List, Optional
+
+
+def normalize_question(question: str) -> str:
+    """
+    Canonical form used as the cache key: unicode-normalized, lowercased,
+    whitespace collapsed, digit-group separators (international and Indian,
+    "1,000,000" / "10,00,000") and trailing zeros dropped from numbers
+    ("Rs 8,000.00" and "rs 8000" map to the same key).
+    """
+    t = unicodedata.normalize("NFKC", question).lower().strip()
+    t = re.sub(r"\b\d{1,3}(?:,\d{2})*(?:,\d{3})+\b", lambda m: m.group().replace(",", ""), t)
+    t = re.sub(r"(\d+)\.0+\b", r"\1", t)
+    t = re.sub(r"(\d+\.\d*?)0+\b", r"\1", t)
+    t = re.sub(r"\s*([%(),:;?=+\-*/^])\s*", r"\1", t)
+    t = re.sub(r"\s+", " ", t)
+    return t.rstrip(" .?!")
+
+
+def question_key(question: str) -> str:
+    return hashlib.sha1(normalize_question(question).encode("utf-8")).hexdigest()
+
+
+def adapter_version(adapter_path: str) -> str:
+    """Content hash of the adapter config + weights; a retrained router gets a new version."""
+    h = hashlib.sha1()
+    root = Path(adapter_path)
+    for name in ("adapter_config.json", "adapter_model.safetensors", "adapter_model.bin"):
+        p = root / name
+        if not p.exists():
+            continue
+        h.update(name.encode("utf-8"))
+        with p.open("rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                h.update(block)
+    return h.hexdigest()[:16]
+
+
+def cascade_version(adapter_path: str, prerouter_path: str, threshold: float) -> str:
+    """
+    Version for answers that may come from the pre-router cascade: the LoRA
+    router's version plus the pre-router weights and the threshold in use,
+    since either decides which questions the pre-router answers.
+    """
+    h = hashlib.sha1(adapter_version(adapter_path).encode("utf-8"))
+    with Path(prerouter_path).open("rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    h.update(repr(float(threshold)).encode("utf-8"))
+    return h.hexdigest()[:16]
+
+
+class RouteCache:
+    """
+    Two-tier routing cache: an in-process LRU (size + TTL bounded) in front of
+    an optional SQLite file that several worker processes can share.
+    Entries are keyed by (normalized question, adapter version).
+    """
+
+    def __init__(self, version: str, max_entries: int = 50_000, ttl_s: float = 7 * 24 * 3600,
+                 db_path: Optional[str] = None):
+        self.version = version
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        self._mem: "OrderedDict[str, tuple]" = OrderedDict()
+        self._db = None
+        if db_path:
+            Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS route_cache ("
+                " key TEXT NOT NULL, version TEXT NOT NULL, result TEXT NOT NULL,"
+                " created REAL NOT NULL, PRIMARY KEY (key, version))"
+            )
+            self._db.commit()
+
+        self.stats = {"mem_hits": 0, "disk_hits": 0, "misses": 0,
+                      "hit_ms": 0.0, "miss_ms": 0.0, "evictions": 0}
+
+    def _expired(self, created: float) -> bool:
+        return self.ttl_s > 0 and time.time() - created > self.ttl_s
+
+    def _mem_put(self, key: str, result: dict, created: float) -> None:
+        self._mem[key] = (result, created)
+        self._mem.move_to_end(key)
+        while len(self._mem) > self.max_entries:
+            self._mem.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def get(self, question: str) -> Optional[dict]:
+        key = question_key(question)
+        item = self._mem.get(key)
+        if item is not None:
+            if not self._expired(item[1]):
+                self._mem.move_to_end(key)
+                self.stats["mem_hits"] += 1
+                return dict(item[0])
+            del self._mem[key]
+
+        if self._db is not None:
+            row = self._db.execute(
+                "SELECT result, created FROM route_cache WHERE key = ? AND version = ?",
+                (key, self.version),
+            ).fetchone()
+            if row is not None and not self._expired(row[1]):
+                result = json.loads(row[0])
+                self._mem_put(key, result, row[1])
+                self.stats["disk_hits"] += 1
+                return dict(result)
+        return None
+
+    def put(self, question: str, result: dict, commit: bool = True) -> None:
+        key = question_key(question)
+        result = {k: result[k] for k in ("label", "probs", "margin") if k in result}
+        now = time.time()
+        self._mem_put(key, result, now)
+        if self._db is not None:
+            self._db.execute(
+                "INSERT OR REPLACE INTO route_cache (key, version, result, created) VALUES (?, ?, ?, ?)",
+                (key, self.version, json.dumps(result), now),
+            )
+            if commit:
+                self._db.commit()
+
+    def purge_stale(self) -> int:
+        """Drops on-disk entries of other adapter versions or past their TTL."""
+        if self._db is None:
+            return 0
+        cur = self._db.execute(
+            "DELETE FROM route_cache WHERE version != ? OR created < ?",
+            (self.version, time.time() - self.ttl_s if self.ttl_s > 0 else 0),
+        )
+        self._db.commit()
+        return cur.rowcount
+
+    def route(self, questions: List[str], route_fn: Callable[[List[str]], List[dict]]) -> List[dict]:
+        """
+        Serves hits from the cache and sends the distinct misses to `route_fn`
+        in a single call. Each result carries "cached" and "ms".
+        """
+        results: List[Optional[dict]] = [None] * len(questions)
+        misses = {}
+        for i, q in enumerate(questions):
+            t0 = time.perf_counter()
+            hit = self.get(q)
+            if hit is not None:
+                hit["cached"] = True
+                hit["ms"] = (time.perf_counter() - t0) * 1000
+                self.stats["hit_ms"] += hit["ms"]
+                results[i] = hit
+            else:
+                misses.setdefault(question_key(q), []).append(i)
+
+        if misses:
+            firsts = [idx[0] for idx in misses.values()]
+            t0 = time.perf_counter()
+            routed = route_fn([questions[i] for i in firsts])
+            self.stats["miss_ms"] += (time.perf_counter() - t0) * 1000
+            for idx, res in zip(misses.values(), routed):
+                self.put(questions[idx[0]], res, commit=False)
+                for i in idx:
+                    r = dict(res)
+                    r["cached"] = False
+                    results[i] = r
+            if self._db is not None:
+                self._db.commit()
+            self.stats["misses"] += sum(len(idx) for idx in misses.values())
+        return results
+
+    def metrics(self) -> dict:
+        hits = self.stats["mem_hits"] + self.stats["disk_hits"]
+        lookups = hits + self.stats["misses"]
+        return {
+            "hit_rate": hits / lookups if lookups else 0.0,
+            "mem_hits": self.stats["mem_hits"],
+            "disk_hits": self.stats["disk_hits"],
+            "misses": self.stats["misses"],
+            "evictions": self.stats["evictions"],
+            "entries": len(self._mem),
+            "avg_hit_ms": self.stats["hit_ms"] / hits if hits else 0.0,
+            "avg_miss_ms": self.stats["miss_ms"] / self.stats["misses"] if self.stats["misses"] else 0.0,
+        }
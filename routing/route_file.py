@@ -0,0 +1,137 @@
+import argparse
+import json
+import time
+from pathlib import Path
+
+import torch
+
+from router_scoring import load_model, label_candidates, route_batch, build_prefix_cache
+from prerouter import PreRouter, cascade_route
+from route_cache import RouteCache, adapter_version, cascade_version
+
+
+def read_chunks(path: Path, field: str, chunk_size: int):
+    """
+    Streams the input JSONL in chunks so huge question banks never sit in memory.
+    A line may be a JSON object (question under `field`) or a bare JSON string.
+    """
+    chunk = []
+    with path.open("r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            row = json.loads(line)
+            if isinstance(row, str):
+                row = {field: row}
+            chunk.append(row)
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+    if chunk:
+        yield chunk
+
+
+def main():
+    p = argparse.ArgumentParser(description="Offline batch routing: JSONL questions in, JSONL labels out.")
+    p.add_argument("--base_model", type=str, default="Qwen/Qwen2.5-7B-Instruct")
+    p.add_argument("--adapter", type=str, required=True)
+    p.add_argument("--device", type=str, default="cuda", choices=["cuda", "cpu"])
+    p.add_argument("--input", type=str, required=True)
+    p.add_argument("--output", type=str, required=True)
+    p.add_argument("--field", type=str, default="question")
+    p.add_argument("--batch_size", type=int, default=16)
+    p.add_argument("--chunk_size", type=int, default=1024,
+                   help="Rows read per chunk; batches are length-sorted within a chunk.")
+    p.add_argument("--no_prefix_cache", action="store_true")
+    p.add_argument("--prerouter", type=str, default="",
+                   help="Path to a trained prerouter.npz; confident questions skip the LoRA router.")
+    p.add_argument("--threshold", type=float, default=None,
+                   help="Override the pre-router confidence threshold saved by `prerouter.py tune`.")
+    p.add_argument("--cache_size", type=int, default=0,
+                   help="In-process LRU entries for the route cache (0 disables the cache).")
+    p.add_argument("--cache_ttl", type=float, default=7 * 24 * 3600)
+    p.add_argument("--cache_db", type=str, default="",
+                   help="Optional SQLite file shared by several routing processes.")
+    args = p.parse_args()
+
+    if args.device == "cuda" and not torch.cuda.is_available():
+        raise RuntimeError("CUDA not available but --device=cuda was set.")
+
+    model, tokenizer = load_model(args.base_model, args.adapter, args.device)
+    candidates = label_candidates(tokenizer)
+    prefix = None if args.no_prefix_cache else build_prefix_cache(model, tokenizer)
+    pre = PreRouter.load(Path(args.prerouter)) if args.prerouter else None
+
+    cache = None
+    if args.cache_size > 0 or args.cache_db:
+        if pre is not None:
+            version = cascade_version(args.adapter, args.prerouter,
+                                      pre.threshold if args.threshold is None else args.threshold)
+        else:
+            version = adapter_version(args.adapter)
+        cache = RouteCache(version, max_entries=max(1, args.cache_size),
+                           ttl_s=args.cache_ttl, db_path=args.cache_db or None)
+
+    def router(questions):
+        return route_batch(model, tokenizer, questions, batch_size=args.batch_size,
+                           candidates=candidates, prefix=prefix)
+
+    def route_chunk(questions):
+        if pre is not None:
+            return cascade_route(questions, pre, router, threshold=args.threshold)
+        return router(questions), None
+
+    out_path = Path(args.output)
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+
+    total = 0
+    skipped = 0
+    t_start = time.perf_counter()
+    with out_path.open("w", encoding="utf-8") as fout:
+        for chunk in read_chunks(Path(args.input), args.field, args.chunk_size):
+            questions = [str(r.get(args.field, "")) for r in chunk]
+            if cache is not None:
+                stats = {}
+
+                def uncached(qs):
+                    res, st = route_chunk(qs)
+                    stats.update(st or {})
+                    return res
+
+                results = cache.route(questions, uncached)
+            else:
+                results, stats = route_chunk(questions)
+            if pre is not None:
+                skipped += (stats or {}).get("prerouter", 0)
+            for row, res in zip(chunk, results):
+                row["label"] = res["label"]
+                row["probs"] = res["probs"]
+                row["margin"] = res["margin"]
+                row["route_ms"] = round(res.get("ms", 0.0), 3)
+                if "source" in res:
+                    row["route_source"] = res["source"]
+                if cache is not None:
+                    row["route_cached"] = res["cached"]
+                fout.write(json.dumps(row, ensure_ascii=False) + "\n")
+
+            total += len(chunk)
+            elapsed = time.perf_counter() - t_start
+            print(f"routed {total} questions  ({total / elapsed:.1f} q/s)")
+
+    elapsed = time.perf_counter() - t_start
+    print(f"Done: {total} questions in {elapsed:.1f}s "
+          f"→ {total / max(elapsed, 1e-9):.1f} q/s, batch_size={args.batch_size}")
+    if pre is not None:
+        print(f"Pre-router answered {skipped}/{total} ({skipped / max(1, total) * 100:.1f}%) "
+              f"without the GPU router")
+    if cache is not None:
+        m = cache.metrics()
+        print(f"Route cache: hit rate {m['hit_rate'] * 100:.1f}% "
+              f"({m['mem_hits']} mem, {m['disk_hits']} disk, {m['misses']} misses), "
+              f"avg hit {m['avg_hit_ms']:.3f} ms vs miss {m['avg_miss_ms']:.1f} ms")
+    print(f"Wrote: {out_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,282 @@
+"""
+Label scoring for the LoRA router: prompt building, batched label
+likelihoods over a shared system-prompt cache, and model loading.
+Imported by the routing tools and serving/engine.py; test_router.py only
+imports it for --local so the daemon client path stays free of torch.
+"""
+import copy
+import re
+import sys
+import time
+from pathlib import Path
+
+import torch
+from transformers import AutoTokenizer
+from peft import PeftModel
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT / "serving"))
+
+from loader import load_causal_lm  # noqa: E402
+
+VALID_LABELS = [
+    "algebraic_fractions",
+    "arithmetic",
+    "growth_depreciation",
+    "probability",
+    "quadratic_equations",
+    "sequence_series",
+    "none",
+]
+
+def build_messages(question: str):
+    system = (
+        "You are a routing classifier. "
+        "Given a user's question, output ONLY the best route label from this set:\n"
+        + ", ".join(VALID_LABELS)
+        + "\n\nRules:\n"
+        "- Output exactly one label.\n"
+        "- No extra words, no punctuation, no explanation.\n"
+    )
+
+    return [
+        {"role": "system", "content": system},
+        {"role": "user", "content": question.strip()},
+    ]
+
+def extract_label(text: str) -> str:
+    t = text.strip().lower()
+    t = re.sub(r"\s+", " ", t)
+    for lab in VALID_LABELS:
+        if t == lab:
+            return lab
+        
+    for lab in VALID_LABELS:
+        if lab in t:
+            return lab
+    return "unknown"
+
+@torch.inference_mode()
+def route(model, tokenizer, question: str, max_new_tokens: int, temperature: float):
+    messages = build_messages(question)
+    prompt = tokenizer.apply_chat_template(
+        messages,
+        tokenize=False,
+        add_generation_prompt=True,
+    )
+
+    inputs = tokenizer(prompt, return_tensors="pt", truncation=True, max_length=1024)
+    inputs = {k: v.to(model.device) for k, v in inputs.items()}
+
+    gen = model.generate(
+        **inputs,
+        max_new_tokens=max_new_tokens,
+        do_sample=(temperature > 0),
+        temperature=temperature if temperature > 0 else None,
+        top_p=1.0,
+        pad_token_id=tokenizer.pad_token_id,
+        eos_token_id=tokenizer.eos_token_id,
+    )
+
+    new_tokens = gen[0][inputs["input_ids"].shape[-1]:]
+    raw = tokenizer.decode(new_tokens, skip_special_tokens=True).strip()
+    label = extract_label(raw)
+    return label, raw, prompt
+
+def label_candidates(tokenizer, labels=VALID_LABELS):
+    """
+    Token ids of every label as the router was trained to emit it
+    (train_router_lora.py appends a newline after the label).
+    """
+    return [tokenizer(lab + "\n", add_special_tokens=False)["input_ids"] for lab in labels]
+
+def _repeat_past(past, n: int):
+    """
+    Repeats a prefilled KV cache n times along the batch axis without
+    touching the original (DynamicCache is updated in place by forward).
+    """
+    if hasattr(past, "batch_repeat_interleave"):
+        past = copy.deepcopy(past)
+        past.batch_repeat_interleave(n)
+        return past
+    return tuple(tuple(t.repeat_interleave(n, dim=0) for t in layer) for layer in past)
+
+def _prompt_ids(tokenizer, question: str):
+    messages = build_messages(question)
+    prompt = tokenizer.apply_chat_template(
+        messages,
+        tokenize=False,
+        add_generation_prompt=True,
+    )
+    return tokenizer(prompt, truncation=True, max_length=1024)["input_ids"]
+
+def _pad_candidates(tokenizer, candidates, device):
+    n = len(candidates)
+    width = max(len(c) for c in candidates)
+    ids = torch.full((n, width), tokenizer.pad_token_id, dtype=torch.long)
+    mask = torch.zeros((n, width), dtype=torch.long)
+    for i, c in enumerate(candidates):
+        ids[i, :len(c)] = torch.tensor(c, dtype=torch.long)
+        mask[i, :len(c)] = 1
+    return ids.to(device), mask.to(device)
+
+def _summarize(scores, labels):
+    probs = torch.softmax(scores, dim=-1)
+    top = torch.topk(probs, k=min(2, len(labels)))
+    p1 = top.values[0].item()
+    p2 = top.values[1].item() if len(labels) > 1 else 0.0
+    return {
+        "label": labels[top.indices[0].item()],
+        "probs": {lab: probs[i].item() for i, lab in enumerate(labels)},
+        "margin": p1 - p2,
+    }
+
+@torch.inference_mode()
+def build_prefix_cache(model, tokenizer):
+    """
+    Prefills the constant part of the router prompt (system prompt with the
+    label list and rules, up to where the question starts) once.
+
+    The cache belongs to the adapter that produced it: rebuild it after
+    loading or switching the router adapter. Returns None if the template
+    does not split cleanly at the question boundary for this tokenizer.
+    """
+    marker = "<<QUESTION>>"
+    prompt = tokenizer.apply_chat_template(
+        build_messages(marker),
+        tokenize=False,
+        add_generation_prompt=True,
+    )
+    head, _, tail = prompt.partition(marker)
+    prefix_ids = tokenizer(head, add_special_tokens=False)["input_ids"]
+
+    sample = "Find the compound interest on Rs 5000 at 10% for 2 years."
+    split_ids = prefix_ids + tokenizer(sample + tail, add_special_tokens=False)["input_ids"]
+    if split_ids != _prompt_ids(tokenizer, sample):
+        print("[!] Router prompt does not tokenize cleanly at the question boundary; prefix cache disabled.")
+        return None
+
+    ids = torch.tensor([prefix_ids], dtype=torch.long, device=model.device)
+    out = model(input_ids=ids, use_cache=True)
+    return {"ids": prefix_ids, "tail": tail, "past": out.past_key_values}
+
+def _suffix_ids(tokenizer, question: str, prefix):
+    return tokenizer(
+        question.strip() + prefix["tail"],
+        add_special_tokens=False,
+        truncation=True,
+        max_length=1024 - len(prefix["ids"]),
+    )["input_ids"]
+
+@torch.inference_mode()
+def _score_batch(model, tokenizer, batch_ids, cand_ids, cand_mask, labels, prefix=None):
+    """
+    Scores every label for a batch of tokenized prompts.
+
+    Prompts are left-padded and prefilled once; the label sequences are then
+    scored for all rows in a single forward on top of the repeated cache.
+    With a prefix cache, batch_ids hold only the question part and the
+    shared system prompt is reused instead of prefilled again.
+    """
+    device = model.device
+    b = len(batch_ids)
+    n, width = cand_ids.shape
+    plen = max(len(x) for x in batch_ids)
+
+    ids = torch.full((b, plen), tokenizer.pad_token_id, dtype=torch.long)
+    attn = torch.zeros((b, plen), dtype=torch.long)
+    for i, x in enumerate(batch_ids):
+        ids[i, plen - len(x):] = torch.tensor(x, dtype=torch.long)
+        attn[i, plen - len(x):] = 1
+    ids = ids.to(device)
+    attn = attn.to(device)
+
+    past = None
+    offset = 0
+    if prefix is not None:
+        offset = len(prefix["ids"])
+        past = _repeat_past(prefix["past"], b)
+        attn = torch.cat([torch.ones((b, offset), dtype=torch.long, device=device), attn], dim=1)
+    pos = (attn.cumsum(dim=-1) - 1).clamp(min=0)[:, offset:]
+
+    out = model(input_ids=ids, attention_mask=attn, position_ids=pos,
+                past_key_values=past, use_cache=True)
+    first_logp = torch.log_softmax(out.logits[:, -1].float(), dim=-1)
+    scores = first_logp[:, cand_ids[:, 0]]
+
+    if width > 1:
+        lens = attn.sum(dim=-1)
+        step_attn = torch.cat([
+            attn.repeat_interleave(n, dim=0),
+            cand_mask[:, :-1].repeat(b, 1),
+        ], dim=1)
+        step_pos = lens.repeat_interleave(n)[:, None] + torch.arange(width - 1, device=device)
+        step = model(
+            input_ids=cand_ids[:, :-1].repeat(b, 1),
+            attention_mask=step_attn,
+            position_ids=step_pos,
+            past_key_values=_repeat_past(out.past_key_values, n),
+            use_cache=True,
+        )
+        logp = torch.log_softmax(step.logits.float(), dim=-1)
+        tok_logp = logp.gather(-1, cand_ids[:, 1:].repeat(b, 1).unsqueeze(-1)).squeeze(-1)
+        tok_logp = (tok_logp * cand_mask[:, 1:].repeat(b, 1)).sum(dim=-1)
+        scores = scores + tok_logp.view(b, n)
+
+    return [_summarize(scores[i], labels) for i in range(b)]
+
+def route_batch(model, tokenizer, questions, batch_size: int = 16,
+                candidates=None, labels=VALID_LABELS, prefix=None):
+    """
+    Routes many questions at once with label scoring.
+
+    Questions are sorted by token length so each left-padded batch wastes as
+    little compute on padding as possible; results come back in input order,
+    each with an amortized per-question latency in "ms". Pass the result of
+    build_prefix_cache() as `prefix` to skip re-prefilling the system prompt.
+    """
+    if candidates is None:
+        candidates = label_candidates(tokenizer, labels)
+    cand_ids, cand_mask = _pad_candidates(tokenizer, candidates, model.device)
+
+    if prefix is not None:
+        tokenized = [_suffix_ids(tokenizer, q, prefix) for q in questions]
+    else:
+        tokenized = [_prompt_ids(tokenizer, q) for q in questions]
+    order = sorted(range(len(questions)), key=lambda i: len(tokenized[i]))
+
+    results = [None] * len(questions)
+    for start in range(0, len(order), batch_size):
+        idx = order[start:start + batch_size]
+        t0 = time.perf_counter()
+        batch = _score_batch(model, tokenizer, [tokenized[i] for i in idx],
+                             cand_ids, cand_mask, labels, prefix=prefix)
+        ms = (time.perf_counter() - t0) * 1000 / len(idx)
+        for i, res in zip(idx, batch):
+            res["ms"] = ms
+            results[i] = res
+    return results
+
+def score_labels(model, tokenizer, question: str, candidates=None, labels=VALID_LABELS,
+                 prefix=None):
+    """
+    Routes by scoring every allowed label as a continuation of the prompt.
+
+    One prefill over the prompt, then a single batched forward over all label
+    token sequences on top of the shared prefix cache. Returns the label with
+    the highest sequence log-likelihood, the distribution over labels and the
+    top-1 / top-2 probability margin.
+    """
+    return route_batch(model, tokenizer, [question], batch_size=1,
+                       candidates=candidates, labels=labels, prefix=prefix)[0]
+
+def load_model(base_model: str, adapter_path: str, device: str, quant: str = "nf4"):
+    tokenizer = AutoTokenizer.from_pretrained(base_model, use_fast=True)
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+    tokenizer.padding_side = "right"
+
+    model = load_causal_lm(base_model, device=device, quant=quant)
+    model = PeftModel.from_pretrained(model, adapter_path)
+    model.eval()
+    return model, tokenizer
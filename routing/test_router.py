@@ -1,112 +1,88 @@
 import argparse
-import re
-import torch
-from transformers import AutoTokenizer, AutoModelForCausalLM, BitsAndBytesConfig
-from peft import PeftModel
-
-VALID_LABELS = [
-    "algebraic_fractions",
-    "arithmetic",
-    "growth_depreciation",
-    "probability",
-    "quadratic_equations",
-    "sequence_series",
-    "none",
-]
-
-def build_messages(question: str):
-    system = (
-        "You are a routing classifier. "
-        "Given a user's question, output ONLY the best route label from this set:\n"
-        + ", ".join(VALID_LABELS)
-        + "\n\nRules:\n"
-        "- Output exactly one label.\n"
-        "- No extra words, no punctuation, no explanation.\n"
-    )
-
-    return [
-        {"role": "system", "content": system},
-        {"role": "user", "content": question.strip()},
-    ]
-
-def extract_label(text: str) -> str:
-    t = text.strip().lower()
-    t = re.sub(r"\s+", " ", t)
-    for lab in VALID_LABELS:
-        if t == lab:
-            return lab
-        
-    for lab in VALID_LABELS:
-        if lab in t:
-            return lab
-    return "unknown"
-
-@torch.inference_mode()
-def route(model, tokenizer, question: str, max_new_tokens: int, temperature: float):
-    messages = build_messages(question)
-    prompt = tokenizer.apply_chat_template(
-        messages,
-        tokenize=False,
-        add_generation_prompt=True,
-    )
-
-    inputs = tokenizer(prompt, return_tensors="pt", truncation=True, max_length=1024)
-    inputs = {k: v.to(model.device) for k, v in inputs.items()}
-
-    gen = model.generate(
-        **inputs,
-        max_new_tokens=max_new_tokens,
-        do_sample=(temperature > 0),
-        temperature=temperature if temperature > 0 else None,
-        top_p=1.0,
-        pad_token_id=tokenizer.pad_token_id,
-        eos_token_id=tokenizer.eos_token_id,
-    )
-
-    new_tokens = gen[0][inputs["input_ids"].shape[-1]:]
-    raw = tokenizer.decode(new_tokens, skip_special_tokens=True).strip()
-    label = extract_label(raw)
-    return label, raw, prompt
-
-def load_model(base_model: str, adapter_path: str, device: str):
-    bnb_config = BitsAndBytesConfig(
-        load_in_4bit=True,
-        bnb_4bit_quant_type="nf4",
-        bnb_4bit_use_double_quant=True,
-        bnb_4bit_compute_dtype=torch.float16,
-    )
-
-    tokenizer = AutoTokenizer.from_pretrained(base_model, use_fast=True)
-    if tokenizer.pad_token is None:
-        tokenizer.pad_token = tokenizer.eos_token
-    tokenizer.padding_side = "right"
-
-    model = AutoModelForCausalLM.from_pretrained(
-        base_model,
-        quantization_config=bnb_config,
-        device_map={"": 0} if device == "cuda" else None,
-        attn_implementation="sdpa",
-    )
-    model = PeftModel.from_pretrained(model, adapter_path)
-    model.eval()
-    return model, tokenizer
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT / "serving"))
+
+from daemon_client import add_client_args, client_from_args  # noqa: E402
+
+
+def print_scored(res: dict, ms: float, show_probs: bool):
+    hit = " cached" if res.get("cached") else ""
+    print(f"label: {res['label']}  (p={res['probs'][res['label']]:.3f}, "
+          f"margin={res['margin']:.3f}, {ms:.1f} ms{hit})")
+    if show_probs:
+        for lab, pr in sorted(res["probs"].items(), key=lambda kv: -kv[1]):
+            print(f"  {lab:<22} {pr:.4f}")
+
+
+def client_loop(client, show_probs: bool):
+    """Same prompt loop, answered by the warm daemon (serving/daemon.py) instead of a local model."""
+    print(f"Router ready (daemon pid {client.info['pid']}). Type a question and press Enter. Type 'quit' to exit.\n")
+    while True:
+        q = input("question> ").strip()
+        if not q:
+            continue
+        if q.lower() in {"quit", "exit", "q"}:
+            metrics = client.ping()["route_cache"]
+            if metrics is not None:
+                print(f"route cache (daemon): {metrics}")
+            break
+        t0 = time.perf_counter()
+        res = client.route([q])[0]
+        print_scored(res, (time.perf_counter() - t0) * 1000, show_probs)
 
 
 def main():
-    p = argparse.ArgumentParser()
-    p.add_argument("--base_model", type=str, default="Qwen/Qwen2.5-7B-Instruct")
+    p = argparse.ArgumentParser(description="Interactive router (through the inference daemon unless --local).")
+    add_client_args(p, "Qwen/Qwen2.5-7B-Instruct")
     p.add_argument("--adapter", type=str, required=True)
-    p.add_argument("--device", type=str, default="cuda", choices=["cuda", "cpu"])
+    p.add_argument("--mode", type=str, default="score", choices=["score", "generate"],
+                   help="score: rank every label in one prefill; generate: free-running decode.")
     p.add_argument("--max_new_tokens", type=int, default=6)
     p.add_argument("--temperature", type=float, default=0.0)
     p.add_argument("--show_prompt", action="store_true")
     p.add_argument("--show_raw", action="store_true")
+    p.add_argument("--show_probs", action="store_true")
+    p.add_argument("--no_prefix_cache", action="store_true",
+                   help="Re-prefill the system prompt for every question.")
+    p.add_argument("--cache_size", type=int, default=10_000,
+                   help="Route cache entries keyed on normalized question text (0 disables).")
+    p.add_argument("--cache_ttl", type=float, default=7 * 24 * 3600)
+    p.add_argument("--cache_db", type=str, default="",
+                   help="Optional SQLite file shared across router processes.")
     args = p.parse_args()
 
+    if not args.local:
+        if args.mode != "score":
+            raise SystemExit("--mode generate needs --local (the daemon only serves scored routing).")
+        local_only = [f"--{k}" for k in ("max_new_tokens", "temperature", "show_prompt", "show_raw", "no_prefix_cache")
+                      if getattr(args, k) != p.get_default(k)]
+        if local_only:
+            raise SystemExit(f"{', '.join(local_only)} need --local (the daemon only serves scored routing, always with its prefix cache).")
+        # the daemon keeps its own route cache; these settings are part of the config it is matched on
+        route_cache = {"route_cache_size": args.cache_size, "route_cache_ttl": args.cache_ttl,
+                       "route_cache_db": str(Path(args.cache_db).resolve()) if args.cache_db else ""}
+        client_loop(client_from_args(args, router_adapter=args.adapter, route_cache=route_cache), args.show_probs)
+        return
+
+    # torch, transformers and peft load only for --local, so the daemon client starts fast
+    import torch
+    from route_cache import RouteCache, adapter_version
+    from router_scoring import build_prefix_cache, label_candidates, load_model, route, score_labels
+
     if args.device == "cuda" and not torch.cuda.is_available():
         raise RuntimeError("CUDA not available but --device=cuda was set.")
 
-    model, tokenizer = load_model(args.base_model, args.adapter, args.device)
+    model, tokenizer = load_model(args.base_model, args.adapter, args.device, args.quant)
+    candidates = label_candidates(tokenizer)
+    prefix = None if args.no_prefix_cache else build_prefix_cache(model, tokenizer)
+    cache = None
+    if args.cache_size > 0 or args.cache_db:
+        cache = RouteCache(adapter_version(args.adapter), max_entries=max(1, args.cache_size),
+                           ttl_s=args.cache_ttl, db_path=args.cache_db or None)
 
     print("Router ready. Type a question and press Enter. Type 'quit' to exit.\n")
 
@@ -115,15 +91,29 @@ def main():
         if not q:
             continue
         if q.lower() in {"quit", "exit", "q"}:
+            if cache is not None:
+                print(f"route cache: {cache.metrics()}")
             break
 
+        if args.mode == "score":
+            t0 = time.perf_counter()
+            if cache is not None:
+                res = cache.route([q], lambda qs: [score_labels(model, tokenizer, qs[0],
+                                                                candidates=candidates, prefix=prefix)])[0]
+            else:
+                res = score_labels(model, tokenizer, q, candidates=candidates, prefix=prefix)
+            print_scored(res, (time.perf_counter() - t0) * 1000, args.show_probs)
+            continue
+
+        t0 = time.perf_counter()
         label, raw, prompt = route(
             model, tokenizer, q,
             max_new_tokens=args.max_new_tokens,
             temperature=args.temperature,
         )
+        ms = (time.perf_counter() - t0) * 1000
 
-        print(f"label: {label}")
+        print(f"label: {label}  ({ms:.1f} ms)")
         if args.show_raw:
             print(f"raw: {raw}")
         if args.show_prompt:
@@ -0,0 +1,317 @@
+import argparse
+import hashlib
+import json
+import os
+import random
+import sys
+import time
+from pathlib import Path
+from typing import List
+
+import numpy as np
+import torch
+from transformers import AutoTokenizer, AutoModel
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT / "serving"))
+
+from loader import base_revision, load_causal_lm  # noqa: E402
+
+RAW_PATH = Path("data/routing/raw/routing_raw.jsonl")
+CACHE_ROOT = Path("data/routing/features")
+HEAD_OUT = Path("adapters/router_head/head.npz")
+
+# Features are taken over the question alone, without the allowed-label list,
+# so adding or renaming a label never invalidates the cache.
+FEATURE_SYSTEM = (
+    "You are a router for NEB Grade 10 math chapter adapters.\n"
+    "Read the user question and decide which chapter it belongs to."
+)
+
+
+def load_raw(path: Path) -> List[dict]:
+    rows = []
+    with path.open("r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            rows.append(json.loads(line))
+    return rows
+
+
+def question_key(question: str) -> str:
+    return hashlib.sha1(question.strip().encode("utf-8")).hexdigest()
+
+
+def feature_prompt(tokenizer, question: str) -> str:
+    messages = [
+        {"role": "system", "content": FEATURE_SYSTEM},
+        {"role": "user", "content": question.strip()},
+    ]
+    return tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+
+
+def precision(device: str, quant: str) -> dict:
+    """How load_causal_lm runs the base for `device`/`quant`; features differ between these."""
+    if device == "cuda":
+        return {"device": "cuda", "quant": quant, "dtype": "float16"}
+    return {"device": "cpu", "quant": "none", "dtype": "float32"}
+
+
+def cache_key(model_name: str, revision: str, template: str, pool: str, prec: dict) -> str:
+    blob = json.dumps({
+        "model": model_name,
+        "revision": revision,
+        "template": hashlib.sha1(template.encode("utf-8")).hexdigest(),
+        "pool": pool,
+        "precision": prec,
+    }, sort_keys=True)
+    return hashlib.sha1(blob.encode("utf-8")).hexdigest()[:16]
+
+
+class FeatureCache:
+    """
+    Append-only, memory-mapped float16 feature matrix plus an index of
+    question hashes. Lives in data/routing/features/<key>/ where the key
+    covers the base model revision, the prompt template, pooling and the
+    quantization / dtype the base ran in.
+
+    Rows are written before the index that lists them, and the index is
+    replaced atomically, so after an interrupted append the index names a
+    prefix of features.f16; opening the cache cuts the file back to it.
+    """
+
+    def __init__(self, root: Path):
+        self.root = root
+        self.bin_path = root / "features.f16"
+        self.index_path = root / "index.json"
+        if self.index_path.exists():
+            self.index = json.loads(self.index_path.read_text(encoding="utf-8"))
+        else:
+            self.index = {"hidden_size": None, "keys": [], "info": {}}
+        self._truncate()
+        self.rows = {k: i for i, k in enumerate(self.index["keys"])}
+
+    def _truncate(self) -> None:
+        """Drops rows past the index (an append interrupted before its index write)."""
+        if not self.bin_path.exists():
+            self.index["keys"] = []
+            return
+        row_bytes = (self.index["hidden_size"] or 0) * 2
+        size = self.bin_path.stat().st_size
+        if row_bytes == 0:
+            n = 0
+        else:
+            n = min(len(self.index["keys"]), size // row_bytes)
+            del self.index["keys"][n:]
+        if size > n * row_bytes:
+            with self.bin_path.open("r+b") as f:
+                f.truncate(n * row_bytes)
+
+    def _write_index(self) -> None:
+        tmp = self.index_path.with_name(self.index_path.name + ".tmp")
+        tmp.write_text(json.dumps(self.index), encoding="utf-8")
+        os.replace(tmp, self.index_path)
+
+    def missing(self, keys: List[str]) -> List[str]:
+        return [k for k in dict.fromkeys(keys) if k not in self.rows]
+
+    def append(self, keys: List[str], feats: np.ndarray) -> None:
+        self.root.mkdir(parents=True, exist_ok=True)
+        if self.index["hidden_size"] is None:
+            self.index["hidden_size"] = int(feats.shape[1])
+        with self.bin_path.open("ab") as f:
+            f.write(np.ascontiguousarray(feats, dtype=np.float16).tobytes())
+        for k in keys:
+            self.rows[k] = len(self.index["keys"])
+            self.index["keys"].append(k)
+        self._write_index()
+
+    def matrix(self) -> np.ndarray:
+        n = len(self.index["keys"])
+        return np.memmap(self.bin_path, dtype=np.float16, mode="r",
+                         shape=(n, self.index["hidden_size"]))
+
+    def lookup(self, keys: List[str]) -> np.ndarray:
+        mm = self.matrix()
+        return np.asarray(mm[[self.rows[k] for k in keys]], dtype=np.float32)
+
+
+def open_cache(model_name: str, tokenizer, pool: str, prec: dict, root: Path = CACHE_ROOT):
+    # keyed on the base weights: a hub commit, or a digest of a local dir's weight files
+    revision = base_revision(model_name) or "unknown"
+    key = cache_key(model_name, revision, feature_prompt(tokenizer, "{question}"), pool, prec)
+    cache = FeatureCache(root / key)
+    cache.index["info"] = {"model": model_name, "revision": revision, "pool": pool, "precision": prec}
+    return cache
+
+
+@torch.inference_mode()
+def embed(model, tokenizer, questions: List[str], pool: str) -> np.ndarray:
+    prompts = [feature_prompt(tokenizer, q) for q in questions]
+    enc = tokenizer(prompts, return_tensors="pt", padding=True, truncation=True, max_length=512)
+    enc = {k: v.to(model.device) for k, v in enc.items()}
+    hidden = model(**enc).last_hidden_state.float()
+    mask = enc["attention_mask"]
+    if pool == "mean":
+        m = mask.unsqueeze(-1).to(hidden.dtype)
+        pooled = (hidden * m).sum(dim=1) / m.sum(dim=1).clamp(min=1.0)
+    else:
+        last = mask.sum(dim=1) - 1
+        pooled = hidden[torch.arange(hidden.shape[0], device=hidden.device), last]
+    return pooled.cpu().numpy()
+
+
+def cmd_extract(args):
+    tokenizer = AutoTokenizer.from_pretrained(args.model, use_fast=True)
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+    tokenizer.padding_side = "right"
+
+    rows = load_raw(Path(args.raw))
+    by_key = {question_key(r["question"]): r["question"] for r in rows}
+
+    model = load_causal_lm(args.model, device=args.device, quant=args.quant, auto_class=AutoModel)
+    model.eval()
+
+    cache = open_cache(args.model, tokenizer, args.pool, precision(args.device, args.quant), Path(args.cache_dir))
+    todo = cache.missing(list(by_key))
+    print(f"Cache: {cache.root}  ({len(cache.rows)} cached, {len(todo)} to extract)")
+
+    # length-sorted batches keep padding low
+    todo.sort(key=lambda k: len(by_key[k]))
+    t0 = time.perf_counter()
+    for start in range(0, len(todo), args.batch_size):
+        keys = todo[start:start + args.batch_size]
+        cache.append(keys, embed(model, tokenizer, [by_key[k] for k in keys], args.pool))
+        done = start + len(keys)
+        if done % (args.batch_size * 20) < args.batch_size or done == len(todo):
+            print(f"  {done}/{len(todo)}  ({done / (time.perf_counter() - t0):.1f} q/s)")
+
+    print(f"Features ready: {len(cache.rows)} x {cache.index['hidden_size']} → {cache.bin_path}")
+
+
+def _softmax(z):
+    z = z - z.max(axis=1, keepdims=True)
+    e = np.exp(z)
+    return e / e.sum(axis=1, keepdims=True)
+
+
+def train_head(X, y, n_classes: int, epochs: int, lr: float, l2: float, seed: int):
+    """Full-batch softmax regression with Adam; a few seconds on CPU."""
+    rng = np.random.default_rng(seed)
+    W = (rng.standard_normal((X.shape[1], n_classes)) * 0.01).astype(np.float32)
+    b = np.zeros(n_classes, dtype=np.float32)
+    Y = np.eye(n_classes, dtype=np.float32)[y]
+    mW, vW, mb, vb = 0.0, 0.0, 0.0, 0.0
+    beta1, beta2, eps = 0.9, 0.999, 1e-8
+
+    for t in range(1, epochs + 1):
+        P = _softmax(X @ W + b)
+        G = (P - Y) / len(X)
+        gW = X.T @ G + l2 * W
+        gb = G.sum(axis=0)
+        mW = beta1 * mW + (1 - beta1) * gW
+        vW = beta2 * vW + (1 - beta2) * gW * gW
+        mb = beta1 * mb + (1 - beta1) * gb
+        vb = beta2 * vb + (1 - beta2) * gb * gb
+        W -= lr * (mW / (1 - beta1 ** t)) / (np.sqrt(vW / (1 - beta2 ** t)) + eps)
+        b -= lr * (mb / (1 - beta1 ** t)) / (np.sqrt(vb / (1 - beta2 ** t)) + eps)
+        if t % max(1, epochs // 5) == 0 or t == epochs:
+            loss = -np.log(P[np.arange(len(y)), y] + 1e-12).mean()
+            print(f"step {t}/{epochs}  loss {loss:.4f}")
+    return W, b
+
+
+def cmd_train(args):
+    tokenizer = AutoTokenizer.from_pretrained(args.model, use_fast=True)
+    cache = open_cache(args.model, tokenizer, args.pool, precision(args.device, args.quant), Path(args.cache_dir))
+
+    rows = load_raw(Path(args.raw))
+    if args.labels:
+        keep = set(args.labels.split(","))
+        rows = [r for r in rows if r["label"] in keep]
+    keys = [question_key(r["question"]) for r in rows]
+    missing = cache.missing(keys)
+    if missing:
+        raise RuntimeError(f"{len(missing)} questions have no cached features; run `extract` first.")
+
+    labels = sorted({r["label"] for r in rows})
+    if "none" in labels:
+        labels = [l for l in labels if l != "none"] + ["none"]
+    lab_idx = {lab: i for i, lab in enumerate(labels)}
+
+    order = list(range(len(rows)))
+    random.Random(args.seed).shuffle(order)
+    n_valid = max(1, int(round(len(rows) * args.valid_ratio)))
+    valid_i, train_i = order[:n_valid], order[n_valid:]
+
+    t0 = time.perf_counter()
+    X = cache.lookup(keys)
+    y = np.array([lab_idx[r["label"]] for r in rows])
+    mu = X[train_i].mean(axis=0)
+    sd = X[train_i].std(axis=0) + 1e-5
+    Xn = (X - mu) / sd
+
+    W, b = train_head(Xn[train_i], y[train_i], len(labels), args.epochs, args.lr, args.l2, args.seed)
+    elapsed = time.perf_counter() - t0
+
+    pred = (Xn[valid_i] @ W + b).argmax(axis=1)
+    acc = float((pred == y[valid_i]).mean())
+    print(f"Trained head on {len(train_i)} rows in {elapsed:.1f}s (CPU)")
+    print(f"Valid accuracy: {acc:.4f} ({len(valid_i)} rows)")
+    for lab, i in lab_idx.items():
+        m = y[valid_i] == i
+        if m.any():
+            print(f"  {lab:<22} {(pred[m] == i).mean():.4f}  (n={int(m.sum())})")
+
+    out = Path(args.out)
+    out.parent.mkdir(parents=True, exist_ok=True)
+    meta = {"labels": labels, "pool": args.pool, "cache": str(cache.root),
+            "model": args.model, "precision": cache.index["info"]["precision"], "valid_acc": acc}
+    with out.open("wb") as f:
+        np.savez_compressed(f, W=W, b=b, mu=mu, sd=sd, meta=json.dumps(meta))
+    print(f"Saved head: {out}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Router head training on cached frozen base-model features.")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    p = sub.add_parser("extract", help="Run the frozen base once and cache pooled final-layer states.")
+    p.add_argument("--model", type=str, default="Qwen/Qwen2.5-7B-Instruct")
+    p.add_argument("--raw", type=str, default=str(RAW_PATH))
+    p.add_argument("--cache_dir", type=str, default=str(CACHE_ROOT))
+    p.add_argument("--device", type=str, default="cuda", choices=["cuda", "cpu"])
+    p.add_argument("--quant", type=str, default="nf4", choices=["nf4", "none"])
+    p.add_argument("--pool", type=str, default="last", choices=["last", "mean"])
+    p.add_argument("--batch_size", type=int, default=16)
+    p.set_defaults(func=cmd_extract)
+
+    p = sub.add_parser("train", help="Train a classification head on cached features (CPU).")
+    p.add_argument("--model", type=str, default="Qwen/Qwen2.5-7B-Instruct")
+    p.add_argument("--raw", type=str, default=str(RAW_PATH))
+    p.add_argument("--cache_dir", type=str, default=str(CACHE_ROOT))
+    p.add_argument("--device", type=str, default="cuda", choices=["cuda", "cpu"],
+                   help="The --device the features were extracted on (selects the cache; training runs on CPU).")
+    p.add_argument("--quant", type=str, default="nf4", choices=["nf4", "none"],
+                   help="The --quant the features were extracted with.")
+    p.add_argument("--pool", type=str, default="last", choices=["last", "mean"])
+    p.add_argument("--labels", type=str, default="", help="Comma-separated subset of labels to train on.")
+    p.add_argument("--out", type=str, default=str(HEAD_OUT))
+    p.add_argument("--valid_ratio", type=float, default=0.05)
+    p.add_argument("--epochs", type=int, default=300)
+    p.add_argument("--lr", type=float, default=1e-2)
+    p.add_argument("--l2", type=float, default=1e-4)
+    p.add_argument("--seed", type=int, default=42)
+    p.set_defaults(func=cmd_train)
+
+    args = parser.parse_args()
+    if args.cmd == "extract" and args.device == "cuda" and not torch.cuda.is_available():
+        raise RuntimeError("CUDA not available but --device=cuda was set.")
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
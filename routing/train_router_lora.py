@@ -1,16 +1,24 @@
 import argparse
+import sys
+from pathlib import Path
+
 import torch
 from datasets import load_dataset
 from transformers import (
     AutoTokenizer,
-    AutoModelForCausalLM,
     TrainingArguments,
     Trainer,
     DataCollatorForLanguageModeling,
-    BitsAndBytesConfig,
 )
 from peft import LoraConfig, get_peft_model, prepare_model_for_kbit_training
 
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT / "serving"))
+sys.path.insert(0, str(ROOT / "scripts"))
+
+from loader import load_causal_lm  # noqa: E402
+from autotune import load_run_config  # noqa: E402
+
 
 def build_text(example, tokenizer):
     messages = example["messages"]
@@ -33,15 +41,17 @@ def main():
     parser.add_argument("--out", type=str, default="adapters/router_lora")
     parser.add_argument("--run_dir", type=str, default="runs/router_lora")
 
-    parser.add_argument("--max_len", type=int, default=512)
+    parser.add_argument("--max_len", type=int, default=None, help="Default 512 (or autotune.json's).")
     parser.add_argument("--epochs", type=int, default=1)
     parser.add_argument("--lr", type=float, default=2e-4)
-    parser.add_argument("--batch_size", type=int, default=1)
-    parser.add_argument("--grad_accum", type=int, default=8)
+    parser.add_argument("--batch_size", type=int, default=None, help="Default 1 (or autotune.json's).")
+    parser.add_argument("--grad_accum", type=int, default=None, help="Default 8 (or autotune.json's).")
     parser.add_argument("--logging_steps", type=int, default=20)
     parser.add_argument("--save_steps", type=int, default=250)
     parser.add_argument("--seed", type=int, default=42)
     parser.add_argument("--grad_ckpt", action="store_true")
+    parser.add_argument("--ignore_autotune", action="store_true",
+                        help="Ignore <run_dir>/autotune.json; flags given explicitly override it either way.")
 
     # LoRA
     parser.add_argument("--lora_r", type=int, default=16)
@@ -52,13 +62,23 @@ def main():
     if not torch.cuda.is_available():
         raise RuntimeError("CUDA GPU required for 7B QLoRA training.")
 
-    # ---------------- Quantization ----------------
-    bnb_config = BitsAndBytesConfig(
-        load_in_4bit=True,
-        bnb_4bit_quant_type="nf4",
-        bnb_4bit_use_double_quant=True,
-        bnb_4bit_compute_dtype=torch.float16,  
-    )
+    # prepare_model_for_kbit_training checkpoints by default, so that is the untuned behavior
+    run = {
+        "per_device_train_batch_size": 1,
+        "gradient_accumulation_steps": 8,
+        "gradient_checkpointing": True,
+        "max_len": 512,
+    }
+    if not args.ignore_autotune:
+        run = load_run_config(args.run_dir, defaults=run)
+    # flags given on the command line win over autotune.json
+    given = {"per_device_train_batch_size": args.batch_size, "gradient_accumulation_steps": args.grad_accum,
+             "max_len": args.max_len}
+    run.update({k: v for k, v in given.items() if v is not None})
+    args.batch_size = run["per_device_train_batch_size"]
+    args.grad_accum = run["gradient_accumulation_steps"]
+    args.max_len = run["max_len"]
+    args.grad_ckpt = args.grad_ckpt or run["gradient_checkpointing"]
 
     # ---------------- Load tokenizer & model ----------------
     tokenizer = AutoTokenizer.from_pretrained(args.model, use_fast=True)
@@ -67,19 +87,14 @@ def main():
         tokenizer.pad_token = tokenizer.eos_token
     tokenizer.padding_side = "right"
 
-    model = AutoModelForCausalLM.from_pretrained(
-        args.model,
-        quantization_config=bnb_config,
-        device_map={"": 0},  
-        attn_implementation="sdpa",
-    )
+    model = load_causal_lm(args.model)
     model.config.use_cache = False
 
     if args.grad_ckpt:
         model.gradient_checkpointing_enable()
 
     # ---------------- Prepare for QLoRA ----------------
-    model = prepare_model_for_kbit_training(model)
+    model = prepare_model_for_kbit_training(model, use_gradient_checkpointing=args.grad_ckpt)
 
     lora_cfg = LoraConfig(
         r=args.lora_r,
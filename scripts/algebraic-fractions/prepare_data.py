@@ -1,3 +1,4 @@
+"""Flatten the raw algebraic fractions chat records into processed/train.jsonl text rows."""
 import json
 from pathlib import Path
 
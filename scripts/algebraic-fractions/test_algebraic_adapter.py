@@ -1,10 +1,18 @@
+import argparse
 import json
-import torch
-from transformers import AutoTokenizer, AutoModelForCausalLM, BitsAndBytesConfig
-from peft import PeftModel
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[2]
+sys.path.insert(0, str(ROOT / "serving"))
+
+# torch, transformers and the model are only imported for --local, so the daemon client starts instantly
+from daemon_client import add_client_args, client_from_args  # noqa: E402
 
 BASE = "Qwen/Qwen2.5-7B-Instruct"
 ADAPTER = "adapters/algebraic_fractions_v1"
+CHAPTER = "algebraic_fractions"  # label the daemon serves this adapter under
+DRAFT = ""  # optional same-tokenizer draft for assisted decoding, e.g. "Qwen/Qwen2.5-0.5B-Instruct"
 
 
 def extract_json(text: str):
@@ -25,8 +33,14 @@ def extract_json(text: str):
         return candidate, f"JSON parse error: {e}"
 
 
-def run_generation(model, tokenizer, prompt: str, max_new_tokens: int = 400):
+def run_generation(model, tokenizer, prompt: str, max_new_tokens: int = 400, assistant_model=None):
+    import torch
+    from transformers import StoppingCriteriaList
+    from json_stop import JsonStopCriteria
+
     inputs = tokenizer(prompt, return_tensors="pt").to(model.device)
+    # stop as soon as the top-level JSON object closes instead of rambling to max_new_tokens
+    stop = JsonStopCriteria(tokenizer, inputs["input_ids"].shape[-1])
     with torch.no_grad():
         out = model.generate(
             **inputs,
@@ -34,34 +48,52 @@ def run_generation(model, tokenizer, prompt: str, max_new_tokens: int = 400):
             do_sample=True,
             temperature=0.7,
             top_p=0.9,
+            stopping_criteria=StoppingCriteriaList([stop]),
+            assistant_model=assistant_model,
         )
     return tokenizer.decode(out[0], skip_special_tokens=True)
 
 
-def main():
-    print("Loading base model + algebraic adapter...")
+def load_local(args):
+    """In-process generation (the pre-daemon path): loads base + adapter on every run."""
+    from transformers import AutoTokenizer
+    from peft import PeftModel
+    from loader import load_causal_lm
+    from speculative import load_draft
 
-    bnb_config = BitsAndBytesConfig(
-        load_in_4bit=True,
-        bnb_4bit_quant_type="nf4",
-        bnb_4bit_use_double_quant=True,
-        bnb_4bit_compute_dtype=torch.float16,
-    )
+    print("Loading base model + algebraic adapter...")
 
-    tokenizer = AutoTokenizer.from_pretrained(BASE, use_fast=True)
+    tokenizer = AutoTokenizer.from_pretrained(args.base_model, use_fast=True)
     if tokenizer.pad_token is None:
         tokenizer.pad_token = tokenizer.eos_token
 
-    base_model = AutoModelForCausalLM.from_pretrained(
-        BASE,
-        quantization_config=bnb_config,
-        device_map={"": 0},     # IMPORTANT for stability
-        attn_implementation="sdpa",
-    )
+    base_model = load_causal_lm(args.base_model, device=args.device, quant=args.quant)
     base_model.config.use_cache = False
 
     model = PeftModel.from_pretrained(base_model, ADAPTER)
     model.eval()
+    draft = load_draft(DRAFT, tokenizer, device=args.device) if DRAFT else None
+
+    def generate(prompt: str, max_new_tokens: int):
+        raw = run_generation(model, tokenizer, prompt, max_new_tokens=max_new_tokens, assistant_model=draft)
+        print(raw)
+        return raw
+    return generate
+
+
+def main():
+    p = argparse.ArgumentParser(description="Try the algebraic adapter (through the inference daemon unless --local).")
+    add_client_args(p, BASE)
+    args = p.parse_args()
+
+    if args.local:
+        generate = load_local(args)
+    else:
+        client = client_from_args(args, draft_model=DRAFT)
+
+        def generate(prompt: str, max_new_tokens: int):
+            return client.generate(CHAPTER, prompt, max_new_tokens=max_new_tokens, stream=sys.stdout,
+                                   adapter=ADAPTER)
 
     # -----------------------
     # Test 1: generate_mcq
@@ -88,8 +120,7 @@ question, options, correct_option, answer_explanation, distractor_rationales, me
 """
 
     print("\n===== OUTPUT: generate_mcq =====")
-    raw_mcq = run_generation(model, tokenizer, prompt_mcq)
-    print(raw_mcq)
+    raw_mcq = generate(prompt_mcq, max_new_tokens=400)
 
     parsed_mcq, err = extract_json(raw_mcq)
     if err:
@@ -120,8 +151,7 @@ given, to_find, steps, final_answer
 """
 
     print("\n===== OUTPUT: solve =====")
-    raw_solve = run_generation(model, tokenizer, prompt_solve, max_new_tokens=500)
-    print(raw_solve)
+    raw_solve = generate(prompt_solve, max_new_tokens=500)
 
     parsed_solve, err = extract_json(raw_solve)
     if err:
@@ -1,29 +1,30 @@
-import torch
+"""Train the algebraic fractions LoRA adapter (paths in the Config section)."""
+import sys
+from pathlib import Path
+
 from datasets import load_dataset
 from transformers import (
     AutoTokenizer,
-    AutoModelForCausalLM,
     TrainingArguments,
     Trainer,
     DataCollatorForLanguageModeling,
-    BitsAndBytesConfig,
 )
 from peft import LoraConfig, get_peft_model, prepare_model_for_kbit_training
 
+ROOT = Path(__file__).resolve().parents[2]
+sys.path.insert(0, str(ROOT / "serving"))
+sys.path.insert(0, str(ROOT / "scripts"))
+
+from loader import load_causal_lm  # noqa: E402
+from autotune import load_run_config  # noqa: E402
+
 BASE = "Qwen/Qwen2.5-7B-Instruct"
 
 # ✅ change these for algebraic
 TRAIN_FILE = "data/algebraic_fractions/processed/train.jsonl"
 ADAPTER_OUT = "adapters/algebraic_fractions_v1"
 RUN_DIR = "runs/algebraic_fractions_v1"
-
-# 4-bit load (QLoRA style)
-bnb_config = BitsAndBytesConfig(
-    load_in_4bit=True,
-    bnb_4bit_quant_type="nf4",
-    bnb_4bit_use_double_quant=True,
-    bnb_4bit_compute_dtype=torch.float16,
-)
+RUN = load_run_config(RUN_DIR)  # micro-batch, checkpointing and max length from scripts/autotune.py
 
 tokenizer = AutoTokenizer.from_pretrained(BASE, use_fast=True)
 
@@ -31,17 +32,12 @@ tokenizer = AutoTokenizer.from_pretrained(BASE, use_fast=True)
 if tokenizer.pad_token is None:
     tokenizer.pad_token = tokenizer.eos_token
 
-model = AutoModelForCausalLM.from_pretrained(
-    BASE,
-    quantization_config=bnb_config,
-    device_map={"": 0},            # IMPORTANT (instead of "cuda")
-    attn_implementation="sdpa",
-)
+model = load_causal_lm(BASE)
 
 model.config.use_cache = False     # IMPORTANT for training
 
 # Prepare model for k-bit training
-model = prepare_model_for_kbit_training(model)
+model = prepare_model_for_kbit_training(model, use_gradient_checkpointing=RUN["gradient_checkpointing"])
 
 # LoRA config (good defaults)
 lora_config = LoraConfig(
@@ -62,7 +58,7 @@ model.print_trainable_parameters()
 # Load dataset
 ds = load_dataset("json", data_files=TRAIN_FILE, split="train")
 
-MAX_LEN = 1024
+MAX_LEN = RUN["max_len"]
 
 def tokenize_fn(batch):
     out = tokenizer(
@@ -80,8 +76,8 @@ collator = DataCollatorForLanguageModeling(tokenizer=tokenizer, mlm=False)
 
 args = TrainingArguments(
     output_dir=RUN_DIR,
-    per_device_train_batch_size=1,
-    gradient_accumulation_steps=8,
+    per_device_train_batch_size=RUN["per_device_train_batch_size"],
+    gradient_accumulation_steps=RUN["gradient_accumulation_steps"],
     num_train_epochs=3,
     learning_rate=2e-4,
     fp16=True,
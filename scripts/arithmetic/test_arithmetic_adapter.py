@@ -1,11 +1,19 @@
+import argparse
 import json
 import re
-import torch
-from transformers import AutoTokenizer, AutoModelForCausalLM, BitsAndBytesConfig
-from peft import PeftModel
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[2]
+sys.path.insert(0, str(ROOT / "serving"))
+
+# torch, transformers and the model are only imported for --local, so the daemon client starts instantly
+from daemon_client import add_client_args, client_from_args  # noqa: E402
 
 BASE = "Qwen/Qwen2.5-7B-Instruct"
 ADAPTER = "adapters/arithmetic_v1"
+CHAPTER = "arithmetic"  # label the daemon serves this adapter under
+DRAFT = ""  # optional same-tokenizer draft for assisted decoding, e.g. "Qwen/Qwen2.5-0.5B-Instruct"
 
 def extract_json(text: str):
     """
@@ -26,8 +34,14 @@ def extract_json(text: str):
     except Exception as e:
         return candidate, f"JSON parse error: {e}"
 
-def run_generation(model, tokenizer, prompt: str, max_new_tokens: int = 350):
+def run_generation(model, tokenizer, prompt: str, max_new_tokens: int = 350, assistant_model=None):
+    import torch
+    from transformers import StoppingCriteriaList
+    from json_stop import JsonStopCriteria
+
     inputs = tokenizer(prompt, return_tensors="pt").to(model.device)
+    # stop as soon as the top-level JSON object closes instead of rambling to max_new_tokens
+    stop = JsonStopCriteria(tokenizer, inputs["input_ids"].shape[-1])
     with torch.no_grad():
         out = model.generate(
             **inputs,
@@ -35,31 +49,48 @@ def run_generation(model, tokenizer, prompt: str, max_new_tokens: int = 350):
             do_sample=True,
             temperature=0.7,
             top_p=0.9,
+            stopping_criteria=StoppingCriteriaList([stop]),
+            assistant_model=assistant_model,
         )
     return tokenizer.decode(out[0], skip_special_tokens=True)
 
-def main():
+def load_local(args):
+    """In-process generation (the pre-daemon path): loads base + adapter on every run."""
+    from transformers import AutoTokenizer
+    from peft import PeftModel
+    from loader import load_causal_lm
+    from speculative import load_draft
+
     print("Loading base model + adapter...")
 
-    bnb_config = BitsAndBytesConfig(
-        load_in_4bit=True,
-        bnb_4bit_quant_type="nf4",
-        bnb_4bit_use_double_quant=True,
-        bnb_4bit_compute_dtype=torch.float16,
-    )
-
-    tokenizer = AutoTokenizer.from_pretrained(BASE, use_fast=True)
-
-    base_model = AutoModelForCausalLM.from_pretrained(
-        BASE,
-        quantization_config=bnb_config,
-        device_map={"": 0},          # important on Windows/accelerate stability
-        attn_implementation="sdpa",
-    )
+    tokenizer = AutoTokenizer.from_pretrained(args.base_model, use_fast=True)
+
+    base_model = load_causal_lm(args.base_model, device=args.device, quant=args.quant)
     base_model.config.use_cache = False
 
     model = PeftModel.from_pretrained(base_model, ADAPTER)
     model.eval()
+    draft = load_draft(DRAFT, tokenizer, device=args.device) if DRAFT else None
+
+    def generate(prompt: str, max_new_tokens: int):
+        raw = run_generation(model, tokenizer, prompt, max_new_tokens=max_new_tokens, assistant_model=draft)
+        print(raw)
+        return raw
+    return generate
+
+def main():
+    p = argparse.ArgumentParser(description="Try the arithmetic adapter (through the inference daemon unless --local).")
+    add_client_args(p, BASE)
+    args = p.parse_args()
+
+    if args.local:
+        generate = load_local(args)
+    else:
+        client = client_from_args(args, draft_model=DRAFT)
+
+        def generate(prompt: str, max_new_tokens: int):
+            return client.generate(CHAPTER, prompt, max_new_tokens=max_new_tokens, stream=sys.stdout,
+                                   adapter=ADAPTER)
 
     # -----------------------
     # Test 1: generate_mcq
@@ -83,8 +114,7 @@ question, options, correct_option, answer_explanation, distractor_rationales, me
 """
 
     print("\n===== OUTPUT: generate_mcq =====")
-    raw_mcq = run_generation(model, tokenizer, prompt_mcq, max_new_tokens=350)
-    print(raw_mcq)
+    raw_mcq = generate(prompt_mcq, max_new_tokens=350)
 
     parsed_mcq, err = extract_json(raw_mcq)
     if err:
@@ -114,8 +144,7 @@ given, to_find, steps, final_answer
 """
 
     print("\n===== OUTPUT: solve =====")
-    raw_solve = run_generation(model, tokenizer, prompt_solve, max_new_tokens=450)
-    print(raw_solve)
+    raw_solve = generate(prompt_solve, max_new_tokens=450)
 
     parsed_solve, err = extract_json(raw_solve)
     if err:
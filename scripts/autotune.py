@@ -0,0 +1,268 @@
+import argparse
+import ctypes
+import json
+import math
+import sys
+import threading
+import time
+from pathlib import Path
+
+import torch
+from peft import LoraConfig, get_peft_model, prepare_model_for_kbit_training
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT / "serving"))
+
+from loader import load_causal_lm, load_tokenizer, resident_bytes  # noqa: E402
+
+RUN_CONFIG = "autotune.json"
+
+# what the trainers used before any tuning; also the fallback when no run config exists
+HAND_SET = {
+    "per_device_train_batch_size": 1,
+    "gradient_accumulation_steps": 8,
+    "gradient_checkpointing": True,
+    "max_len": 1024,
+}
+
+
+def load_run_config(run_dir: str, defaults: dict = None) -> dict:
+    """Training settings from <run_dir>/autotune.json when scripts/autotune.py has written one, else the defaults."""
+    cfg = dict(defaults or HAND_SET)
+    path = Path(run_dir) / RUN_CONFIG
+    if path.exists():
+        tuned = json.loads(path.read_text(encoding="utf-8"))
+        cfg.update({k: tuned[k] for k in HAND_SET if k in tuned})
+        print(f"Using tuned run config {path}: {cfg}")
+    return cfg
+
+
+def record_text(example: dict, tokenizer) -> str:
+    """Chapter records carry "text"; router records are chat messages + response (as in train_router_lora.py)."""
+    if "text" in example:
+        return example["text"]
+    prompt = tokenizer.apply_chat_template(example["messages"], tokenize=False, add_generation_prompt=True)
+    return prompt + example["response"].strip() + "\n"
+
+
+def length_stats(train_file: str, tokenizer, sample: int) -> dict:
+    lines = [ln for ln in Path(train_file).read_text(encoding="utf-8").splitlines() if ln.strip()]
+    step = max(1, len(lines) // sample)
+    lengths = sorted(len(tokenizer(record_text(json.loads(ln), tokenizer))["input_ids"]) for ln in lines[::step])
+    pct = {f"p{q}": lengths[min(len(lengths) - 1, int(q / 100 * len(lengths)))] for q in (50, 90, 95, 99)}
+    return dict(pct, max=lengths[-1], records=len(lengths), lengths=lengths)
+
+
+def choose_max_len(stats: dict, percentile: int, cap: int, multiple: int = 64) -> int:
+    target = stats["max"] if percentile >= 100 else stats[f"p{percentile}"]
+    return min(cap, max(multiple, int(math.ceil(target / multiple) * multiple)))
+
+
+def release_freed_memory():
+    """Hands freed heap pages back to the OS so RSS measures the next probe, not an earlier high-water mark."""
+    try:
+        ctypes.CDLL("libc.so.6").malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
+
+
+class PeakMemory:
+    """Peak CUDA allocation, or peak process RSS sampled on a thread (CPU has no allocator counter to reset)."""
+
+    def __init__(self, device: str):
+        self.device = device
+        self.read = lambda: resident_bytes(device)
+        self.peak = 0
+        self._stop = threading.Event()
+
+    def _sample(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, self.read())
+            time.sleep(0.002)
+
+    def __enter__(self):
+        if self.device == "cuda":
+            torch.cuda.reset_peak_memory_stats()
+        else:
+            release_freed_memory()
+            self.peak = self.read()
+            self._thread = threading.Thread(target=self._sample, daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        if self.device == "cuda":
+            self.peak = torch.cuda.max_memory_allocated()
+        else:
+            self._stop.set()
+            self._thread.join()
+            self.peak = max(self.peak, self.read())
+
+
+def default_budget_mb(device: str) -> float:
+    """90% of the GPU, or 80% of (current RSS + MemAvailable) on CPU."""
+    if device == "cuda":
+        return torch.cuda.get_device_properties(0).total_memory * 0.9 / 2**20
+    avail = 0
+    with open("/proc/meminfo", "r") as f:
+        for line in f:
+            if line.startswith("MemAvailable:"):
+                avail = int(line.split()[1]) * 1024
+    return (resident_bytes("cpu") + avail) * 0.8 / 2**20
+
+
+def build_model(base_model: str, device: str, quant: str):
+    """Same model setup as the trainers (QLoRA prep + r=16 LoRA on all seven projections)."""
+    model = load_causal_lm(base_model, device=device, quant=quant)
+    model.config.use_cache = False
+    model = prepare_model_for_kbit_training(model, use_gradient_checkpointing=False)
+    model = get_peft_model(model, LoraConfig(
+        r=16, lora_alpha=32, lora_dropout=0.05, bias="none", task_type="CAUSAL_LM",
+        target_modules=["q_proj", "k_proj", "v_proj", "o_proj", "gate_proj", "up_proj", "down_proj"],
+    ))
+    return model
+
+
+def probe(model, device: str, batch_size: int, max_len: int, ckpt: bool, steps: int) -> dict:
+    """`steps` optimizer steps on a worst-case batch (every row max_len tokens); the first is warm-up."""
+    if ckpt:
+        model.gradient_checkpointing_enable(gradient_checkpointing_kwargs={"use_reentrant": False})
+    else:
+        model.gradient_checkpointing_disable()
+    model.train()
+    vocab = model.config.vocab_size
+    dev = next(model.parameters()).device
+    ids = torch.randint(0, vocab, (batch_size, max_len), device=dev)
+    opt = torch.optim.AdamW([p for p in model.parameters() if p.requires_grad], lr=1e-5)
+    try:
+        with PeakMemory(device) as mem:
+            t_timed = 0.0
+            for i in range(steps):
+                t0 = time.perf_counter()
+                loss = model(input_ids=ids, labels=ids).loss
+                loss.backward()
+                opt.step()
+                opt.zero_grad(set_to_none=True)
+                if device == "cuda":
+                    torch.cuda.synchronize()
+                if i > 0 or steps == 1:
+                    t_timed += time.perf_counter() - t0
+        timed_steps = max(1, steps - 1)
+        return {"batch_size": batch_size, "gradient_checkpointing": ckpt, "fits": True,
+                "peak_mb": round(mem.peak / 2**20, 1),
+                "tokens_per_s": round(batch_size * max_len * timed_steps / max(1e-9, t_timed), 1)}
+    except torch.cuda.OutOfMemoryError:
+        return {"batch_size": batch_size, "gradient_checkpointing": ckpt, "fits": False, "peak_mb": None,
+                "error": "CUDA out of memory"}
+    finally:
+        del opt
+        model.zero_grad(set_to_none=True)
+        if device == "cuda":
+            torch.cuda.empty_cache()
+
+
+def batch_sizes(effective_batch: int, max_batch: int):
+    """Micro-batches that divide the effective batch exactly, so accumulation keeps it (and the LR) unchanged."""
+    return [b for b in range(1, min(effective_batch, max_batch) + 1) if effective_batch % b == 0]
+
+
+def sweep(model, device: str, max_len: int, budget_mb: float, ckpt: bool, sizes, steps: int):
+    """
+    Tries the micro-batch `sizes` in increasing order until a probe exceeds
+    the budget. Before each probe, peak memory is extrapolated linearly from
+    the previous ones and the probe is skipped when the estimate is over
+    budget, so a CPU run never grows into the OOM killer.
+    """
+    idle_mb = resident_bytes(device) / 2**20
+    results = []
+    for bs in sizes:
+        fitted = [r for r in results if r["fits"]]
+        if fitted:
+            last = fitted[-1]
+            per_row = (last["peak_mb"] - idle_mb) / last["batch_size"]
+            if len(fitted) > 1:
+                prev = fitted[-2]
+                per_row = (last["peak_mb"] - prev["peak_mb"]) / (last["batch_size"] - prev["batch_size"])
+            predicted = last["peak_mb"] + per_row * (bs - last["batch_size"])
+            if predicted > budget_mb:
+                results.append({"batch_size": bs, "gradient_checkpointing": ckpt, "fits": False,
+                                "peak_mb": None, "skipped": f"predicted {predicted:.0f} MB > budget"})
+                break
+        res = probe(model, device, bs, max_len, ckpt, steps)
+        if res["fits"] and res["peak_mb"] > budget_mb:
+            res["fits"] = False
+        results.append(res)
+        print(json.dumps(res))
+        if not res["fits"]:
+            break
+    return results
+
+
+def main():
+    p = argparse.ArgumentParser(description="Pick micro-batch, gradient checkpointing and max length for a LoRA run.")
+    p.add_argument("--train_file", type=str, required=True)
+    p.add_argument("--run_dir", type=str, required=True, help="The trainer's output dir; autotune.json is written here.")
+    p.add_argument("--base_model", type=str, default="Qwen/Qwen2.5-7B-Instruct")
+    p.add_argument("--device", type=str, default="cuda", choices=["cuda", "cpu"])
+    p.add_argument("--quant", type=str, default="nf4", choices=["nf4", "none"])
+    p.add_argument("--budget_mb", type=float, default=0.0,
+                   help="Peak memory budget (GPU allocation or CPU RSS); 0 = 90%% of the GPU / 80%% of available RAM.")
+    p.add_argument("--percentile", type=int, default=99, help="max_len covers this percentile of record lengths.")
+    p.add_argument("--max_len_cap", type=int, default=1024)
+    p.add_argument("--effective_batch", type=int, default=8,
+                   help="micro-batch x grad accumulation is kept at exactly this; only its divisors are probed.")
+    p.add_argument("--max_batch", type=int, default=64)
+    p.add_argument("--steps", type=int, default=3, help="Optimizer steps per probe (the first is warm-up).")
+    p.add_argument("--sample", type=int, default=2000, help="Records tokenized for the length percentiles.")
+    args = p.parse_args()
+
+    if args.effective_batch < 1:
+        p.error("--effective_batch must be at least 1")
+    if args.device == "cuda" and not torch.cuda.is_available():
+        raise RuntimeError("CUDA not available but --device=cuda was set.")
+
+    tokenizer = load_tokenizer(args.base_model, padding_side="right")
+    stats = length_stats(args.train_file, tokenizer, args.sample)
+    lengths = stats.pop("lengths")
+    max_len = choose_max_len(stats, args.percentile, args.max_len_cap)
+    stats["truncated_fraction"] = round(sum(n > max_len for n in lengths) / len(lengths), 4)
+    budget = args.budget_mb or default_budget_mb(args.device)
+    print(f"max_len={max_len} from lengths {stats}; budget {budget:.0f} MB")
+
+    model = build_model(args.base_model, args.device, args.quant)
+    sizes = batch_sizes(args.effective_batch, args.max_batch)
+    probes = []
+    for ckpt in (False, True):
+        probes += sweep(model, args.device, max_len, budget, ckpt, sizes, args.steps)
+
+    fitting = [r for r in probes if r["fits"]]
+    if not fitting:
+        raise RuntimeError(f"No configuration fits in {budget:.0f} MB at max_len={max_len}; "
+                           f"lower --max_len_cap or raise --budget_mb.")
+    best = max(fitting, key=lambda r: r["tokens_per_s"])
+    cfg = {
+        "per_device_train_batch_size": best["batch_size"],
+        "gradient_accumulation_steps": args.effective_batch // best["batch_size"],
+        "gradient_checkpointing": best["gradient_checkpointing"],
+        "max_len": max_len,
+        "effective_batch": args.effective_batch,
+        "tokens_per_s": best["tokens_per_s"],
+        "peak_mb": best["peak_mb"],
+        "budget_mb": round(budget, 1),
+        "device": args.device,
+        "quant": args.quant,
+        "base_model": args.base_model,
+        "train_file": args.train_file,
+        "lengths": stats,
+        "probes": probes,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+    out = Path(args.run_dir) / RUN_CONFIG
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps(cfg, indent=2), encoding="utf-8")
+    print(json.dumps({k: cfg[k] for k in HAND_SET}, indent=2))
+    print(f"Wrote {out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,42 +1,39 @@
-import torch
+"""Train the growth and depreciation LoRA adapter (paths in the Config section)."""
+import sys
+from pathlib import Path
+
 from datasets import load_dataset
 from transformers import (
     AutoTokenizer,
-    AutoModelForCausalLM,
     TrainingArguments,
     Trainer,
     DataCollatorForLanguageModeling,
-    BitsAndBytesConfig,
 )
 from peft import LoraConfig, get_peft_model, prepare_model_for_kbit_training
 
+ROOT = Path(__file__).resolve().parents[2]
+sys.path.insert(0, str(ROOT / "serving"))
+sys.path.insert(0, str(ROOT / "scripts"))
+
+from loader import load_causal_lm  # noqa: E402
+from autotune import load_run_config  # noqa: E402
+
 # ------------------ Config ------------------
 BASE = "Qwen/Qwen2.5-7B-Instruct"
 TRAIN_FILE = "data/growth_depreciation/processed/train.jsonl"  # <- your Growth/Depreciation dataset
 ADAPTER_OUT = "adapters/growth_depr_v1"
-
-# 4-bit load (QLoRA style)
-bnb_config = BitsAndBytesConfig(
-    load_in_4bit=True,
-    bnb_4bit_quant_type="nf4",
-    bnb_4bit_use_double_quant=True,
-    bnb_4bit_compute_dtype=torch.float16,
-)
+RUN_DIR = "runs/growth_depr_v1"
+RUN = load_run_config(RUN_DIR)  # micro-batch, checkpointing and max length from scripts/autotune.py
 
 # ------------------ Tokenizer ------------------
 tokenizer = AutoTokenizer.from_pretrained(BASE, use_fast=True)
 
 # ------------------ Model ------------------
-model = AutoModelForCausalLM.from_pretrained(
-    BASE,
-    quantization_config=bnb_config,
-    device_map={"": 0},       # <-- IMPORTANT for CPU/GPU mapping
-    attn_implementation="sdpa",
-)
+model = load_causal_lm(BASE)
 model.config.use_cache = False  # important for training
 
 # Prepare for k-bit training
-model = prepare_model_for_kbit_training(model)
+model = prepare_model_for_kbit_training(model, use_gradient_checkpointing=RUN["gradient_checkpointing"])
 
 # ------------------ LoRA ------------------
 lora_config = LoraConfig(
@@ -54,7 +51,7 @@ model.print_trainable_parameters()
 # ------------------ Dataset ------------------
 ds = load_dataset("json", data_files=TRAIN_FILE, split="train")
 
-MAX_LEN = 1024
+MAX_LEN = RUN["max_len"]
 
 def tokenize_fn(batch):
     out = tokenizer(
@@ -72,9 +69,9 @@ collator = DataCollatorForLanguageModeling(tokenizer=tokenizer, mlm=False)
 
 # ------------------ Training ------------------
 args = TrainingArguments(
-    output_dir="runs/growth_depr_v1",
-    per_device_train_batch_size=1,
-    gradient_accumulation_steps=8,
+    output_dir=RUN_DIR,
+    per_device_train_batch_size=RUN["per_device_train_batch_size"],
+    gradient_accumulation_steps=RUN["gradient_accumulation_steps"],
     num_train_epochs=3,
     learning_rate=2e-4,
     fp16=True,
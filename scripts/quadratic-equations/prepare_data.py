@@ -1,3 +1,4 @@
+"""Flatten the raw quadratic equations chat records into processed/train.jsonl text rows."""
 import json
 from pathlib import Path
 
@@ -1,23 +1,20 @@
-import torch
-from transformers import AutoTokenizer, AutoModelForCausalLM, BitsAndBytesConfig
+"""Sample one arithmetic word problem from the NF4 base model on GPU."""
+import sys
+from pathlib import Path
 
-MODEL_NAME = "Qwen/Qwen2.5-7B-Instruct"
+from transformers import AutoTokenizer
 
-bnb_config = BitsAndBytesConfig(
-    load_in_4bit=True,
-    bnb_4bit_quant_type="nf4",
-    bnb_4bit_use_double_quant=True,
-    bnb_4bit_compute_dtype=torch.float16,
-)
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT / "serving"))
+
+from loader import load_causal_lm  # noqa: E402
+
+MODEL_NAME = "Qwen/Qwen2.5-7B-Instruct"
 
 tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME, use_fast=True)
 
-model = AutoModelForCausalLM.from_pretrained(
-    MODEL_NAME,
-    quantization_config=bnb_config,
-    device_map="cuda",            # IMPORTANT: keep it on GPU
-    attn_implementation="sdpa",   # good default
-)
+# NF4 on GPU; loads models/<name>-nf4 directly when serving/export_quantized.py has been run
+model = load_causal_lm(MODEL_NAME, device_map="cuda")
 
 prompt = "Write one Grade 10 arithmetic word problem."
 inputs = tokenizer(prompt, return_tensors="pt").to("cuda")
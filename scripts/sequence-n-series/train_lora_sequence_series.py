@@ -1,15 +1,23 @@
-import torch
+"""Train the sequence and series LoRA adapter (paths in the Config section)."""
+import sys
+from pathlib import Path
+
 from datasets import load_dataset
 from transformers import (
     AutoTokenizer,
-    AutoModelForCausalLM,
     TrainingArguments,
     Trainer,
     DataCollatorForLanguageModeling,
-    BitsAndBytesConfig,
 )
 from peft import LoraConfig, get_peft_model, prepare_model_for_kbit_training
 
+ROOT = Path(__file__).resolve().parents[2]
+sys.path.insert(0, str(ROOT / "serving"))
+sys.path.insert(0, str(ROOT / "scripts"))
+
+from loader import load_causal_lm  # noqa: E402
+from autotune import load_run_config  # noqa: E402
+
 # ---------------- Config ----------------
 
 BASE = "Qwen/Qwen2.5-7B-Instruct"
@@ -17,34 +25,21 @@ BASE = "Qwen/Qwen2.5-7B-Instruct"
 TRAIN_FILE = "data/sequence_series/processed/train.jsonl"
 ADAPTER_OUT = "adapters/sequence_series_v1"
 RUN_DIR = "runs/sequence_series_v1"
+RUN = load_run_config(RUN_DIR)  # micro-batch, checkpointing and max length from scripts/autotune.py
 
-MAX_LEN = 1024
-
-# ---------------- Quantization ----------------
-
-bnb_config = BitsAndBytesConfig(
-    load_in_4bit=True,
-    bnb_4bit_quant_type="nf4",
-    bnb_4bit_use_double_quant=True,
-    bnb_4bit_compute_dtype=torch.float16,
-)
+MAX_LEN = RUN["max_len"]
 
 # ---------------- Load tokenizer & model ----------------
 
 tokenizer = AutoTokenizer.from_pretrained(BASE, use_fast=True)
 
-model = AutoModelForCausalLM.from_pretrained(
-    BASE,
-    quantization_config=bnb_config,
-    device_map={"": 0},           # IMPORTANT
-    attn_implementation="sdpa",
-)
+model = load_causal_lm(BASE)
 
 model.config.use_cache = False   # IMPORTANT for training
 
 # ---------------- Prepare for QLoRA ----------------
 
-model = prepare_model_for_kbit_training(model)
+model = prepare_model_for_kbit_training(model, use_gradient_checkpointing=RUN["gradient_checkpointing"])
 
 lora_config = LoraConfig(
     r=16,
@@ -90,8 +85,8 @@ collator = DataCollatorForLanguageModeling(
 
 args = TrainingArguments(
     output_dir=RUN_DIR,
-    per_device_train_batch_size=1,
-    gradient_accumulation_steps=8,
+    per_device_train_batch_size=RUN["per_device_train_batch_size"],
+    gradient_accumulation_steps=RUN["gradient_accumulation_steps"],
     num_train_epochs=3,
     learning_rate=2e-4,
     fp16=True,
@@ -0,0 +1,209 @@
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterable
+
+import torch
+from peft import PeftConfig, get_peft_model_state_dict, set_peft_model_state_dict
+from safetensors import safe_open
+
+TIERS = ("device", "cpu", "disk")
+
+
+def state_bytes(state: Dict[str, torch.Tensor]) -> int:
+    return sum(t.numel() * t.element_size() for t in state.values())
+
+
+def read_adapter(path: str, pin: bool) -> Dict[str, torch.Tensor]:
+    """Adapter weights from <path>/adapter_model.safetensors (mmap'd), optionally copied into pinned RAM."""
+    path = Path(path)
+    st = path / "adapter_model.safetensors"
+    if st.exists():
+        with safe_open(str(st), framework="pt", device="cpu") as f:
+            state = {k: f.get_tensor(k) for k in f.keys()}
+    else:
+        state = torch.load(path / "adapter_model.bin", map_location="cpu", mmap=True, weights_only=True)
+    if pin:
+        state = {k: v.pin_memory() for k, v in state.items()}
+    return state
+
+
+class AdapterCache:
+    """
+    Three-tier LoRA adapter store for one PeftModel.
+
+    device: injected into the model (add_adapter + set_peft_model_state_dict)
+            and ready for set_adapter().
+    cpu:    the adapter state dict in RAM, pinned when CUDA is present so the
+            upload to the device can run non-blocking.
+    disk:   the adapter directory; safetensors are opened via mmap.
+
+    acquire() promotes an adapter to the device tier and evicts the least
+    recently used device adapters while the device budget is exceeded;
+    evicted adapters are demoted to the cpu tier, which has its own LRU
+    budget (dropping from cpu only forgets the copy; disk stays the source
+    of truth). prefetch() starts the disk -> cpu read on a background thread,
+    e.g. as soon as the router has predicted the chapter; only acquire()
+    touches the model, so the model stays single-threaded. Adapters listed
+    in `pinned` are never evicted; when only pinned or active adapters are
+    left and the incoming one still does not fit, it is loaded over budget
+    and the overrun is logged and counted in the report.
+    """
+
+    def __init__(self, model, device_budget_bytes: int, cpu_budget_bytes: int, pinned: Iterable[str] = ()):
+        self.model = model
+        self.device_budget = device_budget_bytes
+        self.cpu_budget = cpu_budget_bytes
+        self.pinned = set(pinned)
+        self.pin = torch.cuda.is_available()
+        self.paths: Dict[str, str] = {}
+        self.sizes: Dict[str, int] = {}
+        self.device: "OrderedDict[str, int]" = OrderedDict()
+        self.cpu: "OrderedDict[str, Dict[str, torch.Tensor]]" = OrderedDict()
+        self.lock = threading.Lock()
+        self.pending: Dict[str, Future] = {}
+        self.prefetched = set()
+        self.prefetcher = ThreadPoolExecutor(max_workers=1, thread_name_prefix="adapter-prefetch")
+        self.stats = {"requests": 0, "hits": {t: 0 for t in TIERS}, "evictions": {"device": 0, "cpu": 0},
+                      "prefetches": 0, "prefetch_hits": 0, "device_overruns": 0, "max_overrun_bytes": 0}
+        self.load_ms = {"disk_to_cpu": [], "cpu_to_device": []}
+
+    def register(self, name: str, path: str, resident: bool = False):
+        """Makes `name` known at `path`; resident=True when it is already loaded in the model."""
+        self.paths[name] = path
+        if resident:
+            self.sizes[name] = state_bytes(get_peft_model_state_dict(self.model, adapter_name=name))
+            with self.lock:
+                self.device[name] = self.sizes[name]
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.paths
+
+    def tier(self, name: str) -> str:
+        if name in self.device:
+            return "device"
+        return "cpu" if name in self.cpu else "disk"
+
+    def _read(self, name: str) -> Dict[str, torch.Tensor]:
+        t0 = time.perf_counter()
+        state = read_adapter(self.paths[name], self.pin)
+        self.load_ms["disk_to_cpu"].append((time.perf_counter() - t0) * 1000)
+        return state
+
+    def _put_cpu(self, name: str, state: Dict[str, torch.Tensor]):
+        with self.lock:
+            self.cpu[name] = state
+            self.cpu.move_to_end(name)
+            self.sizes[name] = state_bytes(state)
+            while len(self.cpu) > 1 and sum(map(state_bytes, self.cpu.values())) > self.cpu_budget:
+                self.cpu.popitem(last=False)
+                self.stats["evictions"]["cpu"] += 1
+
+    def _prefetch_job(self, name: str):
+        try:
+            with self.lock:
+                warm = name in self.cpu or name in self.device
+            if not warm:
+                self._put_cpu(name, self._read(name))
+                self.prefetched.add(name)
+        finally:
+            with self.lock:
+                self.pending.pop(name, None)
+
+    def prefetch(self, name: str):
+        """Starts reading `name` into the cpu tier in the background (no-op when already warm)."""
+        if name not in self.paths:
+            return
+        with self.lock:
+            if name in self.device or name in self.cpu or name in self.pending:
+                return
+            self.stats["prefetches"] += 1
+            self.pending[name] = self.prefetcher.submit(self._prefetch_job, name)
+
+    def acquire(self, name: str):
+        """Ensures `name` is injected into the model; call before set_adapter(name)."""
+        self.stats["requests"] += 1
+        with self.lock:
+            resident = name in self.device
+            if resident:
+                self.device.move_to_end(name)
+        if resident:
+            self.stats["hits"]["device"] += 1
+            return
+        fut = self.pending.get(name)
+        if fut is not None:
+            fut.result()
+        if name in self.prefetched:
+            self.prefetched.discard(name)
+            self.stats["prefetch_hits"] += 1
+        with self.lock:
+            state = self.cpu.get(name)
+        if state is not None:
+            self.stats["hits"]["cpu"] += 1
+        else:
+            self.stats["hits"]["disk"] += 1
+            state = self._read(name)
+            self._put_cpu(name, state)
+
+        self._make_room(self.sizes[name])
+        t0 = time.perf_counter()
+        config = PeftConfig.from_pretrained(self.paths[name])
+        config.inference_mode = True
+        self.model.add_adapter(name, config)
+        device = next(self.model.parameters()).device
+        set_peft_model_state_dict(self.model, {k: v.to(device, non_blocking=True) for k, v in state.items()},
+                                  adapter_name=name)
+        if torch.cuda.is_available():
+            torch.cuda.synchronize()
+        self.load_ms["cpu_to_device"].append((time.perf_counter() - t0) * 1000)
+        with self.lock:
+            self.device[name] = self.sizes[name]
+
+    def _make_room(self, incoming: int):
+        while True:
+            with self.lock:
+                used = sum(self.device.values())
+                if used + incoming <= self.device_budget:
+                    return
+                victim = next((n for n in self.device if n not in self.pinned and n != self.model.active_adapter),
+                              None)
+                cached = victim in self.cpu
+            if victim is None:
+                over = used + incoming - self.device_budget
+                self.stats["device_overruns"] += 1
+                self.stats["max_overrun_bytes"] = max(self.stats["max_overrun_bytes"], over)
+                print(f"[!] adapter cache: {over / 2**20:.1f} MB over the device budget; only pinned or "
+                      f"active adapters are resident ({', '.join(self.device)})")
+                return
+            if not cached:
+                state = get_peft_model_state_dict(self.model, adapter_name=victim)
+                self._put_cpu(victim, {k: v.to("cpu") for k, v in state.items()})
+            self.model.delete_adapter(victim)
+            with self.lock:
+                del self.device[victim]
+            self.stats["evictions"]["device"] += 1
+
+    def report(self) -> dict:
+        served = max(1, self.stats["requests"])
+        with self.lock:
+            cpu_bytes = sum(map(state_bytes, self.cpu.values()))
+            cpu_names = list(self.cpu)
+            device_bytes = sum(self.device.values())
+            device_names = list(self.device)
+        out = {
+            "requests": self.stats["requests"],
+            "hit_rate": {t: round(n / served, 3) for t, n in self.stats["hits"].items()},
+            "evictions": dict(self.stats["evictions"]),
+            "prefetches": self.stats["prefetches"],
+            "prefetch_hits": self.stats["prefetch_hits"],
+            "device_overruns": self.stats["device_overruns"],
+            "max_overrun_mb": round(self.stats["max_overrun_bytes"] / 2**20, 2),
+            "resident_mb": {"device": round(device_bytes / 2**20, 2), "cpu": round(cpu_bytes / 2**20, 2)},
+            "resident": {"device": device_names, "cpu": cpu_names},
+        }
+        for k, v in self.load_ms.items():
+            s = sorted(v) or [0.0]
+            out[f"{k}_ms"] = {"n": len(v), "median": round(s[len(s) // 2], 2), "max": round(s[-1], 2)}
+        return out
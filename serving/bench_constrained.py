@@ -0,0 +1,77 @@
+import argparse
+import json
+import time
+
+import torch
+
+from chapters import CHAPTERS, ROUTER_ADAPTER, MAX_NEW_TOKENS, build_mcq_prompt, build_solve_prompt, extract_json
+from engine import InferenceEngine
+from json_schema import validate
+
+
+def prompts_for(task: str, chapter: str, n: int):
+    if task == "generate_mcq":
+        return [build_mcq_prompt(chapter) for _ in range(n)]
+    return [build_solve_prompt(chapter, CHAPTERS[chapter]["sample_q"]) for _ in range(n)]
+
+
+def run(engine: InferenceEngine, task: str, n: int, batch_size: int, constrained: bool, do_sample: bool):
+    eos = engine.tokenizer.eos_token_id
+    pad = engine.tokenizer.pad_token_id
+    valid, tokens, total = 0, 0, 0
+    errors = {}
+    t0 = time.perf_counter()
+    for chapter in CHAPTERS:
+        prompts = prompts_for(task, chapter, n)
+        for s in range(0, n, batch_size):
+            ids = engine.generate_ids(chapter, prompts[s:s + batch_size], max_new_tokens=MAX_NEW_TOKENS[task],
+                                      do_sample=do_sample, constrain=task if constrained else None)
+            for row in ids.tolist():
+                used = next((i + 1 for i, t in enumerate(row) if t in (eos, pad)), len(row))
+                tokens += used
+                total += 1
+                parsed, err = extract_json(engine.tokenizer.decode(row[:used], skip_special_tokens=True))
+                err = err or validate(task, parsed)
+                if err:
+                    key = err.split(":")[0]
+                    errors[key] = errors.get(key, 0) + 1
+                else:
+                    valid += 1
+    return {
+        "outputs": total,
+        "valid_rate": round(valid / max(1, total), 3),
+        "avg_new_tokens": round(tokens / max(1, total), 1),
+        "tokens_per_valid_output": round(tokens / valid, 1) if valid else None,
+        "seconds": round(time.perf_counter() - t0, 2),
+        "errors": errors,
+    }
+
+
+def main():
+    p = argparse.ArgumentParser(description="Valid-JSON rate with and without schema-constrained decoding.")
+    p.add_argument("--base_model", type=str, default="Qwen/Qwen2.5-7B-Instruct")
+    p.add_argument("--router_adapter", type=str, default=ROUTER_ADAPTER)
+    p.add_argument("--device", type=str, default="cuda", choices=["cuda", "cpu"])
+    p.add_argument("--quant", type=str, default="nf4", choices=["nf4", "none"])
+    p.add_argument("--n", type=int, default=8, help="Generations per chapter and task.")
+    p.add_argument("--batch_size", type=int, default=8)
+    p.add_argument("--tasks", type=str, default="generate_mcq,solve")
+    p.add_argument("--greedy", action="store_true")
+    p.add_argument("--seed", type=int, default=42)
+    args = p.parse_args()
+
+    if args.device == "cuda" and not torch.cuda.is_available():
+        raise RuntimeError("CUDA not available but --device=cuda was set.")
+
+    engine = InferenceEngine(args.base_model, args.router_adapter, device=args.device, quant=args.quant)
+    report = {}
+    for task in args.tasks.split(","):
+        report[task] = {}
+        for mode, constrained in (("unconstrained", False), ("constrained", True)):
+            torch.manual_seed(args.seed)
+            report[task][mode] = run(engine, task, args.n, args.batch_size, constrained, not args.greedy)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+import argparse
+import json
+import time
+from pathlib import Path
+
+import torch
+
+from chapters import CHAPTERS, extract_json
+from cpu_int8 import configure_threads, load_cpu_model, physical_cores
+from export_merged import compare, merged_dir, probe, sample_prompts
+from json_schema import validate
+from loader import load_tokenizer
+
+TASKS = ("generate_mcq", "solve")  # the order sample_prompts alternates in
+
+
+def json_valid(tokenizer, greedy) -> str:
+    ok = 0
+    for i, ids in enumerate(greedy):
+        parsed, err = extract_json(tokenizer.decode(ids, skip_special_tokens=True))
+        ok += int(not (err or validate(TASKS[i % len(TASKS)], parsed)))
+    return f"{ok}/{len(greedy)}"
+
+
+def tok_s(res: dict) -> float:
+    return round(res["tokens"] / max(1e-9, res["seconds"]), 2)
+
+
+def thread_sweep(model, tokenizer, prompt: str, max_new_tokens: int, threads: int = 0):
+    """Decode throughput at 1, 2, 4, ... threads up to the physical core count; `threads` is restored afterwards."""
+    counts, n = [], 1
+    while n < physical_cores():
+        counts.append(n)
+        n *= 2
+    counts.append(physical_cores())
+    out = []
+    for n in counts:
+        configure_threads(n)
+        res = probe(model, tokenizer, [prompt], max_new_tokens)
+        out.append({"threads": n, "tok_s": tok_s(res), "tok_s_per_thread": round(tok_s(res) / n, 2)})
+    configure_threads(threads)
+    return out
+
+
+def main():
+    p = argparse.ArgumentParser(description="Dynamic int8 vs fp32 CPU inference of merged chapter models.")
+    p.add_argument("--base_model", type=str, default="Qwen/Qwen2.5-7B-Instruct")
+    p.add_argument("--chapters", type=str, nargs="+", default=list(CHAPTERS), choices=list(CHAPTERS))
+    p.add_argument("--merged_root", type=str, default="",
+                   help="Directory holding <base name>-<chapter>-merged; default: models/")
+    p.add_argument("--threads", type=int, default=0, help="Intra-op threads; 0 = one per physical core.")
+    p.add_argument("--n_prompts", type=int, default=4, help="Test prompts per chapter (MCQ and solve alternating).")
+    p.add_argument("--max_new_tokens", type=int, default=128)
+    p.add_argument("--thread_sweep", action="store_true", help="Also time int8 decoding at 1, 2, 4, ... threads.")
+    p.add_argument("--out", type=str, default="bench_cpu_int8.json")
+    args = p.parse_args()
+
+    report = {"threads": configure_threads(args.threads), "max_new_tokens": args.max_new_tokens, "chapters": {}}
+    totals = {"fp32": [0, 0.0], "int8": [0, 0.0]}
+    for chapter in args.chapters:
+        model_dir = merged_dir(args.base_model, chapter)
+        if args.merged_root:
+            model_dir = Path(args.merged_root) / model_dir.name
+        if not model_dir.exists():
+            report["chapters"][chapter] = f"skipped: no merged model at {model_dir} (serving/export_merged.py)"
+            print(f"[!] {report['chapters'][chapter]}")
+            continue
+        tokenizer = load_tokenizer(str(model_dir))
+        prompts = sample_prompts(chapter, args.n_prompts)
+        row, results = {}, {}
+        for name in ("fp32", "int8"):
+            model = load_cpu_model(str(model_dir), int8=name == "int8", threads=args.threads)
+            probe(model, tokenizer, prompts[:1], 4)  # warm-up
+            t0 = time.perf_counter()
+            res = results[name] = probe(model, tokenizer, prompts, args.max_new_tokens)
+            row[name] = {"load_s": model.load_report["load_s"], "rss_mb": model.load_report["rss_mb"],
+                         "tok_s": tok_s(res), "wall_s": round(time.perf_counter() - t0, 2),
+                         "json_valid": json_valid(tokenizer, res["greedy"])}
+            totals[name][0] += res["tokens"]
+            totals[name][1] += res["seconds"]
+            if name == "int8" and args.thread_sweep:
+                row["int8_thread_sweep"] = thread_sweep(model, tokenizer, prompts[-1], args.max_new_tokens,
+                                                           args.threads)
+            del model
+        row["int8_vs_fp32"] = dict(compare(results["fp32"], results["int8"]),
+                                   speedup=round(row["int8"]["tok_s"] / max(1e-9, row["fp32"]["tok_s"]), 2))
+        report["chapters"][chapter] = row
+        print(json.dumps({chapter: row}, indent=2))
+
+    if totals["fp32"][1]:
+        fp32, int8 = (totals[k][0] / totals[k][1] for k in ("fp32", "int8"))
+        report["all"] = {"fp32_tok_s": round(fp32, 2), "int8_tok_s": round(int8, 2), "speedup": round(int8 / fp32, 2)}
+    Path(args.out).write_text(json.dumps(report, indent=2), encoding="utf-8")
+    print(json.dumps(report.get("all", report["chapters"]), indent=2))
+    print(f"Wrote {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+import argparse
+import json
+import time
+
+import torch
+
+from chapters import CHAPTERS, ROUTER_ADAPTER, MAX_NEW_TOKENS, extract_json
+from bench_constrained import prompts_for
+from engine import InferenceEngine
+
+
+def used_tokens(row, stop_ids) -> int:
+    return next((i + 1 for i, t in enumerate(row) if t in stop_ids), len(row))
+
+
+def run(engine: InferenceEngine, chapter: str, task: str, n: int, stop_at_close: bool, do_sample: bool, seed: int):
+    torch.manual_seed(seed)
+    stop_ids = {engine.tokenizer.eos_token_id, engine.tokenizer.pad_token_id}
+    t0 = time.perf_counter()
+    ids = engine.generate_ids(chapter, prompts_for(task, chapter, n), max_new_tokens=MAX_NEW_TOKENS[task],
+                              do_sample=do_sample, stop_at_close=stop_at_close)
+    elapsed = time.perf_counter() - t0
+    rows = [r[:used_tokens(r, stop_ids)] for r in ids.tolist()]
+    parsed = [extract_json(engine.tokenizer.decode(r, skip_special_tokens=True)) for r in rows]
+    return elapsed, [len(r) for r in rows], [p for p, err in parsed if not err]
+
+
+def main():
+    p = argparse.ArgumentParser(description="Tokens saved by stopping at the close of the top-level JSON object.")
+    p.add_argument("--base_model", type=str, default="Qwen/Qwen2.5-7B-Instruct")
+    p.add_argument("--router_adapter", type=str, default=ROUTER_ADAPTER)
+    p.add_argument("--device", type=str, default="cuda", choices=["cuda", "cpu"])
+    p.add_argument("--quant", type=str, default="nf4", choices=["nf4", "none"])
+    p.add_argument("--n", type=int, default=4, help="Batched requests per chapter and task.")
+    p.add_argument("--sample", action="store_true", help="Sample instead of greedy (outputs then differ per run).")
+    p.add_argument("--seed", type=int, default=42)
+    args = p.parse_args()
+
+    if args.device == "cuda" and not torch.cuda.is_available():
+        raise RuntimeError("CUDA not available but --device=cuda was set.")
+
+    engine = InferenceEngine(args.base_model, args.router_adapter, device=args.device, quant=args.quant)
+    report, totals = {}, {"requests": 0, "tokens_full": 0, "tokens_stopped": 0, "s_full": 0.0, "s_stopped": 0.0}
+    for chapter in CHAPTERS:
+        for task in ("generate_mcq", "solve"):
+            s_full, full, json_full = run(engine, chapter, task, args.n, False, args.sample, args.seed)
+            s_stop, stopped, json_stop = run(engine, chapter, task, args.n, True, args.sample, args.seed)
+            report[f"{chapter}/{task}"] = {
+                "avg_tokens_full": round(sum(full) / len(full), 1),
+                "avg_tokens_stopped": round(sum(stopped) / len(stopped), 1),
+                "tokens_saved_per_request": round((sum(full) - sum(stopped)) / len(full), 1),
+                "valid_json_full": len(json_full),
+                "valid_json_stopped": len(json_stop),
+                "same_json": json_full == json_stop if not args.sample else None,
+            }
+            totals["requests"] += len(full)
+            totals["tokens_full"] += sum(full)
+            totals["tokens_stopped"] += sum(stopped)
+            totals["s_full"] += s_full
+            totals["s_stopped"] += s_stop
+
+    report["all"] = {
+        "requests": totals["requests"],
+        "tokens_saved_per_request": round((totals["tokens_full"] - totals["tokens_stopped"]) / totals["requests"], 1),
+        "tokens_saved_pct": round(100 * (1 - totals["tokens_stopped"] / max(1, totals["tokens_full"])), 1),
+        "seconds_full": round(totals["s_full"], 2),
+        "seconds_stopped": round(totals["s_stopped"], 2),
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,240 @@
+import argparse
+import importlib.util
+import json
+import resource
+import subprocess
+import sys
+import time
+from contextlib import nullcontext
+from pathlib import Path
+
+import torch
+from peft import PeftModel
+
+from chapters import CHAPTERS, MAX_NEW_TOKENS, build_mcq_prompt, build_solve_prompt, extract_json
+from json_schema import validate
+from loader import load_causal_lm, load_tokenizer
+
+QUANTS = {"nf4": None, "int8": None, "fp16": torch.float16, "bf16": torch.bfloat16, "fp32": torch.float32}
+ATTNS = ("sdpa", "eager")
+DECODINGS = ("greedy", "sample")
+RESULT = "BENCH_RESULT "
+
+
+def skip_reason(quant: str, device: str):
+    """Why a cell cannot run on this machine, or None."""
+    if quant in ("nf4", "int8"):
+        if device != "cuda":
+            return "GPU-only: bitsandbytes quantization needs CUDA"
+        if importlib.util.find_spec("bitsandbytes") is None:
+            return "bitsandbytes not installed"
+    if quant == "fp16" and device != "cuda":
+        return "GPU-only: fp16 matmuls are not a supported CPU inference path"
+    if quant == "bf16" and device == "cuda" and not torch.cuda.is_bf16_supported():
+        return "GPU has no bf16 support"
+    return None
+
+
+def prompt_set(tasks):
+    """The generators' two prompts for every chapter: (chapter, task, prompt)."""
+    out = []
+    for chapter, c in CHAPTERS.items():
+        if "generate_mcq" in tasks:
+            out.append((chapter, "generate_mcq", build_mcq_prompt(chapter)))
+        if "solve" in tasks:
+            out.append((chapter, "solve", build_solve_prompt(chapter, c["sample_q"])))
+    return out
+
+
+class FirstToken:
+    """generate() streamer that records when the first new token reaches the host (the first put() is the prompt)."""
+
+    def __init__(self):
+        self.puts = 0
+        self.t = None
+
+    def put(self, value):
+        self.puts += 1
+        if self.puts == 2:
+            self.t = time.perf_counter()
+
+    def end(self):
+        pass
+
+
+def load(args, quant: str, attn: str):
+    """Base under `quant`/`attn` plus adapters; returns (model, adapter per chapter)."""
+    model = load_causal_lm(args.base_model, device=args.device, quant="none" if QUANTS[quant] else quant,
+                           dtype=QUANTS[quant], attn_implementation=attn)
+    if args.adapter == "none":
+        return model, {}
+    if args.adapter:
+        wanted = {chapter: args.adapter for chapter in CHAPTERS}
+    else:
+        wanted = {chapter: c["adapter"] for chapter, c in CHAPTERS.items() if Path(c["adapter"]).exists()}
+    names = {}
+    for chapter, path in wanted.items():
+        name = Path(path).name
+        if name not in names.values():
+            if not isinstance(model, PeftModel):
+                model = PeftModel.from_pretrained(model, path, adapter_name=name)
+            else:
+                model.load_adapter(path, adapter_name=name)
+        names[chapter] = name
+    return model, names
+
+
+def peak_mb(device: str) -> float:
+    if device == "cuda":
+        return torch.cuda.max_memory_allocated() / 2**20
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+@torch.inference_mode()
+def run_cell(args, quant: str, attn: str, decoding: str) -> dict:
+    """One matrix cell, run in its own process so load time and peak memory are not shared with other cells."""
+    if args.device == "cuda":
+        torch.cuda.reset_peak_memory_stats()
+    t0 = time.perf_counter()
+    model, adapters = load(args, quant, attn)
+    model.eval()
+    load_s = time.perf_counter() - t0
+    tokenizer = load_tokenizer(args.base_model)
+    dev = next(model.parameters()).device
+    sample = decoding == "sample"
+
+    def generate(chapter, prompt, max_new_tokens, streamer=None):
+        # a chapter without an adapter runs on the bare base, not under whichever adapter was set last
+        scope = nullcontext()
+        if chapter in adapters:
+            model.set_adapter(adapters[chapter])
+        elif isinstance(model, PeftModel):
+            scope = model.disable_adapter()
+        ids = tokenizer(prompt, return_tensors="pt").to(dev)
+        with scope:
+            out = model.generate(**ids, max_new_tokens=max_new_tokens, do_sample=sample,
+                                 temperature=args.temperature if sample else None,
+                                 top_p=args.top_p if sample else None,
+                                 pad_token_id=tokenizer.pad_token_id, streamer=streamer)
+        return ids["input_ids"].shape[-1], out[0, ids["input_ids"].shape[-1]:]
+
+    prompts = prompt_set(args.tasks)
+    generate(prompts[0][0], prompts[0][2], 4)  # warm-up: kernels, allocator, adapter switch
+
+    prompt_tokens, new_tokens, ttft, decode_s, total_s, valid = 0, 0, [], 0.0, 0.0, 0
+    for i, (chapter, task, prompt) in enumerate(prompts):
+        torch.manual_seed(args.seed + i)
+        first = FirstToken()
+        if args.device == "cuda":
+            torch.cuda.synchronize()
+        t0 = time.perf_counter()
+        n_prompt, new = generate(chapter, prompt, args.max_new_tokens or MAX_NEW_TOKENS[task], first)
+        elapsed = time.perf_counter() - t0
+        stop = (new == tokenizer.eos_token_id) | (new == tokenizer.pad_token_id)
+        used = int(stop.nonzero()[0]) + 1 if stop.any() else new.shape[-1]
+        parsed, err = extract_json(tokenizer.decode(new[:used], skip_special_tokens=True))
+        valid += int(not (err or validate(task, parsed)))
+        first_s = (first.t or t0 + elapsed) - t0
+        prompt_tokens += n_prompt
+        new_tokens += used
+        ttft.append(first_s * 1000)
+        decode_s += elapsed - first_s
+        total_s += elapsed
+
+    ttft.sort()
+    return {
+        "load_s": round(load_s, 2),
+        "prompts": len(prompts),
+        "prompt_tokens": prompt_tokens,
+        "new_tokens": new_tokens,
+        # time to first token covers the prompt forward pass plus one sampling step
+        "prefill_tok_s": round(prompt_tokens / max(1e-9, sum(ttft) / 1000), 1),
+        "decode_tok_s": round(max(0, new_tokens - len(prompts)) / max(1e-9, decode_s), 1),
+        "ttft_ms_median": round(ttft[len(ttft) // 2], 1),
+        "ttft_ms_max": round(ttft[-1], 1),
+        "total_s": round(total_s, 2),
+        "peak_mb": round(peak_mb(args.device), 1),
+        "json_valid_rate": round(valid / len(prompts), 3),
+        "base_only_chapters": sorted({c for c, _, _ in prompts} - set(adapters)) if args.adapter != "none" else [],
+    }
+
+
+def spawn(args, cell: dict) -> dict:
+    cmd = [sys.executable, __file__, "--worker", json.dumps(dict(vars(args), **cell))]
+    proc = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    for line in reversed(proc.stdout.splitlines()):
+        if line.startswith(RESULT):
+            return dict(json.loads(line[len(RESULT):]), status="ok")
+    err = [ln for ln in proc.stderr.splitlines() if ln.strip()]
+    return {"status": "failed", "error": err[-1] if err else f"exit code {proc.returncode}"}
+
+
+def markdown(args, rows) -> str:
+    cols = [("load_s", "load s"), ("prefill_tok_s", "prefill tok/s"), ("decode_tok_s", "decode tok/s"),
+            ("ttft_ms_median", "TTFT ms (p50)"), ("peak_mb", "peak MB"), ("json_valid_rate", "JSON valid")]
+    lines = [f"Base `{args.base_model}` on {args.device}, adapter: {args.adapter or 'chapter adapters'}, "
+             f"{len(prompt_set(args.tasks))} prompts", "",
+             "| quant | attn | decoding | " + " | ".join(c[1] for c in cols) + " |",
+             "|" + "---|" * (3 + len(cols))]
+    for r in rows:
+        if r["status"] == "ok":
+            cells = [str(r[k]) for k, _ in cols]
+        else:
+            cells = [f"{r['status']}: {r.get('reason') or r.get('error')}"] + [""] * (len(cols) - 1)
+        lines.append(f"| {r['quant']} | {r['attn']} | {r['decoding']} | " + " | ".join(cells) + " |")
+    base_only = next((r["base_only_chapters"] for r in rows if r.get("base_only_chapters")), [])
+    if base_only:
+        lines += ["", f"No adapter found for {', '.join(base_only)}; their prompts ran on the bare base."]
+    return "\n".join(lines) + "\n"
+
+
+def main():
+    p = argparse.ArgumentParser(description="Load time, throughput, latency, memory and JSON validity "
+                                            "across quantization x attention x decoding.")
+    p.add_argument("--base_model", type=str, default="Qwen/Qwen2.5-7B-Instruct")
+    p.add_argument("--adapter", type=str, default="",
+                   help="Adapter dir for every prompt; default: each chapter's adapter from chapters.py; "
+                        "'none' = base only.")
+    p.add_argument("--device", type=str, default="cuda", choices=["cuda", "cpu"])
+    p.add_argument("--quants", type=str, nargs="+", default=list(QUANTS), choices=list(QUANTS))
+    p.add_argument("--attn", type=str, nargs="+", default=list(ATTNS), choices=list(ATTNS))
+    p.add_argument("--decoding", type=str, nargs="+", default=list(DECODINGS), choices=list(DECODINGS))
+    p.add_argument("--tasks", type=str, nargs="+", default=list(MAX_NEW_TOKENS), choices=list(MAX_NEW_TOKENS))
+    p.add_argument("--max_new_tokens", type=int, default=0, help="0 = the task's budget from chapters.py.")
+    p.add_argument("--temperature", type=float, default=0.7)
+    p.add_argument("--top_p", type=float, default=0.9)
+    p.add_argument("--seed", type=int, default=42)
+    p.add_argument("--out", type=str, default="bench_matrix.json")
+    p.add_argument("--markdown", type=str, default="bench_matrix.md")
+    p.add_argument("--worker", type=str, default="", help=argparse.SUPPRESS)
+    args = p.parse_args()
+
+    if args.worker:
+        cell = json.loads(args.worker)
+        print(RESULT + json.dumps(run_cell(argparse.Namespace(**cell), cell["quant"], cell["attn"], cell["decoding"])))
+        return
+    if args.device == "cuda" and not torch.cuda.is_available():
+        raise RuntimeError("CUDA not available but --device=cuda was set.")
+
+    rows = []
+    for quant in args.quants:
+        for attn in args.attn:
+            for decoding in args.decoding:
+                cell = {"quant": quant, "attn": attn, "decoding": decoding}
+                reason = skip_reason(quant, args.device)
+                row = dict(cell, status="skipped", reason=reason) if reason else dict(cell, **spawn(args, cell))
+                print(json.dumps(row))
+                rows.append(row)
+
+    report = {"base_model": args.base_model, "adapter": args.adapter or "chapter adapters", "device": args.device,
+              "prompts": len(prompt_set(args.tasks)), "max_new_tokens": args.max_new_tokens or MAX_NEW_TOKENS,
+              "created": time.strftime("%Y-%m-%dT%H:%M:%S"), "results": rows}
+    Path(args.out).write_text(json.dumps(report, indent=2), encoding="utf-8")
+    table = markdown(args, rows)
+    Path(args.markdown).write_text(table, encoding="utf-8")
+    print(table)
+    print(f"Wrote {args.out} and {args.markdown}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+import argparse
+import json
+import sys
+import time
+from contextlib import nullcontext
+
+import torch
+
+from bench_constrained import prompts_for
+from chapters import CHAPTERS, ROUTER_ADAPTER, MAX_NEW_TOKENS
+from engine import InferenceEngine
+from speculative import ModelDrafter, PromptLookupDrafter, SpeculativeDecoder, generation_eos_ids
+
+
+def sync():
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+
+
+def trim(ids, eos_ids):
+    end = next((i for i, t in enumerate(ids) if t in eos_ids), None)
+    return ids if end is None else ids[:end + 1]
+
+
+def main():
+    p = argparse.ArgumentParser(description="Speculative decoding (draft model or prompt lookup): acceptance and speedup per chapter.")
+    p.add_argument("--base_model", type=str, default="Qwen/Qwen2.5-7B-Instruct")
+    p.add_argument("--drafter", type=str, default="model", choices=["model", "prompt_lookup"],
+                   help="prompt_lookup copies n-gram continuations from the prompt; no draft model is loaded.")
+    p.add_argument("--draft_model", type=str, default="Qwen/Qwen2.5-0.5B-Instruct")
+    p.add_argument("--draft_adapter_root", type=str, default="", help="Per-chapter draft LoRAs: <root>/<adapter name>.")
+    p.add_argument("--router_adapter", type=str, default=ROUTER_ADAPTER)
+    p.add_argument("--device", type=str, default="cuda", choices=["cuda", "cpu"])
+    p.add_argument("--quant", type=str, default="nf4", choices=["nf4", "none"])
+    p.add_argument("--k", type=int, default=0, help="Tokens proposed per round (default 4 for a model, 10 for prompt lookup).")
+    p.add_argument("--n", type=int, default=2, help="Prompts per chapter and task.")
+    p.add_argument("--max_new_tokens", type=int, default=0, help="0 = the per-task serving default.")
+    p.add_argument("--sample", action="store_true", help="Also time HF assisted / prompt-lookup generation with sampling.")
+    p.add_argument("--check", action="store_true",
+                   help="Exit 1 unless speculative greedy output equals plain greedy output for every prompt.")
+    args = p.parse_args()
+
+    if args.device == "cuda" and not torch.cuda.is_available():
+        raise RuntimeError("CUDA not available but --device=cuda was set.")
+
+    lookup = args.drafter == "prompt_lookup"
+    k = args.k or (10 if lookup else 4)
+    engine = InferenceEngine(args.base_model, args.router_adapter, device=args.device, quant=args.quant,
+                             draft_model="" if lookup else args.draft_model,
+                             draft_adapter_root=args.draft_adapter_root, spec_k=k)
+    tok = engine.tokenizer
+    eos = generation_eos_ids(engine.model, tok)
+    report, mismatches, total = {}, 0, 0
+    for chapter in CHAPTERS:
+        drafter = PromptLookupDrafter() if lookup else ModelDrafter(engine.draft.model)
+        dec = SpeculativeDecoder(engine.model, drafter, eos, k=k)
+        assist = {"prompt_lookup_num_tokens": k} if lookup else {"assistant_model": engine.draft.model}
+        row = {"plain_s": 0.0, "speculative_s": 0.0, "tokens": 0, "identical": 0, "prompts": 0}
+        if args.sample:
+            row.update(plain_sample_s=0.0, assisted_sample_s=0.0)
+        for task in ("generate_mcq", "solve"):
+            max_new = args.max_new_tokens or MAX_NEW_TOKENS[task]
+            for prompt in prompts_for(task, chapter, args.n):
+                ids = tok(prompt, return_tensors="pt").to(engine.model.device)
+                draft_ctx = nullcontext() if lookup else engine.draft.use(chapter)
+                with engine.use(chapter), draft_ctx, torch.inference_mode():
+                    t0 = time.perf_counter()
+                    out = engine.model.generate(**ids, max_new_tokens=max_new, do_sample=False,
+                                                pad_token_id=tok.pad_token_id)
+                    sync()
+                    t1 = time.perf_counter()
+                    spec = dec.generate(ids["input_ids"], max_new)
+                    sync()
+                    t2 = time.perf_counter()
+                    if args.sample:
+                        kw = dict(max_new_tokens=max_new, do_sample=True, temperature=0.7, top_p=0.9,
+                                  pad_token_id=tok.pad_token_id)
+                        engine.model.generate(**ids, **kw)
+                        sync()
+                        t3 = time.perf_counter()
+                        engine.model.generate(**ids, **kw, **assist)
+                        sync()
+                        row["plain_sample_s"] += t3 - t2
+                        row["assisted_sample_s"] += time.perf_counter() - t3
+                plain = trim(out[0, ids["input_ids"].shape[-1]:].tolist(), eos)
+                row["plain_s"] += t1 - t0
+                row["speculative_s"] += t2 - t1
+                row["tokens"] += len(plain)
+                row["prompts"] += 1
+                row["identical"] += int(plain == spec)
+        mismatches += row["prompts"] - row["identical"]
+        total += row["prompts"]
+        row.update(
+            acceptance_rate=round(dec.acceptance_rate, 3),
+            tokens_per_target_forward=round(dec.stats["new_tokens"] / max(1, dec.stats["target_forwards"]), 2),
+            speedup=round(row["plain_s"] / max(1e-9, row["speculative_s"]), 2),
+        )
+        if args.sample:
+            row["assisted_sample_speedup"] = round(row["plain_sample_s"] / max(1e-9, row["assisted_sample_s"]), 2)
+        report[chapter] = {k: round(v, 3) if isinstance(v, float) else v for k, v in row.items()}
+
+    report["equivalence"] = f"{total - mismatches}/{total} identical under greedy"
+    print(json.dumps(report, indent=2))
+    if args.check and mismatches:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+import json
+
+# The generate_mcq rules every chapter test script ends with, except algebraic fractions.
+MCQ_RULES = [
+    "Provide 4 options (A,B,C,D).",
+    "Exactly ONE option is correct.",
+    "The 3 wrong options must be based on common student mistakes.",
+    "Include distractor mistake tags and short reasons.",
+]
+
+# Router label -> chapter adapter and the prompt pieces the chapter test scripts use.
+# build_mcq_prompt / build_solve_prompt reproduce each script's prompts byte for byte;
+# where a script departs from the common wording: "system_chapter" (False: the system
+# line does not name the chapter), "rules_gap" (False: no blank line after the rules)
+# and "solve_steps" (the lines between "Task: solve" and the question).
+CHAPTERS = {
+    "algebraic_fractions": {
+        "name": "Algebraic Fractions",
+        "adapter": "adapters/algebraic_fractions_v1",
+        "difficulty": 4,
+        "system_chapter": False,
+        "mcq_rules": [
+            "Create ONE NEB-style algebraic fractions question.",
+            "Expression must involve factorization and simplification.",
+            "Provide 4 options (A,B,C,D).",
+            "Exactly ONE option is correct.",
+            "Wrong options must reflect common student mistakes\n  (wrong factor, illegal cancellation, wrong identity).",
+            "Include short distractor rationales.",
+        ],
+        "solve_steps": "Chapter: Algebraic Fractions\nShow full steps clearly.",
+        "sample_q": "Simplify: (x^2 - 9)/(x - 3)",
+    },
+    "arithmetic": {
+        "name": "Arithmetic",
+        "adapter": "adapters/arithmetic_v1",
+        "difficulty": 2,
+        "mcq_rules": ["Create ONE NEB-style arithmetic word problem."] + MCQ_RULES,
+        "rules_gap": False,
+        "sample_q": "Find the simple interest on Rs 8,000 at 10% per annum for 2 years.",
+    },
+    "growth_depreciation": {
+        "name": "Growth and Depreciation",
+        "adapter": "adapters/growth_depr_v1",
+        "difficulty": 2,
+        "mcq_rules": ["Create ONE NEB-style word problem."] + MCQ_RULES,
+        "sample_q": "The population of a city is 20,000 and it grows at 5% per annum for 2 years. "
+                    "Find the population after 2 years.",
+    },
+    "probability": {
+        "name": "Probability",
+        "adapter": "adapters/probability_v1",
+        "difficulty": 2,
+        "mcq_rules": ["Create ONE NEB-style word problem."] + MCQ_RULES,
+        "sample_q": "A bag contains 5 red and 3 blue balls. Two balls are drawn without replacement. "
+                    "Find the probability that both are red.",
+    },
+    "quadratic_equations": {
+        "name": "Quadratic Equations",
+        "adapter": "adapters/quadratic_v1",
+        "difficulty": 2,
+        "mcq_rules": ["Create ONE NEB-style quadratic equation problem."] + MCQ_RULES,
+        "sample_q": "Solve: x^2 - 7x + 10 = 0",
+    },
+    "sequence_series": {
+        "name": "Sequence and Series",
+        "adapter": "adapters/sequence_series_v1",
+        "difficulty": 2,
+        "mcq_rules": ["Create ONE NEB-style word problem from arithmetic or geometric series."] + MCQ_RULES,
+        "rules_gap": False,
+        "sample_q": "Find the sum of first 10 terms of an arithmetic series with first term 3 "
+                    "and common difference 5.",
+    },
+}
+
+ROUTER_ADAPTER = "adapters/router_lora"
+
+MAX_NEW_TOKENS = {"generate_mcq": 350, "solve": 450}
+
+# the difficulty scale the generic-generators label their rows with
+DIFFICULTY_RANGE = (1, 5)
+
+
+def _for_chapter(c: dict) -> str:
+    return f" for the chapter {c['name']}" if c.get("system_chapter", True) else ""
+
+
+def build_mcq_prompt(chapter: str, difficulty: int = None) -> str:
+    c = CHAPTERS[chapter]
+    if difficulty is None:
+        difficulty = c["difficulty"]
+    rules = "\n".join(f"- {r}" for r in c["mcq_rules"])
+    gap = "\n" if c.get("rules_gap", True) else ""
+    return f"""SYSTEM:
+You are an NEB Grade 10 Mathematics question generator{_for_chapter(c)}.
+Output MUST be STRICT JSON only. No markdown, no explanation outside JSON.
+
+USER:
+Task: generate_mcq
+Chapter: {c['name']}
+Difficulty: {difficulty}
+Rules:
+{rules}
+{gap}Return JSON ONLY with keys:
+question, options, correct_option, answer_explanation, distractor_rationales, meta
+"""
+
+
+def build_solve_prompt(chapter: str, question: str) -> str:
+    c = CHAPTERS[chapter]
+    return f"""SYSTEM:
+You are an NEB Grade 10 Mathematics tutor{_for_chapter(c)}.
+Output MUST be STRICT JSON only. No markdown, no extra text.
+
+USER:
+Task: solve
+{c.get("solve_steps", "Show full steps and final answer in JSON.")}
+Question: {question.strip()}
+
+Return JSON ONLY with keys:
+given, to_find, steps, final_answer
+"""
+
+
+def extract_json(text: str):
+    """
+    Tries to extract the first JSON object from model output.
+    Useful if the model accidentally adds extra text.
+    """
+    start = text.find("{")
+    end = text.rfind("}")
+    if start == -1 or end == -1 or end <= start:
+        return None, "Could not find JSON braces in output."
+
+    candidate = text[start:end+1].strip()
+
+    try:
+        return json.loads(candidate), None
+    except Exception as e:
+        return candidate, f"JSON parse error: {e}"
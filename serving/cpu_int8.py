@@ -0,0 +1,111 @@
+import argparse
+import json
+import os
+import time
+from pathlib import Path
+
+import torch
+
+from chapters import CHAPTERS, MAX_NEW_TOKENS, build_mcq_prompt, build_solve_prompt, extract_json
+from export_merged import merged_dir
+from loader import load_causal_lm, load_tokenizer, resident_bytes
+
+
+def physical_cores() -> int:
+    """Cores this process may run on, counting SMT siblings once."""
+    cpus = os.sched_getaffinity(0) if hasattr(os, "sched_getaffinity") else set(range(os.cpu_count() or 1))
+    cores = set()
+    for cpu in cpus:
+        path = Path(f"/sys/devices/system/cpu/cpu{cpu}/topology/thread_siblings_list")
+        cores.add(path.read_text().strip() if path.exists() else str(cpu))
+    return max(1, len(cores))
+
+
+def configure_threads(threads: int = 0) -> dict:
+    """
+    One intra-op thread per physical core and a single inter-op thread:
+    decoding is a chain of small matmuls, so hyperthreads only contend for
+    the same FMA units and inter-op parallelism has nothing to overlap.
+    """
+    threads = threads or physical_cores()
+    torch.set_num_threads(threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        pass  # already fixed once any parallel work has run in this process
+    return {"intra_op": torch.get_num_threads(), "inter_op": torch.get_num_interop_threads(),
+            "quantized_engine": torch.backends.quantized.engine}
+
+
+def quantize_int8(model, skip=("lm_head",)):
+    """
+    PyTorch dynamic int8 quantization of every nn.Linear except `skip`:
+    weights are stored as int8 per channel, activations are quantized on
+    the fly per batch. The output head stays fp32 by default because its
+    logits decide greedy ties.
+    """
+    names = {n for n, m in model.named_modules()
+             if isinstance(m, torch.nn.Linear) and n.rsplit(".", 1)[-1] not in skip}
+    # in place: a copy would hold the fp32 and int8 weights in RAM at once
+    return torch.ao.quantization.quantize_dynamic(model, names, dtype=torch.qint8, inplace=True)
+
+
+def load_cpu_model(model_dir: str, int8: bool = True, threads: int = 0, skip=("lm_head",)):
+    """A merged chapter model (serving/export_merged.py) on CPU, fp32 or dynamic int8."""
+    report = {"threads": configure_threads(threads)}
+    t0 = time.perf_counter()
+    mem0 = resident_bytes("cpu")
+    model = load_causal_lm(model_dir, device="cpu", quant="none")
+    model.config.use_cache = True
+    model.eval()
+    if int8:
+        model = quantize_int8(model, skip)
+    report.update(int8=int8, load_s=round(time.perf_counter() - t0, 2),
+                  rss_mb=round((resident_bytes("cpu") - mem0) / 2**20, 1))
+    model.load_report = dict(getattr(model, "load_report", {}), **report)
+    return model
+
+
+@torch.inference_mode()
+def generate(model, tokenizer, prompt: str, max_new_tokens: int, do_sample: bool = False,
+             temperature: float = 0.7, top_p: float = 0.9) -> str:
+    ids = tokenizer(prompt, return_tensors="pt")
+    out = model.generate(**ids, max_new_tokens=max_new_tokens, do_sample=do_sample,
+                         temperature=temperature if do_sample else None, top_p=top_p if do_sample else None,
+                         pad_token_id=tokenizer.pad_token_id)
+    return tokenizer.decode(out[0, ids["input_ids"].shape[-1]:], skip_special_tokens=True)
+
+
+def main():
+    p = argparse.ArgumentParser(description="Serve one merged chapter model on CPU with dynamic int8 linears.")
+    p.add_argument("--base_model", type=str, default="Qwen/Qwen2.5-7B-Instruct")
+    p.add_argument("--chapter", type=str, required=True, choices=list(CHAPTERS))
+    p.add_argument("--merged", type=str, default="", help="Default: models/<base name>-<chapter>-merged")
+    p.add_argument("--task", type=str, default="solve", choices=list(MAX_NEW_TOKENS))
+    p.add_argument("--question", type=str, default="", help="For --task solve; default: the chapter's sample question.")
+    p.add_argument("--fp32", action="store_true", help="Skip quantization (reference path).")
+    p.add_argument("--threads", type=int, default=0, help="Intra-op threads; 0 = one per physical core.")
+    p.add_argument("--max_new_tokens", type=int, default=0, help="0 = the task's budget from chapters.py.")
+    p.add_argument("--sample", action="store_true")
+    args = p.parse_args()
+
+    model_dir = args.merged or str(merged_dir(args.base_model, args.chapter))
+    if not Path(model_dir).exists():
+        raise FileNotFoundError(f"No merged model at {model_dir}; run serving/export_merged.py --chapter {args.chapter}.")
+    tokenizer = load_tokenizer(model_dir)
+    model = load_cpu_model(model_dir, int8=not args.fp32, threads=args.threads)
+    print(json.dumps(model.load_report, indent=2))
+
+    if args.task == "generate_mcq":
+        prompt = build_mcq_prompt(args.chapter)
+    else:
+        prompt = build_solve_prompt(args.chapter, args.question or CHAPTERS[args.chapter]["sample_q"])
+    t0 = time.perf_counter()
+    text = generate(model, tokenizer, prompt, args.max_new_tokens or MAX_NEW_TOKENS[args.task], args.sample)
+    print(f"Generated in {time.perf_counter() - t0:.1f}s")
+    parsed, err = extract_json(text)
+    print(text if err else json.dumps(parsed, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
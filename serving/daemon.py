@@ -0,0 +1,231 @@
+import argparse
+import asyncio
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import torch
+from transformers import TextIteratorStreamer
+
+from chapters import CHAPTERS, ROUTER_ADAPTER
+from daemon_client import DEFAULT_SOCKET
+from engine import InferenceEngine
+from route_cache import RouteCache, adapter_version
+
+
+class InferenceDaemon:
+    """
+    Long-lived InferenceEngine behind a Unix domain socket.
+
+    The protocol is one JSON request per line and one or more JSON reply
+    lines per request: `generate` streams {"text": ...} chunks as tokens are
+    decoded and ends with {"done": true, ...}; `route`, `ping` and `shutdown`
+    answer with a single done line; failures answer {"error": ...}. Requests
+    run one at a time on the model thread. With a `route_cache`
+    (routing/route_cache.py, keyed by the router adapter's version), `route`
+    answers repeated questions without touching the model. The daemon exits
+    by itself after `idle_timeout` seconds without a request (0 keeps it
+    alive).
+    """
+
+    def __init__(self, engine: InferenceEngine, config: dict, idle_timeout: float,
+                 route_cache: RouteCache = None):
+        self.engine = engine
+        self.config = config
+        self.idle_timeout = idle_timeout
+        self.route_cache = route_cache
+        # the model is not thread-safe: generation runs on this single thread
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.lock = asyncio.Lock()
+        self.started = time.time()
+        self.last_active = time.monotonic()
+        self.active = 0
+        self.stats = {"requests": 0, "errors": 0}
+        self.server = None
+
+    def _ping(self):
+        return {"done": True, "pid": os.getpid(), "config": self.config,
+                "uptime_s": round(time.time() - self.started, 1), "stats": self.stats,
+                "engine": self.engine.report(),
+                "route_cache": self.route_cache.metrics() if self.route_cache is not None else None}
+
+    async def _generate(self, req: dict, writer: asyncio.StreamWriter):
+        chapter = req.get("chapter")
+        if chapter not in CHAPTERS:
+            raise ValueError(f"'chapter' must be one of: {', '.join(CHAPTERS)}")
+        prompt = req.get("prompt")
+        if not isinstance(prompt, str) or not prompt:
+            raise ValueError("'prompt' is required")
+        adapter = req.get("adapter")
+        if adapter is not None:
+            served = self.engine.adapter_paths.get(chapter)
+            if served is None or Path(served).resolve() != Path(adapter).resolve():
+                raise ValueError(f"client asked for adapter {adapter} under '{chapter}', "
+                                 f"daemon serves {Path(served).resolve() if served else 'the bare base model'}")
+        do_sample = bool(req.get("do_sample", True))
+
+        loop = asyncio.get_running_loop()
+        streamer = TextIteratorStreamer(self.engine.tokenizer, skip_prompt=True, skip_special_tokens=True)
+
+        def run():
+            try:
+                return self.engine.generate_ids(
+                    chapter, [prompt],
+                    max_new_tokens=int(req.get("max_new_tokens", 350)),
+                    do_sample=do_sample,
+                    temperature=float(req.get("temperature", 0.7)),
+                    top_p=float(req.get("top_p", 0.9)),
+                    stop_at_close=bool(req.get("stop_at_close", True)),
+                    streamer=streamer,
+                )
+            finally:
+                # unblocks the reader below if generation raised before the streamer ended
+                streamer.end()
+
+        t0 = time.perf_counter()
+        job = loop.run_in_executor(self.executor, run)
+        first_ms, parts = None, []
+        chunks = iter(streamer)
+        while True:
+            chunk = await loop.run_in_executor(None, next, chunks, None)
+            if chunk is None:
+                break
+            if not chunk:
+                continue
+            if first_ms is None:
+                first_ms = (time.perf_counter() - t0) * 1000
+            parts.append(chunk)
+            writer.write(json.dumps({"text": chunk}, ensure_ascii=False).encode("utf-8") + b"\n")
+            await writer.drain()
+        new_ids = await job
+        return {"done": True, "text": "".join(parts), "new_tokens": int(new_ids.shape[-1]),
+                "first_token_ms": round(first_ms or 0.0, 1),
+                "total_ms": round((time.perf_counter() - t0) * 1000, 1)}
+
+    async def _route(self, req: dict):
+        qs = req.get("questions")
+        if not isinstance(qs, list) or not all(isinstance(q, str) for q in qs):
+            raise ValueError("'questions' must be a list of strings")
+        def run():
+            route_fn = lambda batch: self.engine.route(batch, batch_size=max(1, len(batch)))  # noqa: E731
+            if self.route_cache is None:
+                return route_fn(qs)
+            return self.route_cache.route(qs, route_fn)
+
+        t0 = time.perf_counter()
+        res = await asyncio.get_running_loop().run_in_executor(self.executor, run)
+        return {"done": True, "total_ms": round((time.perf_counter() - t0) * 1000, 1),
+                "results": [{"label": r["label"], "probs": r["probs"], "margin": r["margin"],
+                             "cached": bool(r.get("cached"))} for r in res]}
+
+    async def handle(self, req: dict, writer: asyncio.StreamWriter):
+        op = req.get("op")
+        if op == "ping":
+            return self._ping()
+        if op == "shutdown":
+            asyncio.get_running_loop().call_soon(self.server.close)
+            return {"done": True, "pid": os.getpid()}
+        handler = {"generate": self._generate, "route": self._route}.get(op)
+        if handler is None:
+            raise ValueError(f"unknown op {op!r}")
+        async with self.lock:
+            if op == "route":
+                return await handler(req)
+            return await handler(req, writer)
+
+    async def handle_conn(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.active += 1
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                self.stats["requests"] += 1
+                try:
+                    req = json.loads(line)
+                    if not isinstance(req, dict):
+                        raise ValueError("request must be a JSON object")
+                    res = await self.handle(req, writer)
+                except Exception as e:
+                    self.stats["errors"] += 1
+                    res = {"error": f"{type(e).__name__}: {e}"}
+                writer.write(json.dumps(res, ensure_ascii=False).encode("utf-8") + b"\n")
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self.active -= 1
+            self.last_active = time.monotonic()
+            writer.close()
+
+    async def _watch_idle(self):
+        while True:
+            await asyncio.sleep(max(0.5, min(30.0, self.idle_timeout / 4)))
+            if self.active == 0 and time.monotonic() - self.last_active > self.idle_timeout:
+                print(f"Idle for {self.idle_timeout:.0f}s; shutting down.", flush=True)
+                self.server.close()
+                return
+
+    async def serve(self, socket_path: str):
+        path = Path(socket_path)
+        path.unlink(missing_ok=True)
+        self.server = await asyncio.start_unix_server(self.handle_conn, path=str(path))
+        os.chmod(path, 0o600)
+        watcher = asyncio.create_task(self._watch_idle()) if self.idle_timeout > 0 else None
+        print(f"Serving on {path} (pid {os.getpid()}, idle timeout {self.idle_timeout:.0f}s)", flush=True)
+        try:
+            async with self.server:
+                await self.server.wait_closed()
+        finally:
+            if watcher is not None:
+                watcher.cancel()
+            path.unlink(missing_ok=True)
+
+
+def main():
+    p = argparse.ArgumentParser(description="Inference daemon: one loaded base + adapters behind a Unix socket.")
+    p.add_argument("--base_model", type=str, default="Qwen/Qwen2.5-7B-Instruct")
+    p.add_argument("--router_adapter", type=str, default=ROUTER_ADAPTER)
+    p.add_argument("--device", type=str, default="cuda", choices=["cuda", "cpu"])
+    p.add_argument("--quant", type=str, default="nf4", choices=["nf4", "none"])
+    p.add_argument("--socket", type=str, default=DEFAULT_SOCKET)
+    p.add_argument("--idle_timeout", type=float, default=900.0,
+                   help="Exit after this many seconds without a request (0 = never).")
+    p.add_argument("--draft_model", type=str, default="", help="Same-tokenizer draft for speculative decoding.")
+    p.add_argument("--prompt_lookup", type=int, default=0, help="Prompt-lookup drafting with this many tokens (no draft model).")
+    p.add_argument("--device_adapter_mb", type=float, default=0.0,
+                   help="Device budget for chapter adapters; 0 keeps all of them loaded.")
+    p.add_argument("--cpu_adapter_mb", type=float, default=2048.0, help="CPU RAM budget for warm adapters.")
+    p.add_argument("--route_cache_size", type=int, default=10_000,
+                   help="Route cache entries keyed on normalized question text (0 disables).")
+    p.add_argument("--route_cache_ttl", type=float, default=7 * 24 * 3600)
+    p.add_argument("--route_cache_db", type=str, default="",
+                   help="Optional SQLite file shared with other router processes.")
+    args = p.parse_args()
+
+    if args.device == "cuda" and not torch.cuda.is_available():
+        raise RuntimeError("CUDA not available but --device=cuda was set.")
+
+    engine = InferenceEngine(args.base_model, args.router_adapter, device=args.device, quant=args.quant,
+                             draft_model=args.draft_model, prompt_lookup=args.prompt_lookup,
+                             device_adapter_mb=args.device_adapter_mb, cpu_adapter_mb=args.cpu_adapter_mb)
+    print(json.dumps(engine.report(), indent=2), flush=True)
+    config = {"base_model": args.base_model, "router_adapter": args.router_adapter,
+              "device": args.device, "quant": args.quant, "draft_model": args.draft_model,
+              "route_cache_size": args.route_cache_size, "route_cache_ttl": args.route_cache_ttl,
+              "route_cache_db": args.route_cache_db}
+    route_cache = None
+    if args.route_cache_size > 0 or args.route_cache_db:
+        route_cache = RouteCache(adapter_version(args.router_adapter), max_entries=max(1, args.route_cache_size),
+                                 ttl_s=args.route_cache_ttl, db_path=args.route_cache_db or None)
+    daemon = InferenceDaemon(engine, config, args.idle_timeout, route_cache=route_cache)
+    try:
+        asyncio.run(daemon.serve(args.socket))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+import argparse
+import fcntl
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+# stdlib only: a client must start in milliseconds, so torch and the model live in the daemon
+ROOT = Path(__file__).resolve().parents[1]
+DAEMON = ROOT / "serving" / "daemon.py"
+DEFAULT_SOCKET = os.environ.get("MATH_ADAPTERS_SOCKET",
+                                str(Path(tempfile.gettempdir()) / f"math-adapters-{os.getuid()}.sock"))
+T_START = time.perf_counter()
+
+
+class DaemonError(RuntimeError):
+    pass
+
+
+class DaemonClient:
+    """
+    Thin client for serving/daemon.py.
+
+    Connecting to a socket nobody listens on starts the daemon in the
+    background (one spawner at a time, guarded by a lock file next to the
+    socket) and waits until it answers a ping. A running daemon loaded with a
+    different base model, device, quantization (or router adapter, draft
+    model or route cache settings, when asked for) is an error rather than a
+    silent mismatch,
+    as is a generate request whose adapter path differs from the one the
+    daemon serves for that chapter; stop it with
+    `python serving/daemon_client.py stop`.
+    """
+
+    def __init__(self, socket_path: str = DEFAULT_SOCKET, base_model: str = "Qwen/Qwen2.5-7B-Instruct",
+                 device: str = "cuda", quant: str = "nf4", router_adapter: str = None, draft_model: str = "",
+                 route_cache: dict = None, idle_timeout: float = 900.0, startup_timeout: float = 1800.0):
+        self.socket_path = socket_path
+        self.want = {"base_model": base_model, "device": device, "quant": quant}
+        if router_adapter is not None:
+            self.want["router_adapter"] = router_adapter
+        if draft_model:
+            self.want["draft_model"] = draft_model
+        if route_cache:
+            self.want.update(route_cache)
+        self.idle_timeout = idle_timeout
+        self.startup_timeout = startup_timeout
+        self.spawned = False
+        self.info = None
+
+    def start(self) -> "DaemonClient":
+        """Connects to the daemon, spawning it first when none is listening."""
+        info = self._ping_or_spawn()
+        have = {k: info["config"].get(k) for k in self.want}
+        if have != self.want:
+            raise DaemonError(f"daemon on {self.socket_path} serves {have}, this client wants {self.want}; "
+                              f"stop it with `python serving/daemon_client.py stop --socket {self.socket_path}`")
+        self.info = info
+        return self
+
+    def _connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.socket_path)
+        except OSError:
+            sock.close()
+            raise
+        return sock
+
+    def request(self, req: dict):
+        """Sends one request and yields every reply line; raises DaemonError on an error reply."""
+        with self._connect() as sock, sock.makefile("rwb") as f:
+            f.write(json.dumps(req, ensure_ascii=False).encode("utf-8") + b"\n")
+            f.flush()
+            for line in f:
+                msg = json.loads(line)
+                if "error" in msg:
+                    raise DaemonError(msg["error"])
+                yield msg
+                if msg.get("done"):
+                    return
+        raise DaemonError("daemon closed the connection mid-request")
+
+    def call(self, req: dict) -> dict:
+        for msg in self.request(req):
+            if msg.get("done"):
+                return msg
+
+    def ping(self):
+        try:
+            return self.call({"op": "ping"})
+        except (FileNotFoundError, ConnectionRefusedError):
+            return None
+
+    def _ping_or_spawn(self):
+        info = self.ping()
+        if info is not None:
+            return info
+        with open(self.socket_path + ".lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            info = self.ping()  # another client may have started it while we waited for the lock
+            if info is not None:
+                return info
+            Path(self.socket_path).unlink(missing_ok=True)  # stale socket from a crashed daemon
+            log_path = self.socket_path + ".log"
+            cmd = [sys.executable, str(DAEMON), "--socket", self.socket_path,
+                   "--idle_timeout", str(self.idle_timeout)]
+            for k, v in self.want.items():
+                cmd += [f"--{k}", str(v)]
+            print(f"[daemon] starting: {' '.join(cmd)} (log: {log_path})", file=sys.stderr)
+            with open(log_path, "ab") as log:
+                proc = subprocess.Popen(cmd, cwd=ROOT, stdin=subprocess.DEVNULL, stdout=log,
+                                        stderr=subprocess.STDOUT, start_new_session=True)
+            self.spawned = True
+            deadline = time.monotonic() + self.startup_timeout
+            while time.monotonic() < deadline:
+                if proc.poll() is not None:
+                    raise DaemonError(f"daemon exited with code {proc.returncode} during startup; "
+                                      f"see {log_path}:\n{_tail(log_path)}")
+                info = self.ping()
+                if info is not None:
+                    return info
+                time.sleep(0.2)
+            raise DaemonError(f"daemon did not answer within {self.startup_timeout:.0f}s; see {log_path}")
+
+    def generate(self, chapter: str, prompt: str, max_new_tokens: int = 350, do_sample: bool = True,
+                 temperature: float = 0.7, top_p: float = 0.9, stream=None, adapter: str = None) -> str:
+        """
+        Generates under `chapter`'s adapter and returns the new text. Chunks
+        are written to `stream` (e.g. sys.stdout) as they arrive, followed by a
+        timing line on stderr. With `adapter`, the daemon refuses the request
+        unless that is the adapter it serves for `chapter`.
+        """
+        t0 = time.perf_counter()
+        first = None
+        for msg in self.request({"op": "generate", "chapter": chapter, "prompt": prompt,
+                                 "max_new_tokens": max_new_tokens, "do_sample": do_sample,
+                                 "temperature": temperature, "top_p": top_p,
+                                 **({"adapter": str(Path(adapter).resolve())} if adapter else {})}):
+            if "text" in msg and not msg.get("done"):
+                if first is None:
+                    first = time.perf_counter()
+                if stream is not None:
+                    stream.write(msg["text"])
+                    stream.flush()
+            elif msg.get("done"):
+                if stream is not None:
+                    stream.write("\n")
+                    t_end = time.perf_counter()
+                    first = first or t_end
+                    print(f"[daemon] first token {(first - t0) * 1000:.0f} ms after request "
+                          f"({first - T_START:.2f}s after start), "
+                          f"{msg['new_tokens']} tokens in {(t_end - t0) * 1000:.0f} ms", file=sys.stderr)
+                return msg["text"]
+
+    def route(self, questions):
+        return self.call({"op": "route", "questions": list(questions)})["results"]
+
+    def shutdown(self):
+        return self.call({"op": "shutdown"})
+
+
+def _tail(path: str, n: int = 20) -> str:
+    try:
+        return "\n".join(Path(path).read_text(errors="replace").splitlines()[-n:])
+    except OSError:
+        return ""
+
+
+def add_client_args(p: argparse.ArgumentParser, base_model: str):
+    """Flags shared by the entry points that talk to the daemon (or run in-process with --local)."""
+    p.add_argument("--local", action="store_true", help="Load the model in this process instead of using the daemon.")
+    p.add_argument("--socket", type=str, default=DEFAULT_SOCKET)
+    p.add_argument("--base_model", type=str, default=base_model)
+    p.add_argument("--device", type=str, default="cuda", choices=["cuda", "cpu"])
+    p.add_argument("--quant", type=str, default="nf4", choices=["nf4", "none"])
+    p.add_argument("--idle_timeout", type=float, default=900.0,
+                   help="Seconds a daemon started by this client stays up without requests.")
+
+
+def client_from_args(args, router_adapter: str = None, draft_model: str = "", route_cache: dict = None) -> DaemonClient:
+    return DaemonClient(args.socket, base_model=args.base_model, device=args.device, quant=args.quant,
+                        router_adapter=router_adapter, draft_model=draft_model, route_cache=route_cache,
+                        idle_timeout=args.idle_timeout).start()
+
+
+def main():
+    p = argparse.ArgumentParser(description="Inspect or stop the inference daemon.")
+    p.add_argument("command", choices=["status", "stop"])
+    p.add_argument("--socket", type=str, default=DEFAULT_SOCKET)
+    args = p.parse_args()
+
+    client = DaemonClient(args.socket)
+    info = client.ping()
+    if info is None:
+        print(f"No daemon listening on {args.socket}.")
+        return
+    if args.command == "stop":
+        print(json.dumps(client.shutdown()))
+    else:
+        print(json.dumps(info, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,339 @@
+import argparse
+import json
+import sys
+import time
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+from typing import List
+
+import torch
+from peft import PeftModel
+from transformers import LogitsProcessorList, StoppingCriteriaList
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT / "routing"))
+
+from router_scoring import VALID_LABELS, label_candidates, route_batch, build_prefix_cache  # noqa: E402
+from chapters import CHAPTERS, ROUTER_ADAPTER, MAX_NEW_TOKENS, build_mcq_prompt, build_solve_prompt, extract_json  # noqa: E402
+from loader import load_base, resident_bytes  # noqa: E402
+from multi_lora import MixedLora  # noqa: E402
+from adapter_cache import AdapterCache  # noqa: E402
+from json_schema import SchemaLogitsProcessor  # noqa: E402
+from json_stop import JsonCloseStop, JsonStopCriteria  # noqa: E402
+from speculative import DraftModel, ModelDrafter, PromptLookupDrafter, SpeculativeDecoder, generation_eos_ids  # noqa: E402
+
+
+class InferenceEngine:
+    """
+    One base model, many LoRA adapters.
+
+    The base is loaded once; the router and every chapter adapter are
+    registered on the same PeftModel with load_adapter(), and requests switch
+    the active adapter instead of reloading anything. Chapters whose adapter
+    directory is missing fall back to the plain base model.
+
+    With constrained=True, generate_mcq/solve decode under the task's JSON
+    schema (serving/json_schema.py), so outputs always parse. With a
+    draft_model (or prompt_lookup > 0, which drafts by copying n-grams from
+    the prompt), single unconstrained requests use speculative decoding
+    (serving/speculative.py): the own verify loop for greedy, HF assisted /
+    prompt-lookup generation for sampling.
+
+    With device_adapter_mb > 0, only the first adapter is loaded up front;
+    the rest live in an AdapterCache (serving/adapter_cache.py) that keeps
+    hot adapters on the device and warm ones in CPU RAM under LRU budgets,
+    and use() promotes the requested one on demand.
+    """
+
+    def __init__(self, base_model: str, router_adapter: str = ROUTER_ADAPTER,
+                 chapters: dict = CHAPTERS, device: str = "cuda", quant: str = "nf4",
+                 constrained: bool = False, draft_model: str = "", draft_adapter_root: str = "",
+                 spec_k: int = 4, prompt_lookup: int = 0, device_adapter_mb: float = 0.0,
+                 cpu_adapter_mb: float = 2048.0):
+        self.device = device
+        self.chapters = chapters
+        self.constrained = constrained
+        self.switch_ms: List[float] = []
+
+        t0 = time.perf_counter()
+        mem0 = resident_bytes(device)
+        base, self.tokenizer = load_base(base_model, device=device, quant=quant)
+        self.base_bytes = resident_bytes(device) - mem0
+        self.base_load_s = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        self.model = base
+        self.adapters = []
+        self.cache = None
+        self.adapter_paths = paths = {}
+        wanted = [("router", router_adapter)] + [(lab, c["adapter"]) for lab, c in chapters.items()]
+        for name, path in wanted:
+            if not path or not Path(path).exists():
+                print(f"[!] adapter '{name}' not found at {path}; using the base model for it.")
+                continue
+            if not isinstance(self.model, PeftModel):
+                self.model = PeftModel.from_pretrained(base, path, adapter_name=name)
+            elif not device_adapter_mb:
+                self.model.load_adapter(path, adapter_name=name)
+            self.adapters.append(name)
+            paths[name] = path
+        if device_adapter_mb and self.adapters:
+            self.cache = AdapterCache(self.model, int(device_adapter_mb * 2**20), int(cpu_adapter_mb * 2**20),
+                                      pinned=["router"])
+            for name in self.adapters:
+                self.cache.register(name, paths[name], resident=name == self.adapters[0])
+        self.model.eval()
+        self.adapter_load_s = time.perf_counter() - t0
+        self.adapter_bytes = resident_bytes(device) - mem0 - self.base_bytes
+
+        self._mixed = None
+        self.candidates = label_candidates(self.tokenizer)
+        with self.use("router"):
+            self.router_prefix = build_prefix_cache(self.model, self.tokenizer)
+
+        self.draft = None
+        self.speculative = None
+        self.prompt_lookup = prompt_lookup
+        eos = generation_eos_ids(self.model, self.tokenizer)
+        if draft_model:
+            self.draft = DraftModel(draft_model, self.tokenizer, device=device,
+                                    adapter_root=draft_adapter_root, chapters=chapters)
+            self.speculative = SpeculativeDecoder(self.model, ModelDrafter(self.draft.model), eos, k=spec_k)
+        elif prompt_lookup:
+            self.speculative = SpeculativeDecoder(self.model, PromptLookupDrafter(), eos, k=prompt_lookup)
+
+    @contextmanager
+    def use(self, name: str):
+        """Activates adapter `name` (or the bare base when it is not registered)."""
+        if name in self.adapters:
+            t0 = time.perf_counter()
+            if self.cache is not None:
+                self.cache.acquire(name)
+            self.model.set_adapter(name)
+            self.switch_ms.append((time.perf_counter() - t0) * 1000)
+            yield self.model
+        elif isinstance(self.model, PeftModel):
+            with self.model.disable_adapter():
+                yield self.model
+        else:
+            yield self.model
+
+    def prefetch(self, name: str):
+        """Starts loading `name` toward the device in the background (adapter cache only)."""
+        if self.cache is not None:
+            self.cache.prefetch(name)
+
+    def route(self, questions: List[str], batch_size: int = 16) -> List[dict]:
+        with self.use("router"):
+            return route_batch(self.model, self.tokenizer, questions, batch_size=batch_size,
+                               candidates=self.candidates, prefix=self.router_prefix)
+
+    def _processors(self, constrain: str, n: int, prompt_len: int, max_new_tokens: int):
+        if not constrain:
+            return None
+        return LogitsProcessorList([SchemaLogitsProcessor(self.tokenizer, [constrain] * n, prompt_len,
+                                                          max_new_tokens=max_new_tokens)])
+
+    def _stopping(self, stop_at_close: bool, n: int, prompt_len: int):
+        if not stop_at_close:
+            return None
+        return StoppingCriteriaList([JsonStopCriteria(self.tokenizer, prompt_len, n)])
+
+    @torch.inference_mode()
+    def generate_ids(self, chapter: str, prompts: List[str], max_new_tokens: int = 350,
+                     do_sample: bool = True, temperature: float = 0.7, top_p: float = 0.9,
+                     constrain: str = None, stop_at_close: bool = True, streamer=None) -> torch.Tensor:
+        """
+        Batched generation under one chapter adapter; returns the new token ids.
+        `constrain` names a task in json_schema.SCHEMAS to decode under;
+        `stop_at_close` ends each row once its top-level JSON object closes;
+        `streamer` (single prompt only) receives tokens as they are decoded.
+        """
+        inputs = self.tokenizer(prompts, return_tensors="pt", padding=True).to(self.model.device)
+        prompt_len = inputs["input_ids"].shape[-1]
+        if self.speculative is not None and len(prompts) == 1 and not constrain:
+            return self._generate_speculative(chapter, inputs, max_new_tokens, do_sample, temperature, top_p,
+                                              stop_at_close, streamer)
+        with self.use(chapter):
+            out = self.model.generate(
+                **inputs,
+                max_new_tokens=max_new_tokens,
+                do_sample=do_sample,
+                temperature=temperature if do_sample else None,
+                top_p=top_p if do_sample else None,
+                pad_token_id=self.tokenizer.pad_token_id,
+                logits_processor=self._processors(constrain, len(prompts), prompt_len, max_new_tokens),
+                stopping_criteria=self._stopping(stop_at_close, len(prompts), prompt_len),
+                streamer=streamer,
+            )
+        return out[:, prompt_len:]
+
+    def _generate_speculative(self, chapter: str, inputs, max_new_tokens: int, do_sample: bool,
+                              temperature: float, top_p: float, stop_at_close: bool,
+                              streamer=None) -> torch.Tensor:
+        prompt_len = inputs["input_ids"].shape[-1]
+        with self.use(chapter), self.draft.use(chapter) if self.draft else nullcontext():
+            if not do_sample:
+                stop = JsonCloseStop(self.tokenizer) if stop_at_close else None
+                new = self.speculative.generate(inputs["input_ids"], max_new_tokens, stop=stop, streamer=streamer)
+                return torch.tensor([new], dtype=torch.long)
+            out = self.model.generate(
+                **inputs,
+                max_new_tokens=max_new_tokens,
+                do_sample=True,
+                temperature=temperature,
+                top_p=top_p,
+                pad_token_id=self.tokenizer.pad_token_id,
+                **({"assistant_model": self.draft.model} if self.draft
+                   else {"prompt_lookup_num_tokens": self.prompt_lookup}),
+                stopping_criteria=self._stopping(stop_at_close, 1, prompt_len),
+                streamer=streamer,
+            )
+        return out[:, prompt_len:]
+
+    def generate(self, chapter: str, prompts: List[str], max_new_tokens: int = 350,
+                 do_sample: bool = True, temperature: float = 0.7, top_p: float = 0.9,
+                 constrain: str = None, stop_at_close: bool = True) -> List[str]:
+        """Batched generation under one chapter adapter; returns only the new text."""
+        new_tokens = self.generate_ids(chapter, prompts, max_new_tokens, do_sample, temperature, top_p,
+                                       constrain, stop_at_close)
+        return self.tokenizer.batch_decode(new_tokens, skip_special_tokens=True)
+
+    @torch.inference_mode()
+    def generate_mixed(self, chapters: List[str], prompts: List[str], max_new_tokens: int = 350,
+                       do_sample: bool = True, temperature: float = 0.7, top_p: float = 0.9,
+                       constrain: str = None, stop_at_close: bool = True) -> List[str]:
+        """
+        One batched generate where row i runs under chapters[i]'s adapter
+        (gathered per-row LoRA deltas over a single shared base matmul).
+        With the adapter cache the resident set changes, so rows are grouped
+        per chapter instead.
+        """
+        if self.cache is not None:
+            out = [None] * len(prompts)
+            for c in dict.fromkeys(chapters):
+                idx = [i for i, x in enumerate(chapters) if x == c]
+                raws = self.generate(c, [prompts[i] for i in idx], max_new_tokens, do_sample, temperature, top_p,
+                                     constrain, stop_at_close)
+                for i, raw in zip(idx, raws):
+                    out[i] = raw
+            return out
+        if self._mixed is None:
+            if not isinstance(self.model, PeftModel):
+                return [self.generate(c, [p], max_new_tokens, do_sample, temperature, top_p, constrain,
+                                      stop_at_close)[0]
+                        for c, p in zip(chapters, prompts)]
+            self._mixed = MixedLora(self.model, [a for a in self.adapters if a != "router"])
+
+        inputs = self.tokenizer(prompts, return_tensors="pt", padding=True).to(self.model.device)
+        prompt_len = inputs["input_ids"].shape[-1]
+        with self._mixed.rows(chapters):
+            out = self.model.generate(
+                **inputs,
+                max_new_tokens=max_new_tokens,
+                do_sample=do_sample,
+                temperature=temperature if do_sample else None,
+                top_p=top_p if do_sample else None,
+                pad_token_id=self.tokenizer.pad_token_id,
+                logits_processor=self._processors(constrain, len(prompts), prompt_len, max_new_tokens),
+                stopping_criteria=self._stopping(stop_at_close, len(prompts), prompt_len),
+            )
+        new_tokens = out[:, prompt_len:]
+        return self.tokenizer.batch_decode(new_tokens, skip_special_tokens=True)
+
+    def generate_mcq(self, chapter: str, difficulty: int = None, **kw) -> dict:
+        kw.setdefault("constrain", "generate_mcq" if self.constrained else None)
+        raw = self.generate(chapter, [build_mcq_prompt(chapter, difficulty)],
+                            max_new_tokens=kw.pop("max_new_tokens", MAX_NEW_TOKENS["generate_mcq"]), **kw)[0]
+        parsed, err = extract_json(raw)
+        return {"chapter": chapter, "raw": raw, "json": None if err else parsed, "error": err}
+
+    def solve(self, question: str, chapter: str = None, **kw) -> dict:
+        route = None
+        if chapter is None:
+            route = self.route([question])[0]
+            chapter = route["label"]
+        if chapter not in self.chapters:
+            return {"chapter": chapter, "route": route, "raw": "", "json": None,
+                    "error": "Question is outside the supported chapters."}
+        kw.setdefault("constrain", "solve" if self.constrained else None)
+        raw = self.generate(chapter, [build_solve_prompt(chapter, question)],
+                            max_new_tokens=kw.pop("max_new_tokens", MAX_NEW_TOKENS["solve"]), **kw)[0]
+        parsed, err = extract_json(raw)
+        return {"chapter": chapter, "route": route, "raw": raw, "json": None if err else parsed, "error": err}
+
+    def report(self) -> dict:
+        sw = sorted(self.switch_ms) or [0.0]
+        out = {
+            "adapters": self.adapters,
+            "base_load_s": round(self.base_load_s, 2),
+            "adapter_load_s": round(self.adapter_load_s, 2),
+            "base_mb": round(self.base_bytes / 2**20, 1),
+            "adapters_mb": round(self.adapter_bytes / 2**20, 1),
+            "resident_mb": round(resident_bytes(self.device) / 2**20, 1),
+            "switches": len(self.switch_ms),
+            "switch_ms_median": round(sw[len(sw) // 2], 4),
+            "switch_ms_max": round(sw[-1], 4),
+        }
+        if self.cache is not None:
+            out["adapter_cache"] = self.cache.report()
+        if self.speculative is not None:
+            out["speculative"] = dict(self.speculative.stats,
+                                      acceptance_rate=round(self.speculative.acceptance_rate, 3))
+        return out
+
+
+def main():
+    p = argparse.ArgumentParser(description="Route and answer questions with one shared base + all adapters.")
+    p.add_argument("--base_model", type=str, default="Qwen/Qwen2.5-7B-Instruct")
+    p.add_argument("--router_adapter", type=str, default=ROUTER_ADAPTER)
+    p.add_argument("--device", type=str, default="cuda", choices=["cuda", "cpu"])
+    p.add_argument("--quant", type=str, default="nf4", choices=["nf4", "none"])
+    p.add_argument("--constrained", action="store_true", help="Schema-constrained JSON decoding.")
+    p.add_argument("--draft_model", type=str, default="", help="Same-tokenizer draft for speculative decoding.")
+    p.add_argument("--draft_adapter_root", type=str, default="", help="Per-chapter draft LoRAs: <root>/<adapter name>.")
+    p.add_argument("--prompt_lookup", type=int, default=0, help="Prompt-lookup drafting with this many tokens (no draft model).")
+    p.add_argument("--device_adapter_mb", type=float, default=0.0,
+                   help="Device budget for chapter adapters; 0 keeps all of them loaded.")
+    p.add_argument("--cpu_adapter_mb", type=float, default=2048.0, help="CPU RAM budget for warm adapters.")
+    args = p.parse_args()
+
+    if args.device == "cuda" and not torch.cuda.is_available():
+        raise RuntimeError("CUDA not available but --device=cuda was set.")
+
+    engine = InferenceEngine(args.base_model, args.router_adapter, device=args.device, quant=args.quant,
+                             constrained=args.constrained, draft_model=args.draft_model,
+                             draft_adapter_root=args.draft_adapter_root, prompt_lookup=args.prompt_lookup,
+                             device_adapter_mb=args.device_adapter_mb, cpu_adapter_mb=args.cpu_adapter_mb)
+    print(json.dumps(engine.report(), indent=2))
+    print("\nEngine ready. Type a question (routed + solved), 'mcq <label>' for a new MCQ, or 'quit'.\n")
+
+    while True:
+        q = input("question> ").strip()
+        if not q:
+            continue
+        if q.lower() in {"quit", "exit", "q"}:
+            break
+        if q.startswith("mcq "):
+            label = q.split(maxsplit=1)[1].strip()
+            if label not in CHAPTERS:
+                print(f"Unknown chapter. Choose from: {', '.join(l for l in VALID_LABELS if l in CHAPTERS)}")
+                continue
+            res = engine.generate_mcq(label)
+        else:
+            res = engine.solve(q)
+            if res["route"] is not None:
+                r = res["route"]
+                print(f"route: {r['label']}  (p={r['probs'][r['label']]:.3f})")
+
+        if res["json"] is not None:
+            print(json.dumps(res["json"], indent=2, ensure_ascii=False))
+        else:
+            print(f"[!] {res['error']}")
+            print(res["raw"])
+
+    print(json.dumps(engine.report(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+import argparse
+import hashlib
+import json
+import time
+from pathlib import Path
+
+import torch
+from peft import PeftModel
+
+from chapters import CHAPTERS, build_mcq_prompt, build_solve_prompt
+from loader import QUANT_ROOT, base_revision, export_quantized, load_causal_lm, load_tokenizer, quantized_dir
+
+MERGED_META = "merged_meta.json"
+
+
+def merged_dir(base_model: str, chapter: str) -> Path:
+    """Default location of a merged export, e.g. models/Qwen2.5-7B-Instruct-probability-merged."""
+    return QUANT_ROOT / f"{Path(base_model).name}-{chapter}-merged"
+
+
+def adapter_digest(adapter: str) -> str:
+    h = hashlib.sha1()
+    for f in sorted(Path(adapter).glob("adapter_*")):
+        h.update(f.name.encode("utf-8"))
+        h.update(f.read_bytes())
+    return h.hexdigest()[:16]
+
+
+def sample_prompts(chapter: str, n: int):
+    prompts = [build_mcq_prompt(chapter), build_solve_prompt(chapter, CHAPTERS[chapter]["sample_q"])]
+    return [prompts[i % len(prompts)] for i in range(n)]
+
+
+def merge_adapter(base_model: str, adapter: str, out_dir: Path, device: str, quant: str,
+                  max_shard_size: str) -> dict:
+    """
+    Folds the LoRA delta into a copy of the base weights and saves sharded safetensors.
+
+    An NF4 base is dequantized first (compute dtype) so the delta lands on the
+    same rounded weights the adapter was trained against; the result is a
+    plain fp16 checkpoint (fp32 on CPU).
+    """
+    t0 = time.perf_counter()
+    model = load_causal_lm(base_model, device=device, quant=quant)
+    if getattr(model, "is_loaded_in_4bit", False):
+        model = model.dequantize()
+    model = PeftModel.from_pretrained(model, adapter).merge_and_unload()
+    out_dir.mkdir(parents=True, exist_ok=True)
+    model.save_pretrained(out_dir, safe_serialization=True, max_shard_size=max_shard_size)
+    load_tokenizer(base_model).save_pretrained(out_dir)
+    meta = {
+        "base_model": base_model,
+        "base_revision": base_revision(base_model),
+        "adapter": adapter,
+        "adapter_digest": adapter_digest(adapter),
+        "merged_from": "dequantized nf4" if quant == "nf4" and device == "cuda" else str(model.dtype),
+        "dtype": str(model.dtype),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "merge_s": round(time.perf_counter() - t0, 1),
+        "shards": len(list(out_dir.glob("*.safetensors"))),
+        "size_mb": round(sum(f.stat().st_size for f in out_dir.glob("*.safetensors")) / 2**20, 1),
+    }
+    (out_dir / MERGED_META).write_text(json.dumps(meta, indent=2, default=str), encoding="utf-8")
+    del model
+    if torch.cuda.is_available():
+        torch.cuda.empty_cache()
+    return meta
+
+
+def sync():
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+
+
+@torch.inference_mode()
+def probe(model, tokenizer, prompts, max_new_tokens: int) -> dict:
+    """Prompt logits (kept on CPU), greedy continuations and decode latency for one model."""
+    logits, greedy, seconds, tokens = [], [], 0.0, 0
+    for prompt in prompts:
+        ids = tokenizer(prompt, return_tensors="pt").to(model.device)
+        logits.append(model(**ids).logits[0].float().cpu())
+        sync()
+        t0 = time.perf_counter()
+        out = model.generate(**ids, max_new_tokens=max_new_tokens, do_sample=False,
+                             pad_token_id=tokenizer.pad_token_id)
+        sync()
+        seconds += time.perf_counter() - t0
+        new = out[0, ids["input_ids"].shape[-1]:].tolist()
+        greedy.append(new)
+        tokens += len(new)
+    return {"logits": logits, "greedy": greedy, "seconds": seconds, "tokens": tokens}
+
+
+def compare(ref: dict, merged: dict) -> dict:
+    max_abs, mean_abs, top1, n = 0.0, 0.0, 0, 0
+    for a, b in zip(ref["logits"], merged["logits"]):
+        d = (a - b).abs()
+        max_abs = max(max_abs, float(d.max()))
+        mean_abs += float(d.mean()) * a.shape[0]
+        top1 += int((a.argmax(-1) == b.argmax(-1)).sum())
+        n += a.shape[0]
+    same = sum(int(x == y) for x, y in zip(ref["greedy"], merged["greedy"]))
+    return {"logit_max_abs_diff": round(max_abs, 5), "logit_mean_abs_diff": round(mean_abs / max(1, n), 6),
+            "top1_agreement": round(top1 / max(1, n), 4),
+            "greedy_identical": f"{same}/{len(ref['greedy'])}"}
+
+
+def main():
+    p = argparse.ArgumentParser(description="Merge a chapter LoRA into the base weights for adapter-free inference.")
+    p.add_argument("--base_model", type=str, default="Qwen/Qwen2.5-7B-Instruct")
+    p.add_argument("--chapter", type=str, required=True, choices=list(CHAPTERS))
+    p.add_argument("--adapter", type=str, default="", help="Default: the chapter's adapter from chapters.py.")
+    p.add_argument("--out", type=str, default="", help="Default: models/<base name>-<chapter>-merged")
+    p.add_argument("--device", type=str, default="cuda", choices=["cuda", "cpu"])
+    p.add_argument("--quant", type=str, default="nf4", choices=["nf4", "none"],
+                   help="How the base is served; nf4 merges into the dequantized NF4 weights.")
+    p.add_argument("--requantize", action="store_true",
+                   help="Also write an NF4 export of the merged model (models/<merged name>-nf4, CUDA only).")
+    p.add_argument("--max_shard_size", type=str, default="2GB")
+    p.add_argument("--n_prompts", type=int, default=4, help="Sample prompts for the verification report.")
+    p.add_argument("--max_new_tokens", type=int, default=64, help="Greedy tokens per prompt for the latency comparison.")
+    args = p.parse_args()
+
+    if args.device == "cuda" and not torch.cuda.is_available():
+        raise RuntimeError("CUDA not available but --device=cuda was set.")
+    if args.requantize and args.device != "cuda":
+        raise RuntimeError("--requantize needs CUDA: bitsandbytes NF4 quantization is GPU-only.")
+
+    adapter = args.adapter or CHAPTERS[args.chapter]["adapter"]
+    out = Path(args.out) if args.out else merged_dir(args.base_model, args.chapter)
+    tokenizer = load_tokenizer(args.base_model)
+    prompts = sample_prompts(args.chapter, args.n_prompts)
+
+    # reference: the unmerged PEFT model exactly as it is served today
+    model = PeftModel.from_pretrained(load_causal_lm(args.base_model, device=args.device, quant=args.quant), adapter)
+    model.eval()
+    ref = probe(model, tokenizer, prompts, args.max_new_tokens)
+    del model
+    if torch.cuda.is_available():
+        torch.cuda.empty_cache()
+
+    report = {"merge": merge_adapter(args.base_model, adapter, out, args.device, args.quant, args.max_shard_size)}
+    variants = [("merged", "none")]
+    if args.requantize:
+        report["requantize"] = export_quantized(str(out), quantized_dir(str(out)))
+        variants.append(("merged_nf4", "nf4"))
+
+    ref_ms = ref["seconds"] * 1000 / max(1, ref["tokens"])
+    report["unmerged_peft"] = {"ms_per_token": round(ref_ms, 2)}
+    for name, quant in variants:
+        model = load_causal_lm(str(out), device=args.device, quant=quant)
+        model.eval()
+        res = probe(model, tokenizer, prompts, args.max_new_tokens)
+        ms = res["seconds"] * 1000 / max(1, res["tokens"])
+        report[name] = dict(compare(ref, res), ms_per_token=round(ms, 2), speedup=round(ref_ms / max(1e-9, ms), 2))
+        del model
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+    (out / "verification.json").write_text(json.dumps(report, indent=2, default=str), encoding="utf-8")
+    print(json.dumps(report, indent=2, default=str))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+import argparse
+import json
+import time
+from pathlib import Path
+
+import torch
+
+from loader import bnb_4bit_config, export_quantized, export_status, load_causal_lm, quantized_dir
+
+
+def main():
+    p = argparse.ArgumentParser(description="One-time NF4 export of the base model for fast startup.")
+    p.add_argument("--base_model", type=str, default="Qwen/Qwen2.5-7B-Instruct")
+    p.add_argument("--out", type=str, default="", help="Default: models/<base name>-nf4")
+    p.add_argument("--force", action="store_true", help="Re-export even if a matching export exists.")
+    p.add_argument("--compare", action="store_true", help="Time a cold load from the base and from the export.")
+    args = p.parse_args()
+
+    if not torch.cuda.is_available():
+        raise RuntimeError("CUDA GPU required: bitsandbytes NF4 quantization is GPU-only.")
+
+    out = Path(args.out) if args.out else quantized_dir(args.base_model)
+    reason = export_status(out, args.base_model, bnb_4bit_config())
+    if reason is None and not args.force:
+        print(f"{out} is up to date.")
+    else:
+        print(f"Exporting {args.base_model} -> {out} ({reason or 'forced'})")
+        print(json.dumps(export_quantized(args.base_model, out), indent=2, default=str))
+
+    if args.compare:
+        report = {}
+        for name, quantized in (("quantize_on_load", "/nonexistent"), ("prequantized", str(out))):
+            t0 = time.perf_counter()
+            model = load_causal_lm(args.base_model, quantized=quantized)
+            torch.cuda.synchronize()
+            report[name] = {"seconds": round(time.perf_counter() - t0, 2), "source": model.load_report["source"]}
+            del model
+            torch.cuda.empty_cache()
+        report["speedup"] = round(report["quantize_on_load"]["seconds"] / report["prequantized"]["seconds"], 2)
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
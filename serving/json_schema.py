@@ -0,0 +1,542 @@
+import json
+from typing import List, Optional
+
+import torch
+from transformers import LogitsProcessor
+
+# ---------------- Response schemas ----------------
+# Mirrors the "response" objects written by generic-generators/*.py.
+
+STRING = ("string",)
+ANY = ("any",)
+ANY_OBJECT = ("any_object",)
+
+
+def obj(*fields):
+    return ("object", list(fields))
+
+
+def array(item):
+    return ("array", item)
+
+
+def enum(*values):
+    return ("enum", list(values))
+
+
+SCHEMAS = {
+    "generate_mcq": obj(
+        ("question", STRING),
+        ("options", obj(("A", STRING), ("B", STRING), ("C", STRING), ("D", STRING))),
+        ("correct_option", enum("A", "B", "C", "D")),
+        ("answer_explanation", STRING),
+        ("distractor_rationales", ANY_OBJECT),
+        ("meta", ANY_OBJECT),
+    ),
+    "solve": obj(
+        ("given", STRING),
+        ("to_find", STRING),
+        ("steps", array(STRING)),
+        ("final_answer", STRING),
+    ),
+}
+
+REQUIRED_KEYS = {task: [k for k, _ in schema[1]] for task, schema in SCHEMAS.items()}
+
+WS = " \t\n\r"
+MAX_WS = 16
+ESCAPES = set('"\\/bfnrtu')
+NUMBER_CHARS = set("0123456789+-.eE")
+
+
+def min_value(node) -> str:
+    """Shortest JSON text that satisfies `node`."""
+    kind = node[0]
+    if kind == "string":
+        return '""'
+    if kind == "enum":
+        return '"' + min(node[1], key=len) + '"'
+    if kind == "object":
+        return "{" + ",".join(f'"{k}":{min_value(v)}' for k, v in node[1]) + "}"
+    if kind == "array":
+        return "[]"
+    if kind == "any_object":
+        return "{}"
+    return "0"
+
+
+def validate(task: str, value) -> Optional[str]:
+    """Returns None when `value` has every required top-level key of the task schema."""
+    if not isinstance(value, dict):
+        return "output is not a JSON object"
+    missing = [k for k in REQUIRED_KEYS[task] if k not in value]
+    return f"missing keys: {', '.join(missing)}" if missing else None
+
+
+class JsonState:
+    """
+    Incremental, copyable character-level acceptor for one JSON value that
+    must match a schema (fixed key order for schema objects, generic JSON
+    below ANY / ANY_OBJECT). feed(ch) returns False as soon as `ch` cannot
+    be part of any valid completion; `done` is True once the top-level value
+    is closed.
+
+    Frames on the stack are small lists so copy() stays cheap:
+      ["value", node, ws]                 expecting a value of `node`
+      ["str", allowed, buf, esc, hexleft]  inside a string (allowed: enum values or None)
+      ["obj", fields, idx, phase, ws]      schema object with fixed key order
+      ["aobj", phase, ws]                  any object
+      ["arr", item, phase, ws]             array of `item`
+      ["num", text]                        number
+      ["lit", rest]                        remaining chars of true/false/null
+    """
+
+    __slots__ = ("stack", "done", "trail_ws")
+
+    def __init__(self, schema=None):
+        self.stack = [["value", schema, 0]] if schema is not None else []
+        self.done = False
+        self.trail_ws = 0
+
+    def copy(self) -> "JsonState":
+        s = JsonState()
+        s.stack = [f[:] for f in self.stack]
+        s.done = self.done
+        s.trail_ws = self.trail_ws
+        return s
+
+    def feed_text(self, text: str) -> bool:
+        for ch in text:
+            if not self.feed(ch):
+                return False
+        return True
+
+    def _ws(self, frame, ws_index: int) -> bool:
+        frame[ws_index] += 1
+        return frame[ws_index] <= MAX_WS
+
+    def _pop(self):
+        self.stack.pop()
+        if not self.stack:
+            self.done = True
+
+    def _start_value(self, node, ch) -> bool:
+        """Replaces the top 'value' frame with the concrete frame for `ch`."""
+        kind = node[0]
+        if kind in ("string", "enum"):
+            if ch != '"':
+                return False
+            self.stack[-1] = ["str", node[1] if kind == "enum" else None, "", False, 0]
+            return True
+        if kind == "object":
+            if ch != "{":
+                return False
+            self.stack[-1] = ["obj", node[1], 0, "key" if node[1] else "end", 0]
+            return True
+        if kind == "any_object":
+            if ch != "{":
+                return False
+            self.stack[-1] = ["aobj", "first", 0]
+            return True
+        if kind == "array":
+            if ch != "[":
+                return False
+            self.stack[-1] = ["arr", node[1], "first", 0]
+            return True
+        # any JSON value
+        if ch == '"':
+            self.stack[-1] = ["str", None, "", False, 0]
+            return True
+        if ch == "{":
+            self.stack[-1] = ["aobj", "first", 0]
+            return True
+        if ch == "[":
+            self.stack[-1] = ["arr", ANY, "first", 0]
+            return True
+        if ch == "-" or ch.isdigit():
+            self.stack[-1] = ["num", ch]
+            return True
+        for lit in ("true", "false", "null"):
+            if ch == lit[0]:
+                self.stack[-1] = ["lit", lit[1:]]
+                return True
+        return False
+
+    @staticmethod
+    def _number_complete(text: str) -> bool:
+        try:
+            json.loads(text)
+            return True
+        except ValueError:
+            return False
+
+    @staticmethod
+    def _number_prefix_ok(text: str) -> bool:
+        # valid prefix of -?(0|[1-9]\d*)(\.\d+)?([eE][+-]?\d+)?
+        i, n = 0, len(text)
+        if i < n and text[i] == "-":
+            i += 1
+        if i == n:
+            return True
+        if text[i] == "0":
+            i += 1
+        elif text[i].isdigit():
+            while i < n and text[i].isdigit():
+                i += 1
+        else:
+            return False
+        if i < n and text[i] == ".":
+            i += 1
+            if i == n:
+                return True
+            if not text[i].isdigit():
+                return False
+            while i < n and text[i].isdigit():
+                i += 1
+        if i < n and text[i] in "eE":
+            i += 1
+            if i < n and text[i] in "+-":
+                i += 1
+            if i == n:
+                return True
+            if not text[i].isdigit():
+                return False
+            while i < n and text[i].isdigit():
+                i += 1
+        return i == n
+
+    def feed(self, ch: str) -> bool:
+        if self.done:
+            if ch in WS:
+                self.trail_ws += 1
+                return self.trail_ws <= MAX_WS
+            return False
+
+        f = self.stack[-1]
+        kind = f[0]
+
+        if kind == "str":
+            allowed, buf, esc, hexleft = f[1], f[2], f[3], f[4]
+            if hexleft:
+                if ch not in "0123456789abcdefABCDEF":
+                    return False
+                f[4] -= 1
+                return True
+            if esc:
+                if ch not in ESCAPES:
+                    return False
+                f[3] = False
+                if ch == "u":
+                    f[4] = 4
+                if allowed is not None:
+                    return False
+                return True
+            if ch == '"':
+                if allowed is not None and buf not in allowed:
+                    return False
+                self._pop()
+                return True
+            if ch == "\\":
+                f[3] = True
+                return allowed is None
+            if ord(ch) < 0x20:
+                return False
+            if allowed is not None:
+                nb = buf + ch
+                if not any(a.startswith(nb) for a in allowed):
+                    return False
+                f[2] = nb
+            return True
+
+        if kind == "value":
+            if ch in WS:
+                return self._ws(f, 2)
+            return self._start_value(f[1], ch)
+
+        if kind == "num":
+            if ch in NUMBER_CHARS:
+                nt = f[1] + ch
+                if not self._number_prefix_ok(nt):
+                    return False
+                f[1] = nt
+                return True
+            if not self._number_complete(f[1]):
+                return False
+            self._pop()
+            return self.feed(ch)
+
+        if kind == "lit":
+            if not f[1] or ch != f[1][0]:
+                return False
+            f[1] = f[1][1:]
+            if not f[1]:
+                self._pop()
+            return True
+
+        if kind == "obj":
+            fields, idx, phase = f[1], f[2], f[3]
+            if ch in WS:
+                return self._ws(f, 4)
+            f[4] = 0
+            if phase == "key":
+                if ch != '"':
+                    return False
+                f[3] = "colon"
+                self.stack.append(["str", [fields[idx][0]], "", False, 0])
+                return True
+            if phase == "colon":
+                if ch != ":":
+                    return False
+                f[3] = "after"
+                self.stack.append(["value", fields[idx][1], 0])
+                return True
+            if phase == "after":
+                if idx + 1 < len(fields):
+                    if ch != ",":
+                        return False
+                    f[2] = idx + 1
+                    f[3] = "key"
+                    return True
+                if ch != "}":
+                    return False
+                self._pop()
+                return True
+            if phase == "end":
+                if ch != "}":
+                    return False
+                self._pop()
+                return True
+            return False
+
+        if kind == "aobj":
+            phase = f[1]
+            if ch in WS:
+                return self._ws(f, 2)
+            f[2] = 0
+            if phase in ("first", "key"):
+                if ch == "}" and phase == "first":
+                    self._pop()
+                    return True
+                if ch != '"':
+                    return False
+                f[1] = "colon"
+                self.stack.append(["str", None, "", False, 0])
+                return True
+            if phase == "colon":
+                if ch != ":":
+                    return False
+                f[1] = "after"
+                self.stack.append(["value", ANY, 0])
+                return True
+            if phase == "after":
+                if ch == ",":
+                    f[1] = "key"
+                    return True
+                if ch == "}":
+                    self._pop()
+                    return True
+            return False
+
+        if kind == "arr":
+            item, phase = f[1], f[2]
+            if ch in WS:
+                return self._ws(f, 3)
+            f[3] = 0
+            if phase == "first":
+                if ch == "]":
+                    self._pop()
+                    return True
+                f[2] = "after"
+                self.stack.append(["value", item, 0])
+                return self.feed(ch)
+            if phase == "after":
+                if ch == ",":
+                    self.stack.append(["value", item, 0])
+                    return True
+                if ch == "]":
+                    self._pop()
+                    return True
+            return False
+
+        return False
+
+    def completion(self) -> str:
+        """Shortest text that closes every open frame and finishes the top-level value."""
+        out = []
+        for f in reversed(self.stack):
+            kind = f[0]
+            if kind == "str":
+                if f[4]:
+                    out.append("0" * f[4])
+                elif f[3]:
+                    out.append("n")
+                if f[1] is not None:
+                    out.append(min((a for a in f[1] if a.startswith(f[2])), key=len)[len(f[2]):])
+                out.append('"')
+            elif kind == "value":
+                out.append(min_value(f[1]))
+            elif kind == "num":
+                if f[1][-1] in "-+.eE":
+                    out.append("0")
+            elif kind == "lit":
+                out.append(f[1])
+            elif kind == "obj":
+                fields, idx, phase = f[1], f[2], f[3]
+                rest = fields[idx + 1:]
+                if phase == "key":
+                    rest = fields[idx:]
+                elif phase == "colon":
+                    out.append(":" + min_value(fields[idx][1]))
+                tail = ",".join(f'"{k}":{min_value(v)}' for k, v in rest)
+                out.append(("," + tail if phase in ("after", "colon") else tail) if tail else "")
+                out.append("}")
+            elif kind == "aobj":
+                out.append({"first": "}", "key": '"":0}', "colon": ":0}", "after": "}"}[f[1]])
+            elif kind == "arr":
+                out.append("]")
+        return "".join(out)
+
+    @property
+    def inside_free_string(self) -> bool:
+        return bool(self.stack) and self.stack[-1][0] == "str" and self.stack[-1][1] is None \
+            and not self.stack[-1][3] and not self.stack[-1][4]
+
+
+class TokenTable:
+    """Decoded text of every vocab id, computed once per tokenizer."""
+
+    _cache = {}
+
+    def __init__(self, tokenizer):
+        self.special = set(tokenizer.all_special_ids)
+        self.texts: List[Optional[str]] = []
+        for i in range(len(tokenizer)):
+            if i in self.special:
+                self.texts.append(None)
+                continue
+            t = tokenizer.decode([i], skip_special_tokens=False, clean_up_tokenization_spaces=False)
+            self.texts.append(t)
+
+    @classmethod
+    def for_tokenizer(cls, tokenizer) -> "TokenTable":
+        key = (getattr(tokenizer, "name_or_path", ""), len(tokenizer))
+        if key not in cls._cache:
+            cls._cache[key] = cls(tokenizer)
+        return cls._cache[key]
+
+
+def advance(state: JsonState, text: Optional[str]) -> bool:
+    """
+    Feeds one token's text. Tokens that decode to a partial UTF-8 sequence
+    ("\\ufffd") are only accepted inside a free-text string, where any
+    printable character is valid.
+    """
+    if text is None or text == "":
+        return False
+    if "�" in text:
+        if not state.inside_free_string:
+            return False
+        text = text.replace("�", "x")
+    return state.feed_text(text)
+
+
+class SchemaLogitsProcessor(LogitsProcessor):
+    """
+    Masks every token that would make a row's output leave the task schema.
+
+    Each row keeps a JsonState that is advanced with the token chosen at the
+    previous step. Candidates are checked in descending logit order: the top
+    `top_k` first and, only if none of them fits, the rest of the vocabulary
+    until one does. Once the top-level object is closed only EOS is allowed.
+
+    With `max_new_tokens` set, a row whose remaining budget gets within
+    `margin` tokens of its shortest completion is closed by force (open
+    strings are cut, missing keys get empty values), so it never runs out
+    of tokens mid-object.
+    """
+
+    def __init__(self, tokenizer, tasks: List[str], prompt_len: int, top_k: int = 32,
+                 max_new_tokens: Optional[int] = None, margin: int = 8):
+        self.tokenizer = tokenizer
+        self.table = TokenTable.for_tokenizer(tokenizer)
+        self.states = [JsonState(SCHEMAS[t]) for t in tasks]
+        self.fed = [0] * len(tasks)
+        self.prompt_len = prompt_len
+        self.top_k = top_k
+        self.max_new_tokens = max_new_tokens
+        self.margin = margin
+        self.eos_id = tokenizer.eos_token_id
+        self.broken = [False] * len(tasks)
+        self.forced: List[Optional[List[int]]] = [None] * len(tasks)
+        self.stats = {"forced_closes": 0, "full_vocab_scans": 0}
+
+    def _closing_ids(self, state: JsonState) -> Optional[List[int]]:
+        ids = self.tokenizer(state.completion(), add_special_tokens=False)["input_ids"]
+        probe = state.copy()
+        if all(advance(probe, self.table.texts[t]) for t in ids) and probe.done:
+            return ids
+        return None
+
+    def _force(self, row: int, st: JsonState) -> Optional[int]:
+        """Next token of the forced completion once the budget is nearly spent."""
+        if self.forced[row] is None:
+            if self.max_new_tokens is None:
+                return None
+            left = self.max_new_tokens - self.fed[row]
+            if left > len(st.completion()) + self.margin:
+                return None  # tokens <= chars, so there is plenty of budget left
+            ids = self._closing_ids(st)
+            if ids is None or len(ids) + self.margin < left:
+                return None
+            self.forced[row] = ids
+            self.stats["forced_closes"] += 1
+        return self.forced[row].pop(0) if self.forced[row] else None
+
+    def _sync(self, row: int, ids: torch.Tensor):
+        gen = ids[self.prompt_len + self.fed[row]:].tolist()
+        for t in gen:
+            self.fed[row] += 1
+            st = self.states[row]
+            if st.done or self.broken[row]:
+                continue
+            if not advance(st, self.table.texts[t]):
+                self.broken[row] = True
+
+    def _allowed(self, state: JsonState, order: torch.Tensor) -> List[int]:
+        texts = self.table.texts
+        found = []
+        for t in order[:self.top_k].tolist():
+            if advance(state.copy(), texts[t]):
+                found.append(t)
+        if found:
+            return found
+        self.stats["full_vocab_scans"] += 1
+        for t in order[self.top_k:].tolist():
+            if advance(state.copy(), texts[t]):
+                return [t]
+        return []
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor) -> torch.FloatTensor:
+        for row in range(scores.shape[0]):
+            self._sync(row, input_ids[row])
+            st = self.states[row]
+            if self.broken[row]:
+                continue
+            forced = None if st.done else self._force(row, st)
+            if st.done:
+                allowed = [self.eos_id]
+            elif forced is not None:
+                allowed = [forced]
+            else:
+                order = torch.argsort(scores[row], descending=True)
+                allowed = self._allowed(st, order)
+                if not allowed:
+                    self.broken[row] = True
+                    continue
+            keep = torch.zeros_like(scores[row], dtype=torch.bool)
+            keep[allowed] = True
+            row_scores = scores[row].masked_fill(~keep, float("-inf"))
+            if torch.isinf(row_scores[allowed]).all():
+                row_scores[allowed] = 0.0
+            scores[row] = row_scores
+        return scores
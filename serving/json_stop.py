@@ -0,0 +1,98 @@
+from typing import Dict, List
+
+import torch
+from transformers import StoppingCriteria
+
+
+class JsonCloseTracker:
+    """
+    Incremental brace tracker over decoded text. Text before the first '{'
+    is ignored; after it, nesting of {} / [] is counted outside of strings
+    (quote- and backslash-escape aware). `closed` turns True on the char
+    that closes the top-level object.
+    """
+
+    __slots__ = ("depth", "in_str", "esc", "started", "closed")
+
+    def __init__(self):
+        self.depth = 0
+        self.in_str = False
+        self.esc = False
+        self.started = False
+        self.closed = False
+
+    def feed(self, text: str) -> bool:
+        for ch in text:
+            if self.closed:
+                break
+            if not self.started:
+                if ch == "{":
+                    self.started = True
+                    self.depth = 1
+                continue
+            if self.in_str:
+                if self.esc:
+                    self.esc = False
+                elif ch == "\\":
+                    self.esc = True
+                elif ch == '"':
+                    self.in_str = False
+                continue
+            if ch == '"':
+                self.in_str = True
+            elif ch in "{[":
+                self.depth += 1
+            elif ch in "}]":
+                self.depth -= 1
+                if self.depth == 0:
+                    self.closed = True
+        return self.closed
+
+
+class JsonStopCriteria(StoppingCriteria):
+    """
+    Stops each row of a (batched) generate as soon as its top-level JSON
+    object closes. Returns a per-row bool tensor, so finished rows are
+    padded while the others keep decoding. Only tokens after `prompt_len`
+    are tracked; per-token text is decoded once and cached.
+    """
+
+    def __init__(self, tokenizer, prompt_len: int, batch_size: int = 1):
+        self.tokenizer = tokenizer
+        self.prompt_len = prompt_len
+        self.trackers = [JsonCloseTracker() for _ in range(batch_size)]
+        self.fed = [0] * batch_size
+        self.stopped_at: List[int] = [0] * batch_size
+        self._text: Dict[int, str] = {}
+
+    def _piece(self, token: int) -> str:
+        if token not in self._text:
+            self._text[token] = self.tokenizer.decode([token], skip_special_tokens=True)
+        return self._text[token]
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> torch.BoolTensor:
+        done = []
+        for row, tr in enumerate(self.trackers):
+            new = input_ids[row, self.prompt_len + self.fed[row]:].tolist()
+            for t in new:
+                self.fed[row] += 1
+                if not tr.closed and tr.feed(self._piece(t)):
+                    self.stopped_at[row] = self.fed[row]
+            done.append(tr.closed)
+        return torch.tensor(done, dtype=torch.bool, device=input_ids.device)
+
+
+class JsonCloseStop:
+    """The same check as a stop callback over a list of new token ids (ContinuousBatcher, SpeculativeDecoder)."""
+
+    def __init__(self, tokenizer):
+        self.tokenizer = tokenizer
+        self.tracker = JsonCloseTracker()
+        self.fed = 0
+
+    def __call__(self, new_ids: List[int]) -> bool:
+        for t in new_ids[self.fed:]:
+            self.fed += 1
+            if self.tracker.feed(self.tokenizer.decode([t], skip_special_tokens=True)):
+                break
+        return self.tracker.closed
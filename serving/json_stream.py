@@ -0,0 +1,277 @@
+import argparse
+import json
+import time
+from collections import OrderedDict
+from typing import Callable, Iterator, List, Optional
+
+import torch
+from peft import PeftModel
+
+from chapters import CHAPTERS, MAX_NEW_TOKENS, build_mcq_prompt, build_solve_prompt
+from json_schema import ANY_OBJECT, REQUIRED_KEYS, SCHEMAS, JsonState
+from loader import load_base
+from scheduler import ContinuousBatcher
+
+FENCE = "```json"
+
+
+def conforms(node, value) -> bool:
+    kind = node[0]
+    if kind == "string":
+        return isinstance(value, str)
+    if kind == "enum":
+        return value in node[1]
+    if kind == "object":
+        return isinstance(value, dict) and all(k in value and conforms(v, value[k]) for k, v in node[1])
+    if kind == "array":
+        return isinstance(value, list) and all(conforms(node[1], v) for v in value)
+    if kind == "any_object":
+        return isinstance(value, dict)
+    return True
+
+
+class JsonStream:
+    """
+    Incremental parser for one generation, used as the scheduler's stop
+    callback. Each call decodes the new output text and feeds it char by
+    char to a generic JsonState. It stops the request when:
+      - the top-level object closes (done), or
+      - the output can no longer become a valid response (error): prose
+        before '{', malformed JSON, a top-level field of the wrong type, or
+        missing required keys once the object closes.
+    Completed top-level fields are parsed and queued in `pending` as soon as
+    their value ends.
+    """
+
+    def __init__(self, tokenizer, task: str):
+        self.tokenizer = tokenizer
+        self.task = task
+        self.schema = dict(SCHEMAS[task][1])
+        self.state = JsonState(ANY_OBJECT)
+        self.pre = ""
+        self.buf = ""
+        self.emitted = 0
+        self.children = 0
+        self.child_start = 0
+        self.key = None
+        self.fields: "OrderedDict[str, object]" = OrderedDict()
+        self.pending: List[tuple] = []
+        self.done = False
+        self.error: Optional[str] = None
+        self.tokens = 0
+
+    def __call__(self, output_ids: List[int]) -> bool:
+        self.tokens = len(output_ids)
+        text = self.tokenizer.decode(output_ids, skip_special_tokens=True)
+        if text.endswith("�"):
+            return False  # wait for the rest of a multi-byte character
+        new, self.emitted = text[self.emitted:], len(text)
+        for ch in new:
+            if self.done or self.error:
+                break
+            self._feed(ch)
+        return self.done or self.error is not None
+
+    def finish(self):
+        """Called once the request ended for any reason."""
+        if not self.done and self.error is None:
+            self.error = "output ended before the JSON object closed"
+
+    def _fail(self, reason: str):
+        self.error = reason
+
+    def _feed(self, ch: str):
+        if not self.buf:
+            if ch != "{":
+                self.pre += ch
+                if not FENCE.startswith(self.pre.strip()):
+                    self._fail("prose before the opening brace")
+                return
+        self.buf += ch
+        before = len(self.state.stack)
+        if not self.state.feed(ch):
+            self._fail(f"malformed JSON at char {len(self.buf)}")
+            return
+        after = len(self.state.stack)
+        if before == 1 and after >= 2:
+            self.child_start = len(self.buf) - 1
+        elif before >= 2 and after <= 1:
+            self._child_done(self.buf[self.child_start:])
+        if self.state.done and not self.error:
+            missing = [k for k in REQUIRED_KEYS[self.task] if k not in self.fields]
+            if missing:
+                self._fail(f"missing required keys: {', '.join(missing)}")
+            else:
+                self.done = True
+
+    def _child_done(self, segment: str):
+        self.children += 1
+        if self.children % 2:
+            self.key = json.loads(segment)
+            return
+        seg = segment[1:]  # drop the ':' the value frame was pushed on
+        try:
+            value = json.loads(seg)
+        except ValueError:
+            value = json.loads(seg[:-1])  # a number is closed by the next delimiter
+        node = self.schema.get(self.key)
+        if node is not None and not conforms(node, value):
+            self._fail(f"field '{self.key}' does not match the schema")
+            return
+        self.fields[self.key] = value
+        self.pending.append((self.key, value))
+
+
+class Job:
+    def __init__(self, jid: int, task: str, prompt: str, max_new_tokens: int, temperature: float, top_p: float):
+        self.jid = jid
+        self.task = task
+        self.prompt = prompt
+        self.max_new_tokens = max_new_tokens
+        self.temperature = temperature
+        self.top_p = top_p
+        self.attempts = 0
+        self.aborts: List[str] = []
+        self.wasted_tokens = 0
+        self.stream: Optional[JsonStream] = None
+        self.result = None
+        self.error = None
+        self.t_submit = time.perf_counter()
+        self.t_first_field = None
+        self.t_done = None
+
+
+class StreamingJsonGenerator:
+    """
+    Runs JSON jobs on a ContinuousBatcher with a JsonStream per request.
+    A request that becomes unrecoverable is stopped at that token and
+    resampled right away (greedy jobs retry at `retry_temperature`), up to
+    `max_attempts`. events() yields, in order of arrival:
+      ("field", job, key, value)   a top-level field is complete
+      ("retry", job, reason)       the current attempt was aborted; drop its fields
+      ("done", job, None)          job.result holds the parsed object (or job.error)
+    """
+
+    def __init__(self, batcher: ContinuousBatcher, max_attempts: int = 3, retry_temperature: float = 0.7):
+        self.batcher = batcher
+        self.max_attempts = max_attempts
+        self.retry_temperature = retry_temperature
+        self.jobs: List[Job] = []
+        self._by_rid = {}
+        self._live = {}
+
+    def submit(self, task: str, prompt: str, max_new_tokens: int = None, temperature: float = 0.0,
+               top_p: float = 1.0) -> Job:
+        job = Job(len(self.jobs), task, prompt, max_new_tokens or MAX_NEW_TOKENS[task], temperature, top_p)
+        self.jobs.append(job)
+        self._start(job)
+        return job
+
+    def _start(self, job: Job):
+        job.attempts += 1
+        job.stream = JsonStream(self.batcher.tokenizer, job.task)
+        temperature = job.temperature if job.attempts == 1 else max(job.temperature, self.retry_temperature)
+        req = self.batcher.submit(job.prompt, job.max_new_tokens, temperature, job.top_p, stop=job.stream)
+        self._by_rid[req.rid] = job
+        self._live[req.rid] = req
+
+    def events(self) -> Iterator[tuple]:
+        b = self.batcher
+        while b.waiting or b.running:
+            finished = b.step()
+            for rid in list(self._live):
+                job = self._by_rid[rid]
+                while job.stream.pending:
+                    key, value = job.stream.pending.pop(0)
+                    if job.t_first_field is None:
+                        job.t_first_field = time.perf_counter()
+                    yield "field", job, key, value
+            for req in finished:
+                job = self._by_rid[req.rid]
+                self._live.pop(req.rid, None)
+                s = job.stream
+                s.finish()
+                if s.done:
+                    job.result = dict(s.fields)
+                    job.t_done = time.perf_counter()
+                    yield "done", job, None
+                    continue
+                job.aborts.append(s.error)
+                job.wasted_tokens += len(req.output_ids)
+                if job.attempts < self.max_attempts:
+                    yield "retry", job, s.error
+                    self._start(job)
+                else:
+                    job.error = s.error
+                    job.t_done = time.perf_counter()
+                    yield "done", job, None
+
+    def run(self, on_event: Callable = None) -> List[Job]:
+        for ev in self.events():
+            if on_event is not None:
+                on_event(*ev)
+        return self.jobs
+
+
+def main():
+    p = argparse.ArgumentParser(description="Stream JSON fields as they complete; abort and resample broken outputs.")
+    p.add_argument("--base_model", type=str, default="Qwen/Qwen2.5-7B-Instruct")
+    p.add_argument("--adapter", type=str, default="", help="Optional chapter adapter to attach.")
+    p.add_argument("--device", type=str, default="cuda", choices=["cuda", "cpu"])
+    p.add_argument("--quant", type=str, default="nf4", choices=["nf4", "none"])
+    p.add_argument("--task", type=str, default="generate_mcq", choices=list(SCHEMAS))
+    p.add_argument("--n", type=int, default=6)
+    p.add_argument("--max_slots", type=int, default=8)
+    p.add_argument("--max_attempts", type=int, default=3)
+    p.add_argument("--temperature", type=float, default=0.7)
+    p.add_argument("--quiet", action="store_true", help="Only print the summary.")
+    args = p.parse_args()
+
+    if args.device == "cuda" and not torch.cuda.is_available():
+        raise RuntimeError("CUDA not available but --device=cuda was set.")
+
+    model, tokenizer = load_base(args.base_model, device=args.device, quant=args.quant)
+    if args.adapter:
+        model = PeftModel.from_pretrained(model, args.adapter)
+        model.eval()
+
+    gen = StreamingJsonGenerator(ContinuousBatcher(model, tokenizer, max_slots=args.max_slots),
+                                 max_attempts=args.max_attempts)
+    chapters = list(CHAPTERS)
+    for i in range(args.n):
+        ch = chapters[i % len(chapters)]
+        prompt = build_mcq_prompt(ch) if args.task == "generate_mcq" else \
+            build_solve_prompt(ch, CHAPTERS[ch]["sample_q"])
+        gen.submit(args.task, prompt, temperature=args.temperature)
+
+    t0 = time.perf_counter()
+
+    def show(kind, job, *rest):
+        if args.quiet:
+            return
+        ms = (time.perf_counter() - t0) * 1000
+        if kind == "field":
+            print(f"[{ms:8.0f} ms] job {job.jid} {rest[0]}: {json.dumps(rest[1], ensure_ascii=False)[:80]}")
+        elif kind == "retry":
+            print(f"[{ms:8.0f} ms] job {job.jid} aborted after {job.stream.tokens} tokens ({rest[0]}); resampling")
+        else:
+            print(f"[{ms:8.0f} ms] job {job.jid} {'done' if job.result else 'failed: ' + str(job.error)}")
+
+    jobs = gen.run(show)
+    ok = [j for j in jobs if j.result is not None]
+    first = [j.t_first_field - j.t_submit for j in ok]
+    total = [j.t_done - j.t_submit for j in ok]
+    print(json.dumps({
+        "jobs": len(jobs),
+        "valid": len(ok),
+        "attempts": sum(j.attempts for j in jobs),
+        "aborts": sum(len(j.aborts) for j in jobs),
+        "abort_reasons": sorted({r.split(":")[0] for j in jobs for r in j.aborts}),
+        "tokens_in_aborted_attempts": sum(j.wasted_tokens for j in jobs),
+        "avg_s_to_first_field": round(sum(first) / len(first), 3) if first else None,
+        "avg_s_to_done": round(sum(total) / len(total), 3) if total else None,
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
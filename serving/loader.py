@@ -0,0 +1,194 @@
+import hashlib
+import json
+import os
+import time
+from importlib import metadata
+from pathlib import Path
+from typing import Optional
+
+import torch
+import transformers
+from transformers import AutoConfig, AutoTokenizer, AutoModelForCausalLM, BitsAndBytesConfig
+
+QUANT_ROOT = Path("models")
+QUANT_META = "quantized_meta.json"
+
+
+def bnb_4bit_config():
+    return BitsAndBytesConfig(
+        load_in_4bit=True,
+        bnb_4bit_quant_type="nf4",
+        bnb_4bit_use_double_quant=True,
+        bnb_4bit_compute_dtype=torch.float16,
+    )
+
+
+def bnb_8bit_config():
+    return BitsAndBytesConfig(load_in_8bit=True)
+
+
+def quantized_dir(base_model: str) -> Path:
+    """Default location of the pre-quantized export, e.g. models/Qwen2.5-7B-Instruct-nf4."""
+    return QUANT_ROOT / f"{Path(base_model).name}-nf4"
+
+
+def _lib_version(name: str) -> str:
+    try:
+        return metadata.version(name)
+    except metadata.PackageNotFoundError:
+        return "none"
+
+
+def base_revision(base_model: str) -> Optional[str]:
+    """Hub commit of the base weights (or a size/mtime digest for a local dir); None when unknown (offline)."""
+    local = Path(base_model)
+    if local.is_dir():
+        h = hashlib.sha1()
+        for f in sorted(local.glob("*.safetensors")) + sorted(local.glob("*.bin")):
+            st = f.stat()
+            h.update(f"{f.name}:{st.st_size}:{int(st.st_mtime)}".encode("utf-8"))
+        return "local:" + h.hexdigest()[:16]
+    try:
+        return getattr(AutoConfig.from_pretrained(base_model), "_commit_hash", None)
+    except OSError:
+        return None
+
+
+def quant_config_hash(base_model: str, bnb_config: BitsAndBytesConfig) -> str:
+    """
+    Identifies what an export was built from: base model id, quantization
+    settings, and the library versions that define the serialized quant state.
+    """
+    payload = {
+        "base_model": base_model,
+        "quant": bnb_config.to_dict(),
+        "transformers": transformers.__version__.split(".")[0],
+        "bitsandbytes": ".".join(_lib_version("bitsandbytes").split(".")[:2]),
+    }
+    return hashlib.sha1(json.dumps(payload, sort_keys=True, default=str).encode("utf-8")).hexdigest()[:16]
+
+
+def export_status(export_dir: Path, base_model: str, bnb_config: BitsAndBytesConfig) -> Optional[str]:
+    """None when `export_dir` holds a usable export for this base/config, else the reason it is not."""
+    meta_path = export_dir / QUANT_META
+    if not export_dir.exists():
+        return "missing"
+    if not meta_path.exists():
+        return f"no {QUANT_META}"
+    meta = json.loads(meta_path.read_text(encoding="utf-8"))
+    if meta.get("config_hash") != quant_config_hash(base_model, bnb_config):
+        return "config hash changed (base model, quantization settings or library version)"
+    revision = base_revision(base_model)
+    if revision is not None and meta.get("base_revision") not in (None, revision):
+        return f"base weights changed ({meta.get('base_revision')} -> {revision})"
+    if not any(export_dir.glob("*.safetensors")):
+        return "weights missing"
+    return None
+
+
+def export_quantized(base_model: str, out_dir: Path = None) -> dict:
+    """Quantizes the base to NF4 once and saves weights + quant state with a meta file for staleness checks."""
+    out_dir = Path(out_dir) if out_dir else quantized_dir(base_model)
+    cfg = bnb_4bit_config()
+    t0 = time.perf_counter()
+    model = AutoModelForCausalLM.from_pretrained(
+        base_model,
+        quantization_config=cfg,
+        device_map={"": 0},
+        attn_implementation="sdpa",
+    )
+    quantize_s = time.perf_counter() - t0
+    out_dir.mkdir(parents=True, exist_ok=True)
+    model.save_pretrained(out_dir, safe_serialization=True)
+    AutoTokenizer.from_pretrained(base_model, use_fast=True).save_pretrained(out_dir)
+    meta = {
+        "base_model": base_model,
+        "base_revision": base_revision(base_model),
+        "config_hash": quant_config_hash(base_model, cfg),
+        "quant": cfg.to_dict(),
+        "transformers": transformers.__version__,
+        "bitsandbytes": _lib_version("bitsandbytes"),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "quantize_s": round(quantize_s, 1),
+        "size_mb": round(sum(f.stat().st_size for f in out_dir.glob("*.safetensors")) / 2**20, 1),
+    }
+    (out_dir / QUANT_META).write_text(json.dumps(meta, indent=2, default=str), encoding="utf-8")
+    return meta
+
+
+def load_causal_lm(base_model: str, device: str = "cuda", quant: str = "nf4", quantized: str = None,
+                   auto_class=AutoModelForCausalLM, device_map=None, dtype=None, attn_implementation=None):
+    """
+    Loads the model weights the way every script needs them.
+
+    `quant` is nf4 or int8 (bitsandbytes, CUDA only) or none. `dtype`
+    overrides the unquantized dtype (fp16 on CUDA, fp32 on CPU) and
+    `attn_implementation` the attention kernel (sdpa on CUDA, the
+    transformers default on CPU). With CUDA + nf4, a matching pre-quantized export (serving/export_quantized.py)
+    is loaded directly; a missing or stale one falls back to quantizing the
+    fp16 base on load, with a warning for the stale case. The cold-start
+    time and the source used are printed and kept on `model.load_report`.
+    """
+    t0 = time.perf_counter()
+    source = base_model
+    if device == "cuda":
+        kwargs = {"device_map": device_map or {"": 0}, "attn_implementation": attn_implementation or "sdpa"}
+        if quant == "nf4":
+            cfg = bnb_4bit_config()
+            export_dir = Path(quantized) if quantized else quantized_dir(base_model)
+            reason = export_status(export_dir, base_model, cfg)
+            if reason is None:
+                source = str(export_dir)
+            else:
+                if reason != "missing":
+                    print(f"[!] Ignoring stale quantized export {export_dir}: {reason}. "
+                          f"Re-run serving/export_quantized.py to refresh it.")
+                kwargs["quantization_config"] = cfg
+        elif quant == "int8":
+            kwargs["quantization_config"] = bnb_8bit_config()
+        else:
+            kwargs["torch_dtype"] = dtype or torch.float16
+    else:
+        kwargs = {"torch_dtype": dtype or torch.float32}
+        if attn_implementation:
+            kwargs["attn_implementation"] = attn_implementation
+
+    model = auto_class.from_pretrained(source, **kwargs)
+    seconds = time.perf_counter() - t0
+    model.load_report = {"source": source, "prequantized": source != base_model, "seconds": round(seconds, 2)}
+    print(f"Loaded {base_model} from {source} in {seconds:.1f}s")
+    return model
+
+
+def load_tokenizer(base_model: str, padding_side: str = "left"):
+    tokenizer = AutoTokenizer.from_pretrained(base_model, use_fast=True)
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+    tokenizer.padding_side = padding_side
+    return tokenizer
+
+
+def load_base(base_model: str, device: str = "cuda", quant: str = "nf4"):
+    """
+    Loads the base model once for inference.
+
+    On CUDA the default is the same NF4 4-bit setup the training scripts use
+    (from the pre-quantized export when one matches); on CPU the model is
+    loaded unquantized in fp32 (bitsandbytes is GPU-only).
+    """
+    tokenizer = load_tokenizer(base_model)
+    model = load_causal_lm(base_model, device=device, quant=quant)
+    model.config.use_cache = True
+    model.eval()
+    return model, tokenizer
+
+
+def resident_bytes(device: str = "cuda") -> int:
+    """Accelerator memory held by tensors on CUDA, process RSS on CPU."""
+    if device == "cuda" and torch.cuda.is_available():
+        return torch.cuda.memory_allocated()
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return 0
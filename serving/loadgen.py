@@ -0,0 +1,150 @@
+import argparse
+import asyncio
+import json
+import random
+import time
+from collections import Counter
+
+from chapters import CHAPTERS
+
+ROUTE_QUESTIONS = [c["sample_q"] for c in CHAPTERS.values()] + [
+    "What is the capital of France?",
+    "Find the compound interest on Rs 5000 at 10% per annum for 2 years.",
+]
+
+
+def make_request(kind: str, rng: random.Random):
+    if kind == "route":
+        return "/route", {"question": rng.choice(ROUTE_QUESTIONS)}
+    if kind == "generate_mcq":
+        return "/generate_mcq", {"chapter": rng.choice(list(CHAPTERS))}
+    chapter = rng.choice(list(CHAPTERS))
+    return "/solve", {"question": CHAPTERS[chapter]["sample_q"], "chapter": chapter}
+
+
+class Conn:
+    """One keep-alive HTTP/1.1 connection."""
+
+    def __init__(self, host: str, port: int):
+        self.host = host
+        self.port = port
+        self.reader = None
+        self.writer = None
+
+    async def request(self, path: str, payload: dict):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        body = json.dumps(payload).encode("utf-8")
+        self.writer.write(
+            f"POST {path} HTTP/1.1\r\nHost: {self.host}\r\nContent-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n\r\n".encode("latin-1") + body
+        )
+        await self.writer.drain()
+
+        status = int((await self.reader.readline()).split()[1])
+        length = 0
+        close = False
+        while True:
+            h = await self.reader.readline()
+            if h in (b"\r\n", b"\n", b""):
+                break
+            k, _, v = h.decode("latin-1").partition(":")
+            if k.strip().lower() == "content-length":
+                length = int(v.strip())
+            if k.strip().lower() == "connection" and v.strip().lower() == "close":
+                close = True
+        data = await self.reader.readexactly(length)
+        if close:
+            self.close()
+        return status, json.loads(data)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+
+def percentile(xs, q: float):
+    if not xs:
+        return None
+    xs = sorted(xs)
+    return xs[min(len(xs) - 1, int(round(q * (len(xs) - 1))))]
+
+
+async def run(args):
+    weights = {"route": args.route_weight, "generate_mcq": args.mcq_weight, "solve": args.solve_weight}
+    kinds = [k for k, w in weights.items() if w > 0]
+    rng = random.Random(args.seed)
+    plan = rng.choices(kinds, weights=[weights[k] for k in kinds], k=args.requests)
+    queue: asyncio.Queue = asyncio.Queue()
+    for kind in plan:
+        queue.put_nowait(kind)
+
+    lat = {k: [] for k in kinds}
+    statuses = Counter()
+    json_ok = Counter()
+
+    async def worker(i: int):
+        conn = Conn(args.host, args.port)
+        wrng = random.Random(args.seed + i)
+        while not queue.empty():
+            kind = queue.get_nowait()
+            path, payload = make_request(kind, wrng)
+            t0 = time.perf_counter()
+            try:
+                status, res = await conn.request(path, payload)
+            except (ConnectionError, asyncio.IncompleteReadError, ValueError, IndexError):
+                conn.close()
+                statuses["conn_error"] += 1
+                continue
+            statuses[status] += 1
+            if status == 200:
+                lat[kind].append((time.perf_counter() - t0) * 1000)
+                if kind != "route" and res.get("json") is not None:
+                    json_ok[kind] += 1
+        conn.close()
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(worker(i) for i in range(args.concurrency)))
+    elapsed = time.perf_counter() - t0
+
+    ok = sum(len(v) for v in lat.values())
+    report = {
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "seconds": round(elapsed, 2),
+        "requests_per_s": round(ok / elapsed, 2),
+        "statuses": {str(k): v for k, v in statuses.items()},
+    }
+    for kind, xs in lat.items():
+        report[kind] = {
+            "n": len(xs),
+            "p50_ms": round(percentile(xs, 0.50) or 0, 1),
+            "p95_ms": round(percentile(xs, 0.95) or 0, 1),
+            "p99_ms": round(percentile(xs, 0.99) or 0, 1),
+        }
+        if kind != "route":
+            report[kind]["json_valid_rate"] = round(json_ok[kind] / max(1, len(xs)), 3)
+    all_lat = [x for xs in lat.values() for x in xs]
+    report["all"] = {"p50_ms": round(percentile(all_lat, 0.50) or 0, 1),
+                     "p95_ms": round(percentile(all_lat, 0.95) or 0, 1),
+                     "p99_ms": round(percentile(all_lat, 0.99) or 0, 1)}
+    print(json.dumps(report, indent=2))
+
+
+def main():
+    p = argparse.ArgumentParser(description="Closed-loop load generator for serving/server.py.")
+    p.add_argument("--host", type=str, default="127.0.0.1")
+    p.add_argument("--port", type=int, default=8080)
+    p.add_argument("--requests", type=int, default=200)
+    p.add_argument("--concurrency", type=int, default=16)
+    p.add_argument("--route_weight", type=float, default=0.6)
+    p.add_argument("--mcq_weight", type=float, default=0.2)
+    p.add_argument("--solve_weight", type=float, default=0.2)
+    p.add_argument("--seed", type=int, default=42)
+    args = p.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
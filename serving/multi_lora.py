@@ -0,0 +1,91 @@
+import types
+from contextlib import contextmanager
+from typing import List
+
+import torch
+from peft.tuners.lora import LoraLayer
+
+
+class MixedLora:
+    """
+    Per-row adapter selection for a PeftModel holding several LoRA adapters.
+
+    For every LoRA linear layer the A/B matrices of all adapters are stacked
+    once (zero-padded to the largest rank, plus an all-zero slot meaning "base
+    only"). Inside `rows(...)` each patched layer runs the shared base matmul
+    for the whole batch and adds the LoRA delta gathered per row:
+
+        y = base(x) + scale[id] * (x @ A[id]^T) @ B[id]^T
+
+    so requests for different chapters can share one batch.
+    """
+
+    def __init__(self, peft_model, adapter_names: List[str]):
+        self.model = peft_model
+        self.names = list(adapter_names)
+        self.index = {n: i for i, n in enumerate(self.names)}
+        self.base_index = len(self.names)
+        self.row_ids = None
+        self.layers = []
+
+        for module in peft_model.modules():
+            if not isinstance(module, LoraLayer) or not hasattr(module, "base_layer"):
+                continue
+            present = [n for n in self.names if n in module.lora_A]
+            if not present:
+                continue
+            ref_a = module.lora_A[present[0]].weight
+            ref_b = module.lora_B[present[0]].weight
+            r_max = max(module.lora_A[n].weight.shape[0] for n in present)
+            n_slots = len(self.names) + 1
+            A = torch.zeros((n_slots, r_max, ref_a.shape[1]), dtype=ref_a.dtype, device=ref_a.device)
+            B = torch.zeros((n_slots, ref_b.shape[0], r_max), dtype=ref_b.dtype, device=ref_b.device)
+            scale = torch.zeros(n_slots, dtype=ref_a.dtype, device=ref_a.device)
+            for n in present:
+                i = self.index[n]
+                a = module.lora_A[n].weight.detach()
+                b = module.lora_B[n].weight.detach()
+                A[i, :a.shape[0]] = a
+                B[i, :, :b.shape[1]] = b
+                scale[i] = module.scaling[n]
+            self.layers.append((module, {"A": A, "B": B, "scale": scale}))
+
+    def stacked_bytes(self) -> int:
+        return sum(t.numel() * t.element_size() for _, st in self.layers for t in st.values())
+
+    def ids_for(self, adapters: List[str]) -> torch.Tensor:
+        ids = [self.index.get(a, self.base_index) for a in adapters]
+        device = self.layers[0][1]["A"].device if self.layers else "cpu"
+        return torch.tensor(ids, dtype=torch.long, device=device)
+
+    def _forward(self, layer, stacks):
+        mixed = self
+
+        def forward(self_layer, x, *args, **kwargs):
+            result = self_layer.base_layer(x, *args, **kwargs)
+            ids = mixed.row_ids
+            squeeze = x.dim() == 2
+            if squeeze:
+                x = x.unsqueeze(1)
+            A = stacks["A"][ids]
+            B = stacks["B"][ids]
+            h = torch.einsum("bti,bri->btr", x.to(A.dtype), A)
+            delta = torch.einsum("btr,bor->bto", h, B) * stacks["scale"][ids][:, None, None]
+            if squeeze:
+                delta = delta.squeeze(1)
+            return result + delta.to(result.dtype)
+
+        return types.MethodType(forward, layer)
+
+    @contextmanager
+    def rows(self, adapters: List[str]):
+        """Runs the enclosed forward/generate calls with one adapter per batch row."""
+        self.row_ids = self.ids_for(adapters)
+        for layer, stacks in self.layers:
+            layer.forward = self._forward(layer, stacks)
+        try:
+            yield self.model
+        finally:
+            for layer, _ in self.layers:
+                del layer.forward
+            self.row_ids = None
@@ -0,0 +1,239 @@
+import argparse
+import json
+import math
+import re
+import shutil
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, Tuple
+
+import torch
+from peft import PeftModel
+from safetensors.torch import load_file, save_file
+
+from chapters import CHAPTERS
+from export_merged import sample_prompts
+from loader import load_causal_lm, load_tokenizer
+
+PREFIX = "base_model.model."
+
+
+def pattern_value(patterns: dict, module: str, default):
+    """Same lookup PEFT uses for rank_pattern / alpha_pattern."""
+    for key, value in patterns.items():
+        if re.match(rf"(.*\.)?({key})$", module):
+            return value
+    return default
+
+
+def lora_pairs(state: Dict[str, torch.Tensor]) -> Dict[str, Tuple[str, str]]:
+    """module path (as PEFT patterns see it) -> (lora_A key, lora_B key)."""
+    pairs = {}
+    for k in state:
+        if k.endswith(".lora_A.weight"):
+            module = k[:-len(".lora_A.weight")]
+            pairs[module[len(PREFIX):] if module.startswith(PREFIX) else module] = (k, module + ".lora_B.weight")
+    return pairs
+
+
+def factorize(A: torch.Tensor, B: torch.Tensor):
+    """
+    SVD of B @ A without forming the out x in product: QR of B and A^T gives
+    B A = Qb (Rb Ra^T) Qa^T, so only the r x r core is decomposed.
+    Returns (left [out, r], S [r], right [r, in]) with B A = left diag(S) right.
+    """
+    Qb, Rb = torch.linalg.qr(B.float())
+    Qa, Ra = torch.linalg.qr(A.float().T)
+    U, S, Vh = torch.linalg.svd(Rb @ Ra.T)
+    return Qb @ U, S, Vh @ Qa.T
+
+
+def choose_ranks(spectra: Dict[str, torch.Tensor], energy: float = None, budget: int = None) -> Dict[str, int]:
+    """
+    Per-module rank: the smallest k keeping `energy` of the squared singular
+    values, or the globally largest `budget` (scaled) singular values.
+    Every module keeps at least rank 1.
+    """
+    if budget is not None:
+        ranked = sorted(((float(s), m) for m, S in spectra.items() for s in S), reverse=True)[:budget]
+        ranks = defaultdict(int)
+        for _, m in ranked:
+            ranks[m] += 1
+        return {m: max(1, ranks[m]) for m in spectra}
+    out = {}
+    for m, S in spectra.items():
+        cum = torch.cumsum(S.double() ** 2, 0)
+        total = float(cum[-1])
+        out[m] = 1 if total == 0 else max(1, int((cum < energy * total).sum()) + 1)
+    return out
+
+
+def reduce_adapter(adapter: str, out_dir: Path, energy: float = None, budget_ratio: float = None) -> dict:
+    """Writes a lower-rank, PEFT-loadable copy of `adapter` and returns what was kept."""
+    adapter = Path(adapter)
+    cfg = json.loads((adapter / "adapter_config.json").read_text(encoding="utf-8"))
+    if cfg.get("use_dora"):
+        raise ValueError("DoRA adapters carry a magnitude vector per rank; SVD reduction does not apply.")
+    state = load_file(str(adapter / "adapter_model.safetensors"))
+    pairs = lora_pairs(state)
+
+    factors, spectra, scales = {}, {}, {}
+    for m, (ka, kb) in pairs.items():
+        r = pattern_value(cfg.get("rank_pattern") or {}, m, cfg["r"])
+        alpha = pattern_value(cfg.get("alpha_pattern") or {}, m, cfg["lora_alpha"])
+        scales[m] = alpha / (math.sqrt(r) if cfg.get("use_rslora") else r)
+        factors[m] = factorize(state[ka], state[kb])
+        # rank globally by the singular values of the scaled delta actually added to the weight
+        spectra[m] = factors[m][1] * scales[m]
+
+    budget = None
+    if budget_ratio is not None:
+        budget = max(len(pairs), int(round(budget_ratio * sum(len(s) for s in spectra.values()))))
+    ranks = choose_ranks(spectra, energy=energy, budget=budget)
+
+    new_state = {k: v for k, v in state.items() if not (k.endswith(".lora_A.weight") or k.endswith(".lora_B.weight"))}
+    rank_pattern, alpha_pattern, kept = {}, {}, {}
+    for m, (ka, kb) in pairs.items():
+        left, S, right = factors[m]
+        k = ranks[m]
+        root = S[:k].sqrt()
+        new_state[kb] = (left[:, :k] * root).to(state[kb].dtype).contiguous()
+        new_state[ka] = (root[:, None] * right[:k]).to(state[ka].dtype).contiguous()
+        # alpha chosen so PEFT's scaling (alpha / k, or alpha / sqrt(k) with rsLoRA) equals the original one
+        rank_pattern[m] = k
+        alpha_pattern[m] = scales[m] * (math.sqrt(k) if cfg.get("use_rslora") else k)
+        e = S.double() ** 2
+        kept[m] = float(e[:k].sum() / e.sum()) if float(e.sum()) > 0 else 1.0
+
+    out_dir.mkdir(parents=True, exist_ok=True)
+    cfg.update(r=max(ranks.values()), rank_pattern=rank_pattern, alpha_pattern=alpha_pattern)
+    (out_dir / "adapter_config.json").write_text(json.dumps(cfg, indent=2), encoding="utf-8")
+    save_file(new_state, str(out_dir / "adapter_model.safetensors"), metadata={"format": "pt"})
+    for f in adapter.iterdir():
+        if f.name not in ("adapter_config.json", "adapter_model.safetensors") and f.is_file():
+            shutil.copy2(f, out_dir / f.name)
+
+    by_type = defaultdict(list)
+    for m, k in ranks.items():
+        by_type[m.rsplit(".", 1)[-1]].append(k)
+    old = sum(v.numel() for k, v in state.items() if ".lora_" in k)
+    new = sum(v.numel() for k, v in new_state.items() if ".lora_" in k)
+    return {
+        "modules": len(pairs),
+        "mean_rank_by_type": {t: round(sum(ks) / len(ks), 2) for t, ks in sorted(by_type.items())},
+        "min_energy_kept": round(min(kept.values()), 4),
+        "mean_energy_kept": round(sum(kept.values()) / len(kept), 4),
+        "lora_params": {"before": old, "after": new, "ratio": round(new / max(1, old), 3)},
+        "file_mb": {"before": round((adapter / "adapter_model.safetensors").stat().st_size / 2**20, 2),
+                    "after": round((out_dir / "adapter_model.safetensors").stat().st_size / 2**20, 2)},
+    }
+
+
+def eval_texts(path: str, n: int):
+    """The last `n` records of a processed chapter file ("text" field)."""
+    lines = [ln for ln in Path(path).read_text(encoding="utf-8").splitlines() if ln.strip()]
+    return [json.loads(ln)["text"] for ln in lines[-n:]]
+
+
+@torch.inference_mode()
+def mean_loss(model, tokenizer, texts, max_len: int) -> float:
+    total, count = 0.0, 0
+    for t in texts:
+        ids = tokenizer(t, return_tensors="pt", truncation=True, max_length=max_len).to(model.device)
+        n = ids["input_ids"].shape[-1] - 1
+        if n < 1:
+            continue
+        total += float(model(**ids, labels=ids["input_ids"]).loss) * n
+        count += n
+    return total / max(1, count)
+
+
+@torch.inference_mode()
+def greedy(model, tokenizer, prompts, max_new_tokens: int):
+    outs = []
+    for prompt in prompts:
+        ids = tokenizer(prompt, return_tensors="pt").to(model.device)
+        out = model.generate(**ids, max_new_tokens=max_new_tokens, do_sample=False, pad_token_id=tokenizer.pad_token_id)
+        outs.append(out[0, ids["input_ids"].shape[-1]:].tolist())
+    return outs
+
+
+def main():
+    p = argparse.ArgumentParser(description="Shrink a trained LoRA adapter by per-module SVD rank reduction.")
+    p.add_argument("--adapter", type=str, default="", help="Default: the chapter's adapter from chapters.py.")
+    p.add_argument("--chapter", type=str, default="", choices=[""] + list(CHAPTERS))
+    p.add_argument("--out", type=str, default="", help="Default: <adapter>_svd")
+    mode = p.add_mutually_exclusive_group()
+    mode.add_argument("--energy", type=float, default=None,
+                      help="Keep the smallest rank holding this fraction of each module's squared singular values.")
+    mode.add_argument("--budget", type=float, default=None,
+                      help="Keep this fraction of the total rank, spent where the singular values are largest.")
+    p.add_argument("--base_model", type=str, default="Qwen/Qwen2.5-7B-Instruct")
+    p.add_argument("--device", type=str, default="cuda", choices=["cuda", "cpu"])
+    p.add_argument("--quant", type=str, default="nf4", choices=["nf4", "none"])
+    p.add_argument("--eval_file", type=str, default="",
+                   help="Held-out processed JSONL (\"text\" field) the adapter was not trained on. Without it the "
+                        "loss is taken on the tail of data/<chapter>/processed/train.jsonl and reported as "
+                        "train_tail_loss: a fit check, not a validation loss.")
+    p.add_argument("--eval_n", type=int, default=32, help="Records from the end of the eval file (0 skips evaluation).")
+    p.add_argument("--max_len", type=int, default=1024)
+    p.add_argument("--max_new_tokens", type=int, default=64)
+    args = p.parse_args()
+
+    if not args.adapter and not args.chapter:
+        p.error("give --adapter or --chapter")
+    if args.energy is None and args.budget is None:
+        args.energy = 0.9
+    if args.device == "cuda" and not torch.cuda.is_available():
+        raise RuntimeError("CUDA not available but --device=cuda was set.")
+
+    adapter = args.adapter or CHAPTERS[args.chapter]["adapter"]
+    out = Path(args.out) if args.out else Path(adapter.rstrip("/") + "_svd")
+    t0 = time.perf_counter()
+    report = {"adapter": adapter, "out": str(out), "energy": args.energy, "budget": args.budget}
+    report.update(reduce_adapter(adapter, out, energy=args.energy, budget_ratio=args.budget))
+    report["reduce_s"] = round(time.perf_counter() - t0, 2)
+
+    if args.eval_n > 0:
+        tokenizer = load_tokenizer(args.base_model)
+        base = load_causal_lm(args.base_model, device=args.device, quant=args.quant)
+        model, load_s = None, {}
+        for name, path in (("original", adapter), ("reduced", str(out))):
+            t0 = time.perf_counter()
+            if model is None:
+                model = PeftModel.from_pretrained(base, path, adapter_name=name)
+            else:
+                model.load_adapter(path, adapter_name=name)
+            load_s[name] = round(time.perf_counter() - t0, 3)
+        model.eval()
+        report["adapter_load_s"] = load_s
+
+        train_file = f"data/{args.chapter}/processed/train.jsonl" if args.chapter else ""
+        eval_file = args.eval_file or train_file
+        held_out = bool(args.eval_file) and not (train_file and Path(eval_file).resolve() == Path(train_file).resolve())
+        loss_key = "eval_loss" if held_out else "train_tail_loss"
+        texts = eval_texts(eval_file, args.eval_n) if eval_file and Path(eval_file).exists() else []
+        prompts = sample_prompts(args.chapter, 4) if args.chapter else []
+        outs = {}
+        for name in ("original", "reduced"):
+            model.set_adapter(name)
+            if texts:
+                report.setdefault(loss_key, {})[name] = round(mean_loss(model, tokenizer, texts, args.max_len), 4)
+            if prompts:
+                outs[name] = greedy(model, tokenizer, prompts, args.max_new_tokens)
+        if texts:
+            loss = report[loss_key]
+            loss.update(delta=round(loss["reduced"] - loss["original"], 4), records=len(texts), file=eval_file)
+        else:
+            report[loss_key] = f"skipped: no eval file at {eval_file or '(none)'}"
+        if outs:
+            same = sum(int(a == b) for a, b in zip(outs["original"], outs["reduced"]))
+            report["greedy_identical"] = f"{same}/{len(prompts)}"
+
+    (out / "svd_report.json").write_text(json.dumps(report, indent=2), encoding="utf-8")
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,248 @@
+import time
+from collections import deque
+from typing import Callable, List, Optional
+
+import torch
+from transformers import DynamicCache
+
+
+def layer_kv(cache, layer: int):
+    """(keys, values) of one layer for DynamicCache across transformers versions or legacy tuples."""
+    if hasattr(cache, "layers"):
+        return cache.layers[layer].keys, cache.layers[layer].values
+    if hasattr(cache, "key_cache"):
+        return cache.key_cache[layer], cache.value_cache[layer]
+    return cache[layer][0], cache[layer][1]
+
+
+def num_layers(cache) -> int:
+    if hasattr(cache, "layers"):
+        return len(cache.layers)
+    if hasattr(cache, "key_cache"):
+        return len(cache.key_cache)
+    return len(cache)
+
+
+class SlotCache(DynamicCache):
+    """
+    Decode-step view over the scheduler's preallocated KV buffers, for the
+    running slots [0, n) and positions [0, lmax]. update() writes each row's
+    new key/value at that row's own length in place and returns views, so
+    nothing is gathered or concatenated per step.
+    """
+
+    def __init__(self, K, V, lens: torch.Tensor, lmax: int):
+        super().__init__()
+        self.K, self.V, self.lens, self.lmax = K, V, lens, lmax
+        self.rows = torch.arange(lens.shape[0], device=lens.device)
+        n = lens.shape[0]
+        for i in range(len(K)):
+            # registers the layer objects (mask/sliding metadata) without copying any positions
+            super().update(K[i][:n, :, :0], V[i][:n, :, :0], i)
+
+    def update(self, key_states, value_states, layer_idx, cache_kwargs=None):
+        n = self.lens.shape[0]
+        self.K[layer_idx][self.rows, :, self.lens] = key_states[:, :, -1]
+        self.V[layer_idx][self.rows, :, self.lens] = value_states[:, :, -1]
+        return self.K[layer_idx][:n, :, :self.lmax + 1], self.V[layer_idx][:n, :, :self.lmax + 1]
+
+    def get_seq_length(self, layer_idx: int = 0) -> int:
+        return self.lmax
+
+    def get_mask_sizes(self, query, layer_idx: int = 0):
+        q = query if isinstance(query, int) else query.shape[0]
+        return self.lmax + q, 0
+
+
+def crop_cache(cache, length: int):
+    """Drops cached positions beyond `length` (a negative crop() works on old and new transformers)."""
+    extra = cache.get_seq_length() - length
+    if extra > 0:
+        cache.crop(-extra)
+
+
+def sample_next(logits: torch.Tensor, temperature: float, top_p: float) -> int:
+    if temperature <= 0:
+        return int(logits.argmax(dim=-1))
+    probs = torch.softmax(logits.float() / temperature, dim=-1)
+    if top_p < 1.0:
+        sorted_p, sorted_i = probs.sort(descending=True)
+        keep = sorted_p.cumsum(dim=-1) - sorted_p < top_p
+        sorted_p = sorted_p * keep
+        return int(sorted_i[torch.multinomial(sorted_p / sorted_p.sum(), 1)])
+    return int(torch.multinomial(probs, 1))
+
+
+class Request:
+    def __init__(self, rid: int, prompt_ids: List[int], max_new_tokens: int, temperature: float,
+                 top_p: float, stop: Optional[Callable[[List[int]], bool]]):
+        self.rid = rid
+        self.prompt_ids = prompt_ids
+        self.max_new_tokens = max_new_tokens
+        self.temperature = temperature
+        self.top_p = top_p
+        self.stop = stop
+        self.output_ids: List[int] = []
+        self.slot = None
+        self.cache_len = 0
+        self.done = False
+        self.t_submit = time.perf_counter()
+        self.t_first = None
+        self.t_done = None
+
+    @property
+    def latency_s(self):
+        return None if self.t_done is None else self.t_done - self.t_submit
+
+
+class ContinuousBatcher:
+    """
+    Iteration-level scheduler over a plain HF causal LM (base or PeftModel).
+
+    Every call to step() first admits waiting requests into free KV slots
+    (prefilling each prompt once), then runs ONE decode forward for all
+    running sequences and retires the ones that finished (EOS, their own
+    max_new_tokens, or their stop callback). Short MCQ generations therefore
+    leave the batch as soon as they are done instead of waiting for the
+    longest solve in a static batch.
+
+    KV storage is a preallocated [slots, kv_heads, max_len, head_dim] buffer
+    per layer. Running requests always occupy slots [0, n): a retiring
+    request's slot is refilled by moving the last running one into it (one
+    copy per retirement), so each decode step attends over a view of the
+    buffer (SlotCache), masks each row's unused tail and writes the new
+    key/value in place at the row's length.
+    """
+
+    def __init__(self, model, tokenizer, max_slots: int = 16, max_len: int = 2048):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.max_slots = max_slots
+        self.max_len = max_len
+        self.eos_ids = self._eos_ids()
+        self.waiting: deque = deque()
+        self.running: List[Request] = []  # running[j].slot == j
+        self.K = None
+        self.V = None
+        self._next_id = 0
+        self.stats = {"steps": 0, "decode_tokens": 0, "prefill_tokens": 0, "busy_slot_steps": 0}
+
+    def _eos_ids(self):
+        ids = set()
+        cfg = getattr(self.model, "generation_config", None)
+        eos = getattr(cfg, "eos_token_id", None) if cfg is not None else None
+        if isinstance(eos, int):
+            ids.add(eos)
+        elif eos:
+            ids.update(eos)
+        if self.tokenizer.eos_token_id is not None:
+            ids.add(self.tokenizer.eos_token_id)
+        return ids
+
+    def submit(self, prompt: str, max_new_tokens: int = 350, temperature: float = 0.0,
+               top_p: float = 1.0, stop: Callable[[List[int]], bool] = None) -> Request:
+        if not 0 < max_new_tokens < self.max_len:
+            raise ValueError(f"max_new_tokens must be in [1, {self.max_len - 1}] for max_len={self.max_len}, "
+                             f"got {max_new_tokens}")
+        ids = self.tokenizer(prompt)["input_ids"]
+        ids = ids[-(self.max_len - max_new_tokens):]
+        req = Request(self._next_id, ids, max_new_tokens, temperature, top_p, stop)
+        self._next_id += 1
+        self.waiting.append(req)
+        return req
+
+    def _alloc(self, cache):
+        self.K, self.V = [], []
+        for i in range(num_layers(cache)):
+            k, v = layer_kv(cache, i)
+            shape = (self.max_slots, k.shape[1], self.max_len, k.shape[3])
+            self.K.append(torch.zeros(shape, dtype=k.dtype, device=k.device))
+            self.V.append(torch.zeros((self.max_slots, v.shape[1], self.max_len, v.shape[3]),
+                                      dtype=v.dtype, device=v.device))
+
+    def _finish_token(self, req: Request, token: int):
+        req.output_ids.append(token)
+        if req.t_first is None:
+            req.t_first = time.perf_counter()
+        if (token in self.eos_ids
+                or len(req.output_ids) >= req.max_new_tokens
+                or req.cache_len + 1 >= self.max_len
+                or (req.stop is not None and req.stop(req.output_ids))):
+            req.done = True
+            req.t_done = time.perf_counter()
+
+    @torch.inference_mode()
+    def _admit(self):
+        while self.waiting and len(self.running) < self.max_slots:
+            req = self.waiting.popleft()
+            req.slot = len(self.running)
+            ids = torch.tensor([req.prompt_ids], dtype=torch.long, device=self.model.device)
+            out = self.model(input_ids=ids, use_cache=True)
+            if self.K is None:
+                self._alloc(out.past_key_values)
+            n = ids.shape[1]
+            for i in range(len(self.K)):
+                k, v = layer_kv(out.past_key_values, i)
+                self.K[i][req.slot, :, :n] = k[0]
+                self.V[i][req.slot, :, :n] = v[0]
+            req.cache_len = n
+            self.stats["prefill_tokens"] += n
+            self._finish_token(req, sample_next(out.logits[0, -1], req.temperature, req.top_p))
+            self.running.append(req)
+
+    @torch.inference_mode()
+    def _decode(self):
+        batch = self.running  # retired just before, so every row is live and sits in slot j
+        if not batch:
+            return
+        device = self.model.device
+        lens = torch.tensor([r.cache_len for r in batch], dtype=torch.long, device=device)
+        lmax = int(lens.max())
+
+        past = SlotCache(self.K, self.V, lens, lmax)
+        # row j sees its own prefix [0, lens[j]) plus the token written at lens[j]
+        attn = (torch.arange(lmax + 1, device=device)[None, :] <= lens[:, None]).long()
+        input_ids = torch.tensor([[r.output_ids[-1]] for r in batch], dtype=torch.long, device=device)
+
+        out = self.model(input_ids=input_ids, attention_mask=attn, position_ids=lens[:, None],
+                         past_key_values=past, use_cache=True)
+
+        logits = out.logits[:, -1]
+        for j, req in enumerate(batch):
+            req.cache_len += 1
+            self._finish_token(req, sample_next(logits[j], req.temperature, req.top_p))
+        self.stats["decode_tokens"] += len(batch)
+        self.stats["busy_slot_steps"] += len(batch)
+
+    @torch.inference_mode()
+    def _retire(self) -> List[Request]:
+        finished = [r for r in self.running if r.done]
+        keep = [r for r in self.running if not r.done]
+        # compact: requests beyond the new running count move into the holes below it
+        holes = sorted(r.slot for r in finished if r.slot < len(keep))
+        movers = [r for r in keep if r.slot >= len(keep)]
+        for req, slot in zip(movers, holes):
+            n = req.cache_len
+            for i in range(len(self.K)):
+                self.K[i][slot, :, :n] = self.K[i][req.slot, :, :n]
+                self.V[i][slot, :, :n] = self.V[i][req.slot, :, :n]
+            req.slot = slot
+        self.running = sorted(keep, key=lambda r: r.slot)
+        return finished
+
+    def step(self) -> List[Request]:
+        """Admit, decode one token for every running sequence, retire. Returns finished requests."""
+        self._admit()
+        finished = self._retire()
+        self._decode()
+        self.stats["steps"] += 1
+        return finished + self._retire()
+
+    def run(self) -> List[Request]:
+        done = []
+        while self.waiting or self.running:
+            done += self.step()
+        return done
+
+    def text(self, req: Request) -> str:
+        return self.tokenizer.decode(req.output_ids, skip_special_tokens=True)
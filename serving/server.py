@@ -0,0 +1,324 @@
+import argparse
+import asyncio
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List
+
+import torch
+
+from chapters import CHAPTERS, DIFFICULTY_RANGE, ROUTER_ADAPTER, MAX_NEW_TOKENS, build_mcq_prompt, build_solve_prompt, extract_json
+from engine import InferenceEngine
+
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+           413: "Payload Too Large", 500: "Internal Server Error", 503: "Service Unavailable"}
+
+
+class QueueFull(Exception):
+    pass
+
+
+class HTTPError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+def max_new_tokens(body: dict, task: str) -> int:
+    """The request's token budget, an int in [1, MAX_NEW_TOKENS[task]] (400 otherwise)."""
+    value = body.get("max_new_tokens", MAX_NEW_TOKENS[task])
+    cap = MAX_NEW_TOKENS[task]
+    if isinstance(value, bool) or not isinstance(value, int) or not 1 <= value <= cap:
+        raise HTTPError(400, f"'max_new_tokens' must be an integer in [1, {cap}]")
+    return value
+
+
+def difficulty(body: dict, chapter: str) -> int:
+    """The request's difficulty, an int on the generators' scale (400 otherwise); the chapter default if absent."""
+    value = body.get("difficulty", CHAPTERS[chapter]["difficulty"])
+    lo, hi = DIFFICULTY_RANGE
+    if isinstance(value, bool) or not isinstance(value, int) or not lo <= value <= hi:
+        raise HTTPError(400, f"'difficulty' must be an integer in [{lo}, {hi}]")
+    return value
+
+
+class Batcher:
+    """
+    Dynamic batching in front of a blocking batch function.
+
+    Requests wait in a bounded queue; a worker takes the first one, keeps
+    collecting until max_batch_size items or max_wait_ms have passed, then
+    runs `fn(items)` on the model thread. A full queue rejects immediately
+    (the HTTP layer turns that into 503) instead of growing latency unbounded.
+    """
+
+    def __init__(self, name: str, fn: Callable[[List], List], executor, max_batch_size: int,
+                 max_wait_ms: float, max_queue: int):
+        self.name = name
+        self.fn = fn
+        self.executor = executor
+        self.max_batch_size = max_batch_size
+        self.max_wait_s = max_wait_ms / 1000
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue)
+        self.stats = {"requests": 0, "rejected": 0, "batches": 0, "batched_items": 0}
+
+    async def submit(self, item):
+        fut = asyncio.get_running_loop().create_future()
+        try:
+            self.queue.put_nowait((item, fut))
+        except asyncio.QueueFull:
+            self.stats["rejected"] += 1
+            raise QueueFull(self.name)
+        self.stats["requests"] += 1
+        return await fut
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.max_wait_s
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            items = [it for it, _ in batch]
+            self.stats["batches"] += 1
+            self.stats["batched_items"] += len(items)
+            try:
+                results = await loop.run_in_executor(self.executor, self.fn, items)
+            except Exception as e:
+                for _, fut in batch:
+                    if not fut.done():
+                        fut.set_exception(e)
+                continue
+            for (_, fut), res in zip(batch, results):
+                if not fut.done():
+                    fut.set_result(res)
+
+
+class InferenceServer:
+    def __init__(self, engine: InferenceEngine, max_batch_size: int, max_wait_ms: float,
+                 max_queue: int, do_sample: bool):
+        self.engine = engine
+        self.do_sample = do_sample
+        # the model is not thread-safe: every batch runs on this single thread
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.batchers = {
+            "route": Batcher("route", self._route_batch, self.executor,
+                             max_batch_size * 4, max_wait_ms, max_queue),
+            "generate_mcq": Batcher("generate_mcq", self._generate_batch("generate_mcq"), self.executor,
+                                    max_batch_size, max_wait_ms, max_queue),
+            "solve": Batcher("solve", self._generate_batch("solve"), self.executor,
+                             max_batch_size, max_wait_ms, max_queue),
+        }
+        self.started = time.time()
+        self.latency_ms = {k: [] for k in self.batchers}
+
+    def _route_batch(self, questions):
+        return [{"label": r["label"], "probs": r["probs"], "margin": r["margin"]}
+                for r in self.engine.route(questions, batch_size=len(questions))]
+
+    def _generate_batch(self, task: str):
+        def fn(items):
+            raws = self.engine.generate_mixed(
+                [it["chapter"] for it in items],
+                [it["prompt"] for it in items],
+                max_new_tokens=max(it["max_new_tokens"] for it in items),
+                do_sample=self.do_sample,
+                constrain=task if self.engine.constrained else None,
+            )
+            out = []
+            for it, raw in zip(items, raws):
+                parsed, err = extract_json(raw)
+                out.append({"task": task, "chapter": it["chapter"], "json": None if err else parsed,
+                            "error": err, "raw": raw})
+            return out
+        return fn
+
+    async def handle_route(self, body: dict):
+        if "questions" in body:
+            qs = body["questions"]
+            if not isinstance(qs, list) or not all(isinstance(q, str) for q in qs):
+                raise HTTPError(400, "'questions' must be a list of strings")
+            return {"results": await asyncio.gather(*(self.batchers["route"].submit(q) for q in qs))}
+        q = body.get("question")
+        if not isinstance(q, str) or not q.strip():
+            raise HTTPError(400, "'question' is required")
+        return await self.batchers["route"].submit(q)
+
+    async def handle_generate_mcq(self, body: dict):
+        chapter = body.get("chapter")
+        if chapter not in CHAPTERS:
+            raise HTTPError(400, f"'chapter' must be one of: {', '.join(CHAPTERS)}")
+        return await self.batchers["generate_mcq"].submit({
+            "chapter": chapter,
+            "prompt": build_mcq_prompt(chapter, difficulty(body, chapter)),
+            "max_new_tokens": max_new_tokens(body, "generate_mcq"),
+        })
+
+    async def handle_solve(self, body: dict):
+        q = body.get("question")
+        if not isinstance(q, str) or not q.strip():
+            raise HTTPError(400, "'question' is required")
+        chapter = body.get("chapter")
+        if chapter is not None and not isinstance(chapter, str):
+            raise HTTPError(400, "'chapter' must be a string")
+        budget = max_new_tokens(body, "solve")
+        route = None
+        if chapter is None:
+            route = await self.batchers["route"].submit(q)
+            chapter = route["label"]
+        # the adapter read overlaps with the wait in the solve queue
+        self.engine.prefetch(chapter)
+        if chapter not in CHAPTERS:
+            return {"task": "solve", "chapter": chapter, "route": route, "json": None,
+                    "error": "Question is outside the supported chapters.", "raw": ""}
+        res = await self.batchers["solve"].submit({
+            "chapter": chapter,
+            "prompt": build_solve_prompt(chapter, q),
+            "max_new_tokens": budget,
+        })
+        res["route"] = route
+        return res
+
+    def metrics(self):
+        out = {"uptime_s": round(time.time() - self.started, 1), "engine": self.engine.report()}
+        for name, b in self.batchers.items():
+            lat = sorted(self.latency_ms[name])
+            out[name] = dict(b.stats, queue=b.queue.qsize(),
+                             avg_batch=round(b.stats["batched_items"] / max(1, b.stats["batches"]), 2),
+                             p50_ms=round(lat[len(lat) // 2], 1) if lat else None)
+        return out
+
+    async def dispatch(self, method: str, path: str, body: bytes):
+        if path == "/health":
+            return 200, {"status": "ok"}
+        if path == "/metrics":
+            return 200, self.metrics()
+
+        handler = {"/route": self.handle_route, "/generate_mcq": self.handle_generate_mcq,
+                   "/solve": self.handle_solve}.get(path)
+        if handler is None:
+            return 404, {"error": f"no route for {path}"}
+        if method != "POST":
+            return 405, {"error": "use POST"}
+        try:
+            payload = json.loads(body or b"{}")
+        except json.JSONDecodeError as e:
+            return 400, {"error": f"invalid JSON body: {e}"}
+        if not isinstance(payload, dict):
+            return 400, {"error": "JSON body must be an object"}
+
+        t0 = time.perf_counter()
+        try:
+            res = await handler(payload)
+        except QueueFull as e:
+            return 503, {"error": f"{e} queue is full, retry later"}
+        except HTTPError as e:
+            return e.status, {"error": str(e)}
+        except Exception as e:
+            return 500, {"error": f"{type(e).__name__}: {e}"}
+        lat = self.latency_ms[path.lstrip("/")]
+        lat.append((time.perf_counter() - t0) * 1000)
+        del lat[:-10_000]
+        return 200, res
+
+    async def handle_conn(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Minimal HTTP/1.1 with keep-alive and Content-Length bodies."""
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    method, path, version = line.decode("latin-1").split()
+                except ValueError:
+                    break
+                headers = {}
+                while True:
+                    h = await reader.readline()
+                    if h in (b"\r\n", b"\n", b""):
+                        break
+                    k, _, v = h.decode("latin-1").partition(":")
+                    headers[k.strip().lower()] = v.strip()
+
+                length = int(headers.get("content-length", "0") or 0)
+                if length > 1 << 20:
+                    status, res = 413, {"error": "body too large"}
+                    body = b""
+                else:
+                    body = await reader.readexactly(length) if length else b""
+                    status, res = await self.dispatch(method.upper(), path.split("?")[0], body)
+
+                keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+                data = json.dumps(res, ensure_ascii=False).encode("utf-8")
+                writer.write(
+                    f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\n"
+                    "Content-Type: application/json\r\n"
+                    f"Content-Length: {len(data)}\r\n"
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode("latin-1")
+                    + data
+                )
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host: str, port: int):
+        workers = [asyncio.create_task(b.run()) for b in self.batchers.values()]
+        server = await asyncio.start_server(self.handle_conn, host, port)
+        print(f"Serving on http://{host}:{port}  (POST /route, /generate_mcq, /solve; GET /metrics)")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            for w in workers:
+                w.cancel()
+
+
+def main():
+    p = argparse.ArgumentParser(description="Asyncio HTTP inference server with dynamic batching.")
+    p.add_argument("--base_model", type=str, default="Qwen/Qwen2.5-7B-Instruct")
+    p.add_argument("--router_adapter", type=str, default=ROUTER_ADAPTER)
+    p.add_argument("--device", type=str, default="cuda", choices=["cuda", "cpu"])
+    p.add_argument("--quant", type=str, default="nf4", choices=["nf4", "none"])
+    p.add_argument("--host", type=str, default="127.0.0.1")
+    p.add_argument("--port", type=int, default=8080)
+    p.add_argument("--max_batch_size", type=int, default=8)
+    p.add_argument("--max_wait_ms", type=float, default=20.0)
+    p.add_argument("--max_queue", type=int, default=256)
+    p.add_argument("--greedy", action="store_true", help="Greedy decoding instead of sampling.")
+    p.add_argument("--constrained", action="store_true", help="Schema-constrained JSON decoding.")
+    p.add_argument("--draft_model", type=str, default="", help="Same-tokenizer draft for speculative decoding.")
+    p.add_argument("--draft_adapter_root", type=str, default="", help="Per-chapter draft LoRAs: <root>/<adapter name>.")
+    p.add_argument("--prompt_lookup", type=int, default=0, help="Prompt-lookup drafting with this many tokens (no draft model).")
+    p.add_argument("--device_adapter_mb", type=float, default=0.0,
+                   help="Device budget for chapter adapters; 0 keeps all of them loaded.")
+    p.add_argument("--cpu_adapter_mb", type=float, default=2048.0, help="CPU RAM budget for warm adapters.")
+    args = p.parse_args()
+
+    if args.device == "cuda" and not torch.cuda.is_available():
+        raise RuntimeError("CUDA not available but --device=cuda was set.")
+
+    engine = InferenceEngine(args.base_model, args.router_adapter, device=args.device, quant=args.quant,
+                             constrained=args.constrained, draft_model=args.draft_model,
+                             draft_adapter_root=args.draft_adapter_root, prompt_lookup=args.prompt_lookup,
+                             device_adapter_mb=args.device_adapter_mb, cpu_adapter_mb=args.cpu_adapter_mb)
+    server = InferenceServer(engine, args.max_batch_size, args.max_wait_ms, args.max_queue,
+                             do_sample=not args.greedy)
+    try:
+        asyncio.run(server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
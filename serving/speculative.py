@@ -0,0 +1,244 @@
+import copy
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, List, Optional
+
+import torch
+from peft import PeftModel
+
+from loader import load_base
+from scheduler import crop_cache
+
+
+def check_same_vocab(target_tokenizer, draft_tokenizer):
+    """Speculative decoding compares token ids directly, so both models must share one vocabulary."""
+    if len(target_tokenizer) != len(draft_tokenizer) or target_tokenizer.get_vocab() != draft_tokenizer.get_vocab():
+        raise ValueError("Draft model tokenizer does not match the target tokenizer.")
+
+
+def generation_eos_ids(model, tokenizer) -> set:
+    """The ids plain generate() stops on: generation_config.eos_token_id (Qwen2.5-Instruct lists two)."""
+    eos = model.generation_config.eos_token_id
+    if eos is None:
+        return {tokenizer.eos_token_id}
+    return set(eos) if isinstance(eos, (list, tuple)) else {eos}
+
+
+def greedy_processors(model, prompt_len: int, device):
+    """
+    The logits processors generate(do_sample=False) applies for this model's
+    generation_config (e.g. Qwen2.5-Instruct's repetition_penalty=1.05);
+    sampling warpers are left out, as plain greedy leaves them out.
+    """
+    config = copy.deepcopy(model.generation_config)
+    config.do_sample = False
+    return model._get_logits_processor(generation_config=config, input_ids_seq_length=prompt_len, device=device)
+
+
+class DraftModel:
+    """
+    Small same-tokenizer model used to propose tokens. Optional per-chapter
+    draft LoRAs are looked up as <adapter_root>/<chapter adapter dir name>
+    (e.g. adapters/draft/probability_v1) and switched like the target's.
+    """
+
+    def __init__(self, draft_model: str, target_tokenizer, device: str = "cuda", quant: str = "none",
+                 adapter_root: str = "", chapters: dict = None):
+        self.model, tokenizer = load_base(draft_model, device=device, quant=quant)
+        check_same_vocab(target_tokenizer, tokenizer)
+        self.adapters = []
+        if adapter_root and chapters:
+            for name, c in chapters.items():
+                path = Path(adapter_root) / Path(c["adapter"]).name
+                if not path.exists():
+                    continue
+                if not isinstance(self.model, PeftModel):
+                    self.model = PeftModel.from_pretrained(self.model, str(path), adapter_name=name)
+                else:
+                    self.model.load_adapter(str(path), adapter_name=name)
+                self.adapters.append(name)
+            self.model.eval()
+
+    @contextmanager
+    def use(self, name: str):
+        if name in self.adapters:
+            self.model.set_adapter(name)
+            yield self.model
+        elif isinstance(self.model, PeftModel):
+            with self.model.disable_adapter():
+                yield self.model
+        else:
+            yield self.model
+
+
+class ModelDrafter:
+    """Proposes k tokens greedily with a small draft model, keeping its own KV cache."""
+
+    def __init__(self, model):
+        self.model = model
+        self.past = None
+        self.cached = 0
+
+    def reset(self):
+        self.past = None
+        self.cached = 0
+
+    def propose(self, seq: List[int], k: int) -> List[int]:
+        device = self.model.device
+        feed = torch.tensor([seq[self.cached:]], dtype=torch.long, device=device)
+        proposal = []
+        for _ in range(k):
+            out = self.model(input_ids=feed, past_key_values=self.past, use_cache=True)
+            self.past = out.past_key_values
+            tok = int(out.logits[0, -1].argmax())
+            proposal.append(tok)
+            feed = torch.tensor([[tok]], dtype=torch.long, device=device)
+        self.cached = len(seq) + k - 1
+        return proposal
+
+    def rollback(self, committed: int):
+        """Keeps only cache entries for the first `committed` tokens."""
+        self.cached = min(self.cached, committed)
+        crop_cache(self.past, self.cached)
+
+
+class PromptLookupDrafter:
+    """
+    Draft-free proposals: finds the most recent earlier occurrence of the
+    last n tokens (n = max_ngram down to min_ngram) in prompt + output and
+    proposes the tokens that followed it. Outputs that copy the question,
+    amounts and formulas from the prompt get long accepted runs.
+    """
+
+    def __init__(self, max_ngram: int = 3, min_ngram: int = 1):
+        self.max_ngram = max_ngram
+        self.min_ngram = min_ngram
+
+    def reset(self):
+        pass
+
+    def propose(self, seq: List[int], k: int) -> List[int]:
+        for n in range(self.max_ngram, self.min_ngram - 1, -1):
+            if len(seq) <= n:
+                continue
+            tail = seq[-n:]
+            for start in range(len(seq) - n - 1, -1, -1):
+                if seq[start:start + n] == tail:
+                    return seq[start + n:start + n + k]
+        return []
+
+    def rollback(self, committed: int):
+        pass
+
+
+class SpeculativeDecoder:
+    """
+    Greedy draft-then-verify decoding for one sequence.
+
+    Each round the drafter proposes up to `k` tokens, the target scores
+    [last token, d1..dk] in a single forward, and the longest prefix where
+    the proposal matches the target's argmax is kept plus the target's own
+    next token. The argmax is taken after the target's generation_config
+    logits processors (repetition penalty and the like), each applied to the
+    sequence as it stands at that position, and `eos_ids` should be
+    generation_eos_ids(): with both, every kept token is the one plain greedy
+    generate() would pick and the output is identical; only the number of
+    target forwards changes. KV caches are cropped back to the committed
+    length. An empty proposal degrades to one ordinary decode step.
+    """
+
+    def __init__(self, target, drafter, eos_ids, k: int = 4):
+        self.target = target
+        self.drafter = drafter
+        self.eos_ids = set(eos_ids)
+        self.k = k
+        self.stats = {"rounds": 0, "proposed": 0, "accepted": 0, "target_forwards": 0, "new_tokens": 0}
+
+    @property
+    def acceptance_rate(self) -> float:
+        return self.stats["accepted"] / max(1, self.stats["proposed"])
+
+    @torch.inference_mode()
+    def generate(self, input_ids: torch.Tensor, max_new_tokens: int,
+                 stop: Optional[Callable[[List[int]], bool]] = None, streamer=None) -> List[int]:
+        """
+        input_ids: [1, prompt_len]. Returns the new token ids (EOS included when produced).
+        `streamer` gets the prompt, then each round's accepted tokens, like HF generate(streamer=).
+        """
+        device = input_ids.device
+        if streamer is not None:
+            streamer.put(input_ids.cpu())
+        t_out = self.target(input_ids=input_ids, use_cache=True)
+        t_past = t_out.past_key_values
+        self.stats["target_forwards"] += 1
+        self.drafter.reset()
+        seq = input_ids[0].tolist()
+        prompt_len = len(seq)
+        processors = greedy_processors(self.target, prompt_len, device)
+        seq.append(self._pick(processors, seq, t_out.logits[0, -1:], device))
+        emitted = prompt_len
+
+        finished = self._finished(seq, prompt_len, 1, max_new_tokens, stop)
+        emitted = self._stream(streamer, seq, emitted)
+        if not finished:
+            while True:
+                k = min(self.k, max_new_tokens - (len(seq) - prompt_len))
+                proposal = self.drafter.propose(seq, k)
+
+                # target: verify all proposals in one forward
+                verify = torch.tensor([[seq[-1]] + proposal], dtype=torch.long, device=device)
+                t_out = self.target(input_ids=verify, past_key_values=t_past, use_cache=True)
+                t_past = t_out.past_key_values
+                self.stats["target_forwards"] += 1
+
+                n = 0
+                while True:
+                    pred = self._pick(processors, seq + proposal[:n], t_out.logits[0, n:n + 1], device)
+                    if n == len(proposal) or proposal[n] != pred:
+                        accepted = proposal[:n] + [pred]
+                        break
+                    n += 1
+                seq.extend(accepted)
+                self.stats["rounds"] += 1
+                self.stats["proposed"] += len(proposal)
+                self.stats["accepted"] += n
+
+                finished = self._finished(seq, prompt_len, len(accepted), max_new_tokens, stop)
+                emitted = self._stream(streamer, seq, emitted)
+                if finished:
+                    break
+                crop_cache(t_past, len(seq) - 1)
+                self.drafter.rollback(len(seq) - 1)
+
+        new = seq[prompt_len:]
+        self.stats["new_tokens"] += len(new)
+        if streamer is not None:
+            streamer.end()
+        return new
+
+    @staticmethod
+    def _pick(processors, seq: List[int], logits: torch.Tensor, device) -> int:
+        """Greedy choice after `seq` from that position's logits [1, vocab], processed as generate() would."""
+        ids = torch.tensor([seq], dtype=torch.long, device=device)
+        return int(processors(ids, logits.float()).argmax())
+
+    @staticmethod
+    def _stream(streamer, seq: List[int], emitted: int) -> int:
+        if streamer is not None and len(seq) > emitted:
+            streamer.put(torch.tensor(seq[emitted:], dtype=torch.long))
+        return len(seq)
+
+    def _finished(self, seq: List[int], prompt_len: int, added: int, max_new_tokens: int, stop) -> bool:
+        """Checks the `added` newest tokens in order; truncates `seq` at the first one that ends generation."""
+        n = len(seq) - prompt_len
+        for i in range(n - added + 1, n + 1):
+            if (seq[prompt_len + i - 1] in self.eos_ids or i >= max_new_tokens
+                    or (stop is not None and stop(seq[prompt_len:prompt_len + i]))):
+                del seq[prompt_len + i:]
+                return True
+        return False
+
+
+def load_draft(draft_model: str, target_tokenizer, device: str = "cuda"):
+    """Plain draft model for HF assisted generation (`generate(..., assistant_model=draft)`)."""
+    return DraftModel(draft_model, target_tokenizer, device=device).model
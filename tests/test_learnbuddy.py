@@ -0,0 +1,30 @@
+import importlib.util
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parents[1]
+LIGHT = ["generate", "prepare", "download", "test"]
+MODEL = ["route", "train", "serve", "bench", "export"]
+
+
+def selfcheck(commands):
+    proc = subprocess.run([sys.executable, str(ROOT / "learnbuddy.py"), "selfcheck", *commands, "--json"],
+                          cwd=ROOT, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    rows = json.loads(proc.stdout)
+    over = [r for r in rows if not r.get("ok", not r["heavy"])]
+    return proc.returncode, over
+
+
+def test_light_commands_within_import_budget():
+    code, over = selfcheck(LIGHT)
+    assert code == 0, json.dumps(over, indent=2)
+
+
+@pytest.mark.skipif(importlib.util.find_spec("torch") is None, reason="model targets import torch")
+def test_model_commands_within_import_budget():
+    code, over = selfcheck(MODEL)
+    assert code == 0, json.dumps(over, indent=2)
@@ -0,0 +1,55 @@
+import asyncio
+import json
+
+import pytest
+
+pytest.importorskip("torch")
+
+
+@pytest.fixture(scope="module")
+def engine(tiny_models):
+    from chapters import CHAPTERS
+    from engine import InferenceEngine
+
+    # no adapters on disk: the router and every chapter run on the bare tiny base
+    chapters = {name: dict(c, adapter="") for name, c in CHAPTERS.items()}
+    return InferenceEngine(str(tiny_models[0]), router_adapter="", chapters=chapters, device="cpu", quant="none")
+
+
+def post(engine, *calls):
+    """Runs the (path, body) calls through a fresh InferenceServer and returns their (status, payload)."""
+    from server import InferenceServer
+
+    async def go():
+        server = InferenceServer(engine, max_batch_size=4, max_wait_ms=5, max_queue=8, do_sample=False)
+        workers = [asyncio.create_task(b.run()) for b in server.batchers.values()]
+        try:
+            return [await server.dispatch("POST", path, json.dumps(body).encode("utf-8")) for path, body in calls]
+        finally:
+            for w in workers:
+                w.cancel()
+    return asyncio.run(go())
+
+
+def test_generate_mcq_difficulty(engine):
+    base = {"chapter": "probability", "max_new_tokens": 8}
+    ok = post(engine, ("/generate_mcq", base), ("/generate_mcq", dict(base, difficulty=1)),
+              ("/generate_mcq", dict(base, difficulty=5)))
+    for status, res in ok:
+        assert status == 200, res
+        assert res["task"] == "generate_mcq" and res["chapter"] == "probability"
+    bad = post(engine, *[("/generate_mcq", dict(base, difficulty=d)) for d in (0, 6, "3", 2.5, True, None)])
+    for status, res in bad:
+        assert status == 400 and "'difficulty'" in res["error"], res
+
+
+def test_route_and_solve(engine):
+    (s_route, route), (s_solve, solve), (s_bad, bad) = post(
+        engine,
+        ("/route", {"question": "A die is rolled once. What is the probability of getting a six?"}),
+        ("/solve", {"question": "Find 15% of 8000.", "chapter": "arithmetic", "max_new_tokens": 8}),
+        ("/generate_mcq", {"chapter": "calculus"}),
+    )
+    assert s_route == 200 and "label" in route and "probs" in route
+    assert s_solve == 200 and solve["chapter"] == "arithmetic" and solve["route"] is None
+    assert s_bad == 400
@@ -0,0 +1,32 @@
+import pytest
+
+torch = pytest.importorskip("torch")
+
+PROMPTS = ["def main():\n    p = argparse.ArgumentParser(", "import random\nfrom fractions import",
+           "return json.dumps(", "class Question:\n    def"]
+
+
+def plain_greedy(model, ids, max_new_tokens, eos_ids):
+    out = model.generate(ids, max_new_tokens=max_new_tokens, do_sample=False)[0, ids.shape[-1]:].tolist()
+    end = next((i for i, t in enumerate(out) if t in eos_ids), None)
+    return out if end is None else out[:end + 1]
+
+
+@pytest.mark.parametrize("drafter", ["lookup", "model"])
+def test_speculative_matches_plain_greedy(tiny_models, drafter):
+    from transformers import AutoModelForCausalLM, AutoTokenizer
+    from speculative import ModelDrafter, PromptLookupDrafter, SpeculativeDecoder, generation_eos_ids
+
+    base, draft = tiny_models
+    tokenizer = AutoTokenizer.from_pretrained(base)
+    model = AutoModelForCausalLM.from_pretrained(base).eval()
+    eos = generation_eos_ids(model, tokenizer)
+    assert len(eos) == 2 and model.generation_config.repetition_penalty != 1.0
+    make = (lambda: PromptLookupDrafter()) if drafter == "lookup" else (
+        lambda: ModelDrafter(AutoModelForCausalLM.from_pretrained(draft).eval()))
+    for text in PROMPTS:
+        ids = tokenizer(text, return_tensors="pt")["input_ids"]
+        with torch.no_grad():
+            expected = plain_greedy(model, ids, 48, eos)
+            got = SpeculativeDecoder(model, make(), eos, k=4).generate(ids, 48)
+        assert got == expected, text